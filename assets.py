@@ -0,0 +1,158 @@
+"""
+Static asset pipeline.
+
+``python assets.py build`` copies every file under ``static/et`` to
+``static/build`` with a content hash in its name, writes gzip and (when the
+optional ``brotli`` package is installed) brotli variants next to each text
+file, and records the original -> fingerprinted names in
+``static/build/manifest.json``. Templates link assets with
+``asset_url('et/css/base.css')``; until a build exists it falls back to the
+plain file. ``PrecompressedStaticFiles`` serves the variant matching the
+client's ``Accept-Encoding`` and marks fingerprinted files immutable.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional, gzip alone is still served
+    brotli = None
+
+STATIC_DIR = "static"
+SOURCE_DIR = "et"
+BUILD_DIR = "build"
+MANIFEST = os.path.join(STATIC_DIR, BUILD_DIR, "manifest.json")
+COMPRESSIBLE = (".css", ".js", ".svg", ".html", ".json", ".txt", ".map")
+IMMUTABLE = "public, max-age=31536000, immutable"
+# preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_manifest = None
+
+
+def fingerprinted_name(relative_path: str, content: bytes) -> str:
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _write_variants(path: str, content: bytes):
+    if not path.endswith(COMPRESSIBLE):
+        return
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+
+
+def build(static_dir: str = STATIC_DIR) -> dict:
+    """Rebuild ``static/build`` from ``static/et`` and return the manifest."""
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    manifest = {}
+    source_root = os.path.join(static_dir, SOURCE_DIR)
+    for dirpath, _, filenames in os.walk(source_root):
+        for filename in sorted(filenames):
+            source = os.path.join(dirpath, filename)
+            relative = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                content = f.read()
+            target = f"{BUILD_DIR}/{fingerprinted_name(relative, content)}"
+            target_path = os.path.join(static_dir, *target.split("/"))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, "wb") as f:
+                f.write(content)
+            _write_variants(target_path, content)
+            manifest[relative] = target
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def asset_url(path: str) -> str:
+    """URL of a static asset, fingerprinted when ``assets.py build`` has run."""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {}
+    path = path.lstrip("/")
+    return f"/{STATIC_DIR}/{_manifest.get(path, path)}"
+
+
+def accepted_encodings(header: str) -> list:
+    """
+    The ``ENCODINGS`` entries the ``Accept-Encoding`` header allows, best
+    first: by q-value, then in ``ENCODINGS`` order. ``q=0`` refuses an
+    encoding, ``*`` stands for those not named.
+    """
+    weights = {}
+    for item in header.split(","):
+        token, *params = item.strip().split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+    ranked = []
+    for order, (encoding, suffix) in enumerate(ENCODINGS):
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > 0:
+            ranked.append((-q, order, encoding, suffix))
+    return [(encoding, suffix) for _, _, encoding, suffix in sorted(ranked)]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that prefers ``.br`` / ``.gz`` siblings written by :func:`build`."""
+
+    async def get_response(self, path: str, scope):
+        response = None
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for encoding, suffix in accepted:
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + suffix
+            )
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                response = FileResponse(
+                    full_path,
+                    stat_result=stat_result,
+                    media_type=guess_type(path)[0] or "text/plain",
+                    headers={"Content-Encoding": encoding},
+                )
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code == 200 and path.startswith(BUILD_DIR + os.sep):
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        raise SystemExit("usage: python assets.py build")
+    built = build()
+    print(f"built {len(built)} assets into {os.path.join(STATIC_DIR, BUILD_DIR)}"
+          + ("" if brotli is not None else " (brotli not installed, gzip only)"))
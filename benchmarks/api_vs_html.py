@@ -0,0 +1,88 @@
+"""
+Latency and payload size of the JSON API against the HTML page for the same data.
+
+Start the server, then point this at a user with a card that has transactions:
+
+    uvicorn main:app --port 8000
+    python -m benchmarks.api_vs_html --base-url http://localhost:8000 \
+        --username bench --password bench --card 1
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.concurrency import login
+
+
+async def measure(client: httpx.AsyncClient, path: str, iterations: int, headers=None):
+    latencies = []
+    sizes = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = await client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f"GET {path} returned {response.status_code}")
+        sizes.append(len(response.content))
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+        "bytes": statistics.mean(sizes),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--card", type=int, required=True)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        await login(client, args.username, args.password)
+        token = (
+            await client.post(
+                "/api/v1/token", data={"username": args.username, "password": args.password}
+            )
+        ).json()["access_token"]
+        bearer = {"Authorization": f"Bearer {token}"}
+        pairs = [
+            ("cards", "/cards", "/api/v1/cards"),
+            (
+                "transactions",
+                f"/transactions/card/{args.card}?limit={args.limit}",
+                f"/api/v1/cards/{args.card}/incomes?limit={args.limit}",
+            ),
+        ]
+
+        print(f"{'page':>14} {'kind':>5} {'p50 ms':>8} {'p99 ms':>8} {'bytes':>9}")
+        for name, html_path, api_path in pairs:
+            html = await measure(client, html_path, args.iterations)
+            client.cookies.clear()
+            api = await measure(client, api_path, args.iterations, headers=bearer)
+            if name == "transactions":
+                # the page shows incomes and expenses, so fetch both from the API
+                expenses = await measure(
+                    client,
+                    f"/api/v1/cards/{args.card}/expenses?limit={args.limit}",
+                    args.iterations,
+                    headers=bearer,
+                )
+                api = {key: api[key] + expenses[key] for key in api}
+            await login(client, args.username, args.password)
+            for kind, result in (("html", html), ("json", api)):
+                print(
+                    f"{name:>14} {kind:>5} {result['p50_ms']:>8.2f} "
+                    f"{result['p99_ms']:>8.2f} {result['bytes']:>9.0f}"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
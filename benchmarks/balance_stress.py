@@ -0,0 +1,164 @@
+"""
+Fire thousands of concurrent income/expense writes at a few cards and check
+the final balances are exact and no writer deadlocked.
+
+Every writer goes through the same ledger calls as the transaction handlers
+(``create_income``, ``create_expense``, ``update_expense``) in one database
+transaction, so the card, rollup and budget total rows are all contended the
+way they are in production. The cards share one owner and budgets, so
+expenses on different cards still meet on the budget totals. Amounts are
+whole numbers so the expected totals are exact in floating point.
+
+    python -m benchmarks.balance_stress --url postgresql+asyncpg://et:et@localhost/et_bench
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, exc, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import ledger
+import models
+
+IMPORTANCE = models.IMPORTANCE[:2]
+
+
+def setup(sync_url: str, cards: int):
+    engine = create_engine(sync_url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        user = models.Users(username="stress", email="stress@example.com", is_active=True)
+        db.add(user)
+        db.flush()
+        income_type = models.IncomeTypes(name="salary", owner_id=user.id)
+        expense_types = [models.ExpenseTypes(name=name, owner_id=user.id) for name in ("rent", "food")]
+        accounts = [
+            models.Accounts(name=f"stress {n}", balance=0, owner_id=user.id, is_active=True,
+                            modified_at=datetime.now())
+            for n in range(cards)
+        ]
+        db.add_all([income_type, *expense_types, *accounts])
+        db.flush()
+        # one budget per expense type and per importance, so every expense moves two totals
+        db.add_all(
+            [models.Budgets(t_type=t.id, amount=10000, owner_id=user.id, is_active=True,
+                            created_at=datetime.now()) for t in expense_types]
+            + [models.Budgets(importance=level, amount=10000, owner_id=user.id, is_active=True,
+                              created_at=datetime.now()) for level in IMPORTANCE]
+        )
+        db.commit()
+        return user.id, [a.id for a in accounts], income_type.id, [t.id for t in expense_types]
+
+
+def is_deadlock(error: exc.DBAPIError) -> bool:
+    return "deadlock" in str(error.orig).lower()
+
+
+class Run:
+    def __init__(self, Session, ids):
+        self.Session = Session
+        self.owner_id, self.accounts, self.income_type, self.expense_types = ids
+        self.expected = {account_id: 0.0 for account_id in self.accounts}
+        # (account_id, id, created_at, amount) of committed expenses
+        self.expenses = []
+        self.deadlocks = 0
+
+    async def _commit(self, write):
+        async with self.Session() as db:
+            try:
+                result = await write(db)
+                await db.commit()
+            except exc.DBAPIError as error:
+                if not is_deadlock(error):
+                    raise
+                self.deadlocks += 1
+                return None
+        return result
+
+    async def create(self, amount: int):
+        account_id = random.choice(self.accounts)
+        if amount >= 0:
+            async def write(db):
+                return await ledger.create_income(
+                    db, self.owner_id, account_id, self.income_type, amount, "stress"
+                )
+        else:
+            async def write(db):
+                return await ledger.create_expense(
+                    db, self.owner_id, account_id, random.choice(self.expense_types),
+                    -amount, "stress", random.choice(IMPORTANCE),
+                )
+        row = await self._commit(write)
+        if row is None:
+            return
+        self.expected[account_id] += amount
+        if amount < 0:
+            self.expenses.append((account_id, row.id, row.created_at, -amount))
+
+    async def update(self, expense):
+        account_id, expense_id, created_at, old_amount = expense
+        amount = random.randint(1, 500)
+
+        async def write(db):
+            return await ledger.update_expense(
+                db, self.owner_id, account_id, expense_id, random.choice(self.expense_types),
+                amount, "stress", random.choice(IMPORTANCE), created_at,
+            )
+        if await self._commit(write) is not None:
+            self.expected[account_id] += old_amount - amount
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True, help="throwaway postgresql+asyncpg database")
+    parser.add_argument("--writes", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--cards", type=int, default=3)
+    args = parser.parse_args()
+
+    async_engine = create_async_engine(args.url, pool_size=args.concurrency, max_overflow=0)
+    ids = setup(async_engine.url.set(drivername="postgresql").render_as_string(hide_password=False),
+                args.cards)
+    Session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+    run = Run(Session, ids)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(job):
+        async with semaphore:
+            await job
+
+    # half the writes create rows, the other half mixes creates with edits of those rows
+    creates = args.writes // 2
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(run.create(random.randint(-500, 500))) for _ in range(creates)))
+    edits = random.sample(run.expenses, min(len(run.expenses), (args.writes - creates) // 2))
+    jobs = [run.update(expense) for expense in edits]
+    jobs += [run.create(random.randint(-500, 500)) for _ in range(args.writes - creates - len(edits))]
+    random.shuffle(jobs)
+    await asyncio.gather(*(limited(job) for job in jobs))
+    elapsed = time.perf_counter() - started
+
+    async with Session() as db:
+        balances = dict(
+            (await db.execute(
+                select(models.Accounts.id, models.Accounts.balance)
+                .where(models.Accounts.id.in_(run.accounts))
+            )).all()
+        )
+    exact = all(balances[account_id] == run.expected[account_id] for account_id in run.accounts)
+    print(f"{args.writes} writes ({len(edits)} edits) in {elapsed:.2f}s ({args.writes / elapsed:.0f}/s) "
+          f"at concurrency {args.concurrency} over {args.cards} cards")
+    for account_id in run.accounts:
+        print(f"card {account_id}: final balance {balances[account_id]}, expected {run.expected[account_id]}")
+    print(f"balances {'OK' if exact else 'MISMATCH'}, {run.deadlocks} deadlocks")
+    await async_engine.dispose()
+    raise SystemExit(0 if exact and not run.deadlocks else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
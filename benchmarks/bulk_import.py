@@ -0,0 +1,75 @@
+"""
+Rows/sec and peak memory of a statement import.
+
+Generates a CSV with ``--rows`` rows (1M by default) and streams it through
+importer.import_transactions into a fresh card on a throwaway database.
+
+    python -m benchmarks.bulk_import --url postgresql+asyncpg://et:et@localhost/et_bench
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import date, timedelta
+
+import aiofiles
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.balance_stress import setup
+from importer import ImportMapping, import_transactions
+
+
+def write_statement(path: str, rows: int):
+    start = date(2015, 1, 1)
+    with open(path, "w") as out:
+        out.write("date,amount,description\n")
+        for n in range(rows):
+            day = start + timedelta(days=n % 3000)
+            amount = random.randint(-50000, 50000) / 100
+            out.write(f'{day.isoformat()},{amount},"row {n}, imported"\n')
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True, help="throwaway postgresql+asyncpg database")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_async_engine(args.url)
+    owner_id, account_id, income_type, expense_type = setup(
+        engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    )
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.csv")
+        write_statement(path, args.rows)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        rss_before = peak_rss_mb()
+
+        mapping = ImportMapping(income_type=income_type, expense_type=expense_type)
+        started = time.perf_counter()
+        async with Session() as db, aiofiles.open(path, "rb") as upload:
+            result = await import_transactions(
+                db, upload, "csv", mapping, owner_id, account_id, batch_size=args.batch_size
+            )
+            await db.commit()
+        elapsed = time.perf_counter() - started
+
+    print(f"{result.rows} rows ({size_mb:.0f} MB) in {elapsed:.1f}s: {result.rows / elapsed:,.0f} rows/s")
+    print(f"peak RSS {peak_rss_mb():.0f} MB (was {rss_before:.0f} MB before the import)")
+    print(f"net {result.net:.2f}, card balance {result.balance:.2f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Requests/sec of a page at 1, 10 and 100 concurrent clients.
+
+Run it against a server started from each build you want to compare, e.g.
+
+    uvicorn main:app --port 8000
+    python -m benchmarks.concurrency --base-url http://localhost:8000 \
+        --username bench --password bench --path /transactions/card/1
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    response = await client.post("/auth/", data={"email": username, "password": password})
+    if "access_token" not in client.cookies:
+        raise SystemExit(f"login failed for {username!r} (status {response.status_code})")
+
+
+async def run_level(client: httpx.AsyncClient, path: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--path", default="/cards")
+    parser.add_argument("--levels", default="1,10,100")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        await login(client, args.username, args.password)
+        print(f"{'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+        for level in (int(value) for value in args.levels.split(",")):
+            result = await run_level(client, args.path, level, args.duration)
+            print(
+                f"{result['concurrency']:>8} {result['rps']:>10.1f} {result['p50_ms']:>10.1f} "
+                f"{result['p99_ms']:>10.1f} {result['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
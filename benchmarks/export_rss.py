@@ -0,0 +1,65 @@
+"""
+Export millions of rows and report throughput and peak RSS.
+
+Seeds a throwaway database with benchmarks.index_plans and drains
+exporter.export_transactions for one user across all of their cards.
+
+    python -m benchmarks.export_rss --url postgresql://et:et@localhost/et_bench --rows 2000000
+"""
+import argparse
+import asyncio
+import resource
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import exporter
+import models
+from benchmarks.index_plans import seed
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def drain(owner_id: int, file_format: str):
+    size = 0
+    async for chunk in exporter.export_transactions(owner_id, None, file_format):
+        size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True, help="throwaway Postgres database (sync driver)")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="rows per table")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        engine = create_engine(args.url)
+        models.Base.metadata.drop_all(bind=engine)
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            # a single user owning every card, so the export covers all rows
+            seed(conn, users=1, cards=3, rows=args.rows)
+
+    async_url = make_url(args.url).set(drivername="postgresql+asyncpg")
+    exporter.AsyncSessionLocal = sessionmaker(
+        create_async_engine(async_url), class_=AsyncSession, expire_on_commit=False
+    )
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    size = asyncio.run(drain(1, args.format))
+    elapsed = time.perf_counter() - started
+    print(f"exported {size / 1024 / 1024:.0f} MB of {args.format} in {elapsed:.1f}s")
+    print(f"peak RSS {peak_rss_mb():.0f} MB (was {rss_before:.0f} MB before exporting)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare query plans and timings of the list queries with and without the
+owner/account/is_active indexes from migration 0002.
+
+Point it at a throwaway Postgres database, it creates and seeds the schema:
+
+    python -m benchmarks.index_plans --url postgresql://et:et@localhost/et_bench
+"""
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+
+import models
+import partitions
+
+NEW_INDEX_NAMES = {
+    "ix_incomes_owner_account_created",
+    "ix_incomes_active_owner_account_created",
+    "ix_expenses_owner_account_created",
+    "ix_expenses_active_owner_account_created",
+    "ix_accounts_active_owner",
+    "ix_accounttypes_owner",
+    "ix_incometypes_owner",
+    "ix_expensetypes_owner",
+}
+NEW_INDEXES = [
+    index
+    for table in models.Base.metadata.sorted_tables
+    for index in table.indexes
+    if index.name in NEW_INDEX_NAMES
+]
+
+QUERIES = {
+    "income page": """
+        SELECT i.id, i.description, i.amount, i.created_at, t.name
+        FROM incomes i JOIN incometypes t ON t.id = i.t_type
+        WHERE i.account_id = :account_id AND i.owner_id = :owner_id AND i.is_active
+        ORDER BY i.created_at DESC, i.id DESC LIMIT 51
+    """,
+    "expense page": """
+        SELECT e.id, e.description, e.amount, e.importance, e.created_at, t.name
+        FROM expenses e JOIN expensetypes t ON t.id = e.t_type
+        WHERE e.account_id = :account_id AND e.owner_id = :owner_id AND e.is_active
+        ORDER BY e.created_at DESC, e.id DESC LIMIT 51
+    """,
+    "cards": "SELECT * FROM accounts WHERE owner_id = :owner_id AND is_active",
+    "income types": "SELECT * FROM incometypes WHERE owner_id = :owner_id",
+}
+
+SEED = [
+    """
+    INSERT INTO users (id, username, email, first_name, last_name, is_active)
+    SELECT u, 'user' || u, 'user' || u || '@example.com', 'first' || u, 'last' || u, true
+    FROM generate_series(1, :users) AS u
+    """,
+    """
+    INSERT INTO incometypes (id, name, owner_id, is_active)
+    SELECT u, 'salary', u, true FROM generate_series(1, :users) AS u
+    """,
+    """
+    INSERT INTO expensetypes (id, name, owner_id, is_active)
+    SELECT u, 'rent', u, true FROM generate_series(1, :users) AS u
+    """,
+    """
+    INSERT INTO accounts (id, name, balance, owner_id, is_active)
+    SELECT a, 'card' || a, 0, (a - 1) / :cards + 1, true
+    FROM generate_series(1, :users * :cards) AS a
+    """,
+]
+
+SEED_DAYS = 1000
+SEED_TRANSACTIONS = """
+    INSERT INTO {table} (amount, created_at, is_active, t_type, description, owner_id, account_id)
+    SELECT random() * 100,
+           now() - (n % {days}) * interval '1 day',
+           n % 10 <> 0,
+           a / :cards + 1,
+           'seeded',
+           a / :cards + 1,
+           a + 1
+    FROM generate_series(1, :rows) AS n, LATERAL (SELECT n % (:users * :cards) AS a) s
+"""
+
+
+def seed(conn, users: int, cards: int, rows: int):
+    params = {"users": users, "cards": cards, "rows": rows}
+    for statement in SEED:
+        conn.execute(text(statement), params)
+    # the rows go back SEED_DAYS days, create_all only made the recent months
+    partitions.ensure_partitions(conn, first=date.today() - timedelta(days=SEED_DAYS + 1))
+    for table in ("incomes", "expenses"):
+        conn.execute(text(SEED_TRANSACTIONS.format(table=table, days=SEED_DAYS)), params)
+    conn.execute(text("UPDATE expenses SET importance = 'Essential'"))
+
+
+def measure(conn, label: str, repeat: int):
+    params = {"owner_id": 1, "account_id": 1}
+    print(f"\n=== {label} ===")
+    for name, sql in QUERIES.items():
+        plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"), params)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(text(sql), params).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"\n-- {name}: median {statistics.median(timings):.2f} ms over {repeat} runs")
+        for (line,) in plan:
+            print(f"   {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True, help="throwaway Postgres database")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--cards", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows per table")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        for index in NEW_INDEXES:
+            index.drop(conn)
+        seed(conn, args.users, args.cards, args.rows)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+        measure(conn, "before: primary keys only", args.repeat)
+
+    with engine.begin() as conn:
+        for index in NEW_INDEXES:
+            index.create(conn)
+        conn.execute(text("ANALYZE"))
+        measure(conn, "after: migration 0002 indexes", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Drive a running server with simulated users and report p50/p95/p99 latency
+and throughput per operation.
+
+Seed a throwaway database with benchmarks.seed, start the app against it,
+then:
+
+    uvicorn main:app --port 8000
+    python -m benchmarks.load --base-url http://localhost:8000 --users 100 \
+        --clients 50 --duration 60 --json results.json
+
+Each client logs in as one of the seeded ``user<n>`` accounts with a cookie,
+like a browser, and then loops over the real pages: the card list, a card's
+transactions and adding, editing and deleting incomes. Keep the JSON output
+from each release to compare them.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.report import print_table, summarize, write_json
+
+MIX = {"cards": 20, "transactions": 50, "add income": 10, "edit income": 10, "delete income": 10}
+
+
+class Client:
+    def __init__(self, http: httpx.AsyncClient, rng: random.Random, stats, errors):
+        self.http = http
+        self.rng = rng
+        self.stats = stats
+        self.errors = errors
+        self.cards = []
+        self.income_types = []
+        self.created = []
+
+    async def timed(self, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.http.request(method, url, **kwargs)
+        self.stats[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    async def login(self, username: str, password: str):
+        await self.timed("login", "POST", "/auth/", data={"email": username, "password": password})
+        if "access_token" not in self.http.cookies:
+            raise SystemExit(f"login failed for {username!r}, was the database seeded with benchmarks.seed?")
+        self.cards = [card["id"] for card in (await self.http.get("/api/v1/cards")).json()["items"]]
+        self.income_types = [
+            row["id"] for row in (await self.http.get("/api/v1/custom-data/income-type")).json()["items"]
+        ]
+
+    async def step(self, operation: str):
+        card = self.rng.choice(self.cards)
+        base = f"/transactions/card/{card}"
+        if operation == "cards":
+            await self.timed(operation, "GET", "/cards")
+        elif operation == "transactions":
+            await self.timed(operation, "GET", base)
+        elif operation == "add income":
+            form = {"t_type": self.rng.choice(self.income_types), "amount": self.rng.randint(1, 100),
+                    "description": "load test"}
+            await self.timed(operation, "POST", f"{base}/add-income", data=form)
+            # not timed: find the new row's id for the edit/delete steps
+            newest = (await self.http.get(f"/api/v1/cards/{card}/incomes", params={"limit": 1})).json()
+            if newest["items"]:
+                self.created.append((card, newest["items"][0]["id"]))
+        elif operation == "edit income" and self.created:
+            card, income_id = self.rng.choice(self.created)
+            form = {"t_type": self.rng.choice(self.income_types), "amount": self.rng.randint(1, 100),
+                    "description": "load test, edited"}
+            await self.timed(operation, "POST", f"/transactions/card/{card}/edit-income/{income_id}", data=form)
+        elif operation == "delete income" and self.created:
+            card, income_id = self.created.pop(self.rng.randrange(len(self.created)))
+            await self.timed(operation, "GET", f"/transactions/card/{card}/delete-income/{income_id}")
+
+
+async def run(args):
+    stats = defaultdict(list)
+    errors = defaultdict(int)
+    operations, weights = zip(*MIX.items())
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async def worker(index: int):
+        rng = random.Random(args.seed + index)
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as http:
+            client = Client(http, rng, stats, errors)
+            await client.login(f"user{index % args.users + 1}", args.password)
+            await start.wait()
+            while time.perf_counter() < deadline:
+                await client.step(rng.choices(operations, weights)[0])
+
+    start = asyncio.Event()
+    deadline = float("inf")
+    tasks = [asyncio.create_task(worker(index)) for index in range(args.clients)]
+    # let every client log in before the clock starts
+    while len(stats["login"]) + errors["login"] < args.clients and not any(t.done() for t in tasks):
+        await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    # logins happen before the clock starts, so they get latencies but no rate
+    results = {"login": summarize(stats.pop("login"), 0, errors.pop("login", 0))}
+    for name in operations:
+        results[name] = summarize(stats[name], elapsed, errors[name])
+    everything = [latency for name in operations for latency in stats[name]]
+    results["all pages"] = summarize(everything, elapsed, sum(errors.values()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=100, help="seeded users to log in as")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table(results)
+    if args.json:
+        write_json(args.json, results, clients=args.clients, duration=args.duration, base_url=args.base_url)
+
+
+if __name__ == "__main__":
+    main()
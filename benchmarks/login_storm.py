@@ -0,0 +1,77 @@
+"""
+Latency of a regular page while a storm of logins is running.
+
+Each login costs a bcrypt verification. With hashing on the event loop the
+probe latency climbs with the storm; with the hashing pool it should stay flat
+and surplus logins are rejected with a "try again" page instead of queueing.
+
+    python -m benchmarks.login_storm --base-url http://localhost:8000 \
+        --username bench --password bench
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.concurrency import login
+
+
+async def probe(client: httpx.AsyncClient, path: str, duration: float):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.05)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+async def storm(base_url: str, username: str, password: str, clients: int, duration: float):
+    counts = {"ok": 0, "busy": 0}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    "/auth/", data={"email": username, "password": password}
+                )
+                counts["ok" if response.status_code == 302 else "busy"] += 1
+                client.cookies.clear()
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--probe-path", default="/cards")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent login clients")
+    parser.add_argument("--duration", type=float, default=15.0)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        await login(client, args.username, args.password)
+
+        p50, p99 = await probe(client, args.probe_path, args.duration)
+        print(f"idle:  {args.probe_path} p50 {p50:.1f} ms  p99 {p99:.1f} ms")
+
+        probe_task = asyncio.create_task(probe(client, args.probe_path, args.duration))
+        counts = await storm(
+            args.base_url, args.username, args.password, args.clients, args.duration
+        )
+        p50, p99 = await probe_task
+        rate = counts["ok"] / args.duration
+        print(f"storm: {args.probe_path} p50 {p50:.1f} ms  p99 {p99:.1f} ms")
+        print(f"       {rate:.1f} logins/s, {counts['busy']} rejected while the pool was full")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Fill a throwaway database with synthetic users, cards, custom types and
+incomes/expenses for the load and query benchmarks.
+
+Works on Postgres and SQLite. Every user logs in as ``user<n>`` with
+``--password`` (default ``bench``). Rows are generated from ``--seed``, so two
+runs with the same arguments produce the same data.
+
+    python -m benchmarks.seed --url postgresql://et:et@localhost/et_bench \
+        --users 100 --cards 3 --rows 1000000
+    python -m benchmarks.seed --url sqlite:///bench.db --users 10 --rows 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+
+import models
+import partitions
+import rollups
+import snapshots
+from hashing import bcrypt_context
+
+BATCH_SIZE = 10_000
+INCOME_TYPES = ("salary", "refund", "interest", "gift")
+EXPENSE_TYPES = ("rent", "groceries", "transport", "utilities", "eating out", "travel")
+ACCOUNT_TYPES = ("debit card", "credit card")
+MERCHANTS = ("Amazon", "Tesco", "Uber", "Netflix", "Shell", "Ikea", "Starbucks", "Apple")
+
+
+def _insert_batches(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.execute(insert(table), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(table), batch)
+
+
+def _types(names, users, now):
+    """One type per name per user: the rows and {user_id: [type ids]}."""
+    rows, ids = [], {}
+    type_id = 0
+    for user_id in range(1, users + 1):
+        for name in names:
+            type_id += 1
+            rows.append({"id": type_id, "name": name, "description": name, "is_active": True,
+                         "owner_id": user_id, "created_at": now, "modified_at": now})
+            ids.setdefault(user_id, []).append(type_id)
+    return rows, ids
+
+
+def _transactions(rng, rows, cards, type_ids, days, now, expense):
+    for n in range(rows):
+        account_id, owner_id = cards[n % len(cards)]
+        created_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        row = {
+            # explicit, the (id, created_at) key does not autoincrement on sqlite
+            "id": n + 1,
+            "amount": round(rng.uniform(1, 500), 2),
+            "created_at": created_at,
+            "modified_at": created_at,
+            "is_active": rng.random() > 0.05,
+            "t_type": rng.choice(type_ids[owner_id]),
+            "description": f"{rng.choice(MERCHANTS)} #{rng.randrange(100000)}",
+            "owner_id": owner_id,
+            "account_id": account_id,
+        }
+        if expense:
+            row["importance"] = rng.choice(models.IMPORTANCE)
+        yield row
+
+
+def seed(engine, users: int, cards: int, rows: int, password: str, days: int = 730, seed_value: int = 0):
+    rng = random.Random(seed_value)
+    now = datetime.now().replace(microsecond=0)
+    hashed = bcrypt_context.hash(password)
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Users), [
+            {"id": u, "username": f"user{u}", "email": f"user{u}@example.com",
+             "first_name": f"first{u}", "last_name": f"last{u}", "hashed_password": hashed,
+             "is_active": True, "created_at": now, "modified_at": now}
+            for u in range(1, users + 1)
+        ])
+        type_ids = {}
+        for model, names in ((models.AccountTypes, ACCOUNT_TYPES),
+                             (models.IncomeTypes, INCOME_TYPES),
+                             (models.ExpenseTypes, EXPENSE_TYPES)):
+            type_rows, type_ids[model] = _types(names, users, now)
+            conn.execute(insert(model), type_rows)
+
+        card_keys = []
+        card_rows = []
+        for user_id in range(1, users + 1):
+            for _ in range(cards):
+                card_id = len(card_keys) + 1
+                card_keys.append((card_id, user_id))
+                card_rows.append({"id": card_id, "name": f"card {card_id}", "description": "seeded",
+                                  "card_type": type_ids[models.AccountTypes][user_id][0],
+                                  "balance": 0, "is_active": True, "owner_id": user_id,
+                                  "created_at": now, "modified_at": now})
+        conn.execute(insert(models.Accounts), card_rows)
+
+        if engine.dialect.name == "postgresql":
+            # create_all only made the recent months, the rest would land in the default partition
+            partitions.ensure_partitions(conn, first=(now - timedelta(days=days)).date())
+        _insert_batches(conn, models.Incomes, _transactions(
+            rng, rows, card_keys, type_ids[models.IncomeTypes], days, now, expense=False))
+        _insert_batches(conn, models.Expenses, _transactions(
+            rng, rows, card_keys, type_ids[models.ExpenseTypes], days, now, expense=True))
+
+        conn.execute(text("""
+            UPDATE accounts SET balance =
+                COALESCE((SELECT SUM(amount) FROM incomes
+                          WHERE incomes.account_id = accounts.id AND incomes.is_active), 0)
+              - COALESCE((SELECT SUM(amount) FROM expenses
+                          WHERE expenses.account_id = accounts.id AND expenses.is_active), 0)
+        """))
+
+        if engine.dialect.name == "postgresql":
+            # ids above were explicit, move the sequences past them
+            for table in ("users", "accounttypes", "incometypes", "expensetypes", "accounts",
+                          "incomes", "expenses"):
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT MAX(id) FROM {table}))"
+                ))
+
+    if engine.dialect.name == "postgresql":
+        # the rollup and snapshot upserts are postgres only, sqlite runs leave them empty
+        rollups.backfill(engine)
+        snapshots.backfill(engine)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True, help="throwaway database, it is dropped and recreated")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--cards", type=int, default=3, help="cards per user")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="incomes and expenses each")
+    parser.add_argument("--days", type=int, default=730, help="spread transactions over this many days")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(create_engine(args.url), args.users, args.cards, args.rows, args.password, args.days, args.seed)
+    print(f"seeded {args.users} users, {args.users * args.cards} cards and {2 * args.rows} "
+          f"transactions in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Import time of the app and time until a freshly started server answers its
+first request.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def import_time() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request_time(path: str, timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    )
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1).raise_for_status()
+                return (time.perf_counter() - started) * 1000
+            except httpx.HTTPError:
+                time.sleep(0.01)
+        raise SystemExit(f"server did not answer {path} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/auth/", help="page requested once the server is up")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports = [import_time() for _ in range(args.runs)]
+    first = [first_request_time(args.path, args.timeout) for _ in range(args.runs)]
+    print(f"import main:           median {statistics.median(imports):.0f} ms, max {max(imports):.0f} ms")
+    print(f"spawn -> first answer: median {statistics.median(first):.0f} ms, max {max(first):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
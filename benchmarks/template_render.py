@@ -0,0 +1,79 @@
+"""
+Render time of cards.html and transactions.html at 10, 1k and 10k rows
+through the shared template environment.
+
+    python -m benchmarks.template_render --iterations 20
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from templating import precompile_templates, templates
+
+SIZES = (10, 1_000, 10_000)
+
+
+def static_url(name, path):
+    return f"/static{path}"
+
+
+def cards(rows: int):
+    return [
+        SimpleNamespace(id=i, name=f"card {i}", balance=round(i * 1.5, 2)) for i in range(rows)
+    ]
+
+
+def transactions(rows: int):
+    now = datetime.now()
+    return [
+        SimpleNamespace(
+            id=i,
+            kind="income" if i % 3 == 0 else "expense",
+            created_at=now - timedelta(hours=i),
+            type_name="groceries",
+            description=f"transaction {i}",
+            amount=12.5,
+            importance=None if i % 3 == 0 else "Essential",
+            balance_after=1000.0 - i,
+        )
+        for i in range(rows)
+    ]
+
+
+def measure(name: str, context: dict, iterations: int):
+    template = templates.get_template(name)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        html = template.render(context)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = precompile_templates()
+    print(f"precompiled {count} templates in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    user = {"username": "bench", "id": 1}
+    print(f"{'template':>18} {'rows':>7} {'median ms':>10} {'bytes':>10}")
+    for size in SIZES:
+        pages = (
+            ("cards.html", {"cards": cards(size)}),
+            ("transactions.html", {"transactions": transactions(size), "pages": {}, "card_id": 1}),
+        )
+        for name, context in pages:
+            # url_for normally needs a live request; a context value shadows the global
+            context.update({"request": None, "user": user, "url_for": static_url})
+            median, size_bytes = measure(name, context, args.iterations)
+            print(f"{name:>18} {size:>7} {median:>10.2f} {size_bytes:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Monthly spending budgets per expense type or importance level.
+
+``budget_totals`` keeps a running total per budget and month: the ledger
+adds every expense change to the budgets it matches, as it does for the
+rollups, so showing spend against budget is one small query per page that
+never reads ``expenses``. When a change takes a total across the budget's
+``alert_ratio`` or across the budget itself, a ``budget_alerts`` row is
+written (once per budget, month and threshold) and shown until dismissed.
+
+New budgets are seeded from the monthly rollups, and
+``python budgets.py backfill`` rebuilds every total from them.
+"""
+import sys
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from rollups import month_of
+
+ALERT_RATIO = 0.8
+ALERT_LIMIT = 20
+
+
+def _key(owner_id: int, t_type: int, importance: str, moment) -> tuple:
+    return owner_id, t_type, importance, month_of(moment)
+
+
+def expense_key(expense: models.Expenses) -> tuple:
+    """The ``record`` key of ``expense`` as it is now."""
+    return _key(expense.owner_id, expense.t_type, expense.importance, expense.created_at)
+
+
+async def record(db: AsyncSession, deltas: dict):
+    """
+    Add the ``(owner_id, t_type, importance, month) -> amount`` deltas to
+    every budget they count towards, with one upsert in budget order so
+    concurrent writers lock the totals in the same order, and write the
+    alerts for the thresholds the increases cross. Call it after the rollups
+    and before the card balance, see ``ledger``.
+    """
+    deltas = {key: amount for key, amount in deltas.items() if amount != 0}
+    if not deltas:
+        return
+    rows = await db.execute(
+        select(
+            models.Budgets.id,
+            models.Budgets.owner_id,
+            models.Budgets.t_type,
+            models.Budgets.importance,
+            models.Budgets.amount,
+            models.Budgets.alert_ratio,
+        )
+        .where(models.Budgets.owner_id.in_({key[0] for key in deltas}))
+        .where(models.Budgets.is_active == True)
+    )
+    budgets = {}
+    changes = {}
+    for budget in rows:
+        budgets[budget.id] = budget
+        for (owner_id, t_type, importance, month), amount in deltas.items():
+            # match on the column the budget is keyed on only, like ``_seed``'s SQL ``=``,
+            # so a NULL type or importance never matches the budget's other, NULL column
+            if owner_id == budget.owner_id and (
+                (budget.t_type is not None and t_type == budget.t_type)
+                or (budget.importance is not None and importance == budget.importance)
+            ):
+                changes[budget.id, month] = changes.get((budget.id, month), 0.0) + amount
+    if not changes:
+        return
+
+    totals = models.BudgetTotals
+    statement = pg_insert(totals).values([
+        {"budget_id": budget_id, "month": month, "spent": amount}
+        for (budget_id, month), amount in sorted(changes.items())
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=["budget_id", "month"],
+        set_={"spent": totals.spent + statement.excluded.spent},
+    ).returning(totals.budget_id, totals.month, totals.spent)
+    alerts = []
+    for budget_id, month, spent in await db.execute(statement):
+        amount = changes[budget_id, month]
+        budget = budgets[budget_id]
+        for threshold in sorted({budget.alert_ratio or ALERT_RATIO, 1.0}):
+            if spent - amount < threshold * budget.amount <= spent:
+                alerts.append({
+                    "budget_id": budget_id, "owner_id": budget.owner_id, "month": month,
+                    "threshold": threshold, "spent": spent, "seen": False,
+                    "created_at": datetime.now(),
+                })
+    if alerts:
+        await db.execute(pg_insert(models.BudgetAlerts).values(alerts).on_conflict_do_nothing())
+
+
+async def record_expense(db: AsyncSession, expense: models.Expenses, amount: float):
+    """Add ``amount`` to the budgets ``expense`` counts towards, in its month."""
+    await record(db, {expense_key(expense): amount})
+
+
+class BudgetDeltas:
+    """
+    Collects budget spend for bulk writers, like ``RollupTotals``. Flush it
+    after the rollups and before the card balance is updated.
+    """
+
+    def __init__(self):
+        self.deltas = {}
+
+    def add(self, row: dict):
+        key = _key(row["owner_id"], row["t_type"], row["importance"], row["created_at"])
+        self.deltas[key] = self.deltas.get(key, 0.0) + row["amount"]
+
+    async def flush(self, db: AsyncSession):
+        await record(db, self.deltas)
+        self.deltas.clear()
+
+
+def _seed(budget_ids=None):
+    """Insert totals for ``budget_ids`` (default: all active budgets) from the monthly rollups."""
+    budgets = models.Budgets
+    rollup = models.MonthlyExpenseTotals
+    query = (
+        select(budgets.id, rollup.month, func.sum(rollup.total))
+        .join(
+            rollup,
+            (rollup.owner_id == budgets.owner_id)
+            & ((rollup.t_type == budgets.t_type) | (rollup.importance == budgets.importance)),
+        )
+        .where(budgets.is_active == True)
+        .group_by(budgets.id, rollup.month)
+    )
+    if budget_ids is not None:
+        query = query.where(budgets.id.in_(budget_ids))
+    return insert(models.BudgetTotals).from_select(["budget_id", "month", "spent"], query)
+
+
+async def create_budget(
+    db: AsyncSession,
+    owner_id: int,
+    amount: float,
+    t_type: Optional[int] = None,
+    importance: Optional[str] = None,
+    alert_ratio: float = ALERT_RATIO,
+) -> models.Budgets:
+    """Add a budget with its totals so far. Does not commit."""
+    budget = models.Budgets()
+    budget.t_type = t_type
+    budget.importance = None if t_type is not None else importance
+    budget.amount = amount
+    budget.alert_ratio = alert_ratio
+    budget.is_active = True
+    budget.created_at = datetime.now()
+    budget.modified_at = datetime.now()
+    budget.owner_id = owner_id
+    db.add(budget)
+    await db.flush()
+    await db.execute(_seed([budget.id]))
+    return budget
+
+
+async def remove_budget(db: AsyncSession, owner_id: int, budget_id: int) -> bool:
+    """Stop a budget; False when it is not ``owner_id``'s. Does not commit."""
+    result = await db.execute(
+        update(models.Budgets)
+        .where(models.Budgets.id == budget_id)
+        .where(models.Budgets.owner_id == owner_id)
+        .where(models.Budgets.is_active == True)
+        .values(is_active=False, modified_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def status_listing(owner_id: int, month: date):
+    """The owner's active budgets with what was spent against them in ``month``."""
+    budgets = models.Budgets
+    totals = models.BudgetTotals
+    return (
+        select(
+            budgets.id,
+            budgets.t_type,
+            models.ExpenseTypes.name.label("type_name"),
+            budgets.importance,
+            budgets.amount,
+            budgets.alert_ratio,
+            func.coalesce(totals.spent, 0).label("spent"),
+        )
+        .outerjoin(totals, (totals.budget_id == budgets.id) & (totals.month == month))
+        .outerjoin(models.ExpenseTypes, models.ExpenseTypes.id == budgets.t_type)
+        .where(budgets.owner_id == owner_id)
+        .where(budgets.is_active == True)
+        .order_by(budgets.id)
+    )
+
+
+def alert_listing(owner_id: int, limit: int = ALERT_LIMIT):
+    """The owner's newest ``limit`` alerts that were not dismissed yet."""
+    alerts = models.BudgetAlerts
+    budgets = models.Budgets
+    return (
+        select(
+            alerts.id,
+            alerts.month,
+            alerts.threshold,
+            alerts.spent,
+            alerts.created_at,
+            budgets.amount,
+            budgets.importance,
+            models.ExpenseTypes.name.label("type_name"),
+        )
+        .join(budgets, budgets.id == alerts.budget_id)
+        .outerjoin(models.ExpenseTypes, models.ExpenseTypes.id == budgets.t_type)
+        .where(alerts.owner_id == owner_id)
+        .where(alerts.seen == False)
+        .order_by(alerts.created_at.desc())
+        .limit(limit)
+    )
+
+
+async def summary(db: AsyncSession, owner_id: int) -> dict:
+    """Template context for the budget panel: this month's budgets and open alerts."""
+    month = month_of(datetime.now())
+    return {
+        "budget_month": month,
+        "budgets": (await db.execute(status_listing(owner_id, month))).all(),
+        "budget_alerts": (await db.execute(alert_listing(owner_id))).all(),
+    }
+
+
+async def dismiss_alert(db: AsyncSession, owner_id: int, alert_id: int) -> bool:
+    result = await db.execute(
+        update(models.BudgetAlerts)
+        .where(models.BudgetAlerts.id == alert_id)
+        .where(models.BudgetAlerts.owner_id == owner_id)
+        .values(seen=True)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def backfill(engine):
+    """
+    Rebuild all budget totals from the monthly rollups in one transaction,
+    with the rollups locked against writes. Alerts are left alone.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE monthly_expense_totals IN SHARE MODE"))
+        conn.execute(delete(models.BudgetTotals))
+        conn.execute(_seed())
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        raise SystemExit("usage: python budgets.py backfill")
+    from database import get_engine
+
+    backfill(get_engine())
@@ -0,0 +1,108 @@
+"""
+Conditional GET for the card pages.
+
+A page's version stamp is the newest of two timestamps. One is the card's
+``modified_at``: every income/expense write bumps it through
+``ledger.apply_balance_delta`` and card edits set it. The other is the
+owner's ``pages_modified_at``, which :func:`touch_owner` bumps for changes
+that show on the card pages without touching a card: type names in the
+transaction list, and budgets and alerts in the budget panel. The
+transaction list uses the newest stamp of all cards, since expenses on any
+card move the budget panel. Pages derive their ``ETag`` and
+``Last-Modified`` from it and answer ``304 Not Modified`` from this one
+lookup when the client's copy is current.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import Response
+
+import models
+
+CACHE_CONTROL = "private, no-cache"
+
+
+async def card_stamp(db: AsyncSession, owner_id: int, card_id: int) -> Optional[datetime]:
+    return await db.scalar(
+        select(func.greatest(models.Accounts.modified_at, models.Users.pages_modified_at))
+        .select_from(models.Accounts)
+        .join(models.Users, models.Users.id == models.Accounts.owner_id)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == owner_id)
+    )
+
+
+async def cards_stamp(db: AsyncSession, owner_id: int) -> Optional[datetime]:
+    """Newest stamp of all the owner's cards, deleted ones included."""
+    cards = (
+        select(func.max(models.Accounts.modified_at))
+        .where(models.Accounts.owner_id == owner_id)
+        .scalar_subquery()
+    )
+    return await db.scalar(
+        select(func.greatest(cards, models.Users.pages_modified_at)).where(
+            models.Users.id == owner_id
+        )
+    )
+
+
+async def touch_owner(db: AsyncSession, owner_id: int):
+    """Invalidate all of the owner's card pages without changing the cards."""
+    await db.execute(
+        update(models.Users)
+        .where(models.Users.id == owner_id)
+        .values(pages_modified_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def etag(stamp: datetime, *parts) -> str:
+    raw = "|".join(str(part) for part in (stamp.isoformat(), *parts))
+    return 'W/"' + hashlib.blake2b(raw.encode(), digest_size=12).hexdigest() + '"'
+
+
+def _http_date(stamp: datetime) -> str:
+    # modified_at is stored as naive local time
+    return format_datetime(stamp.astimezone(timezone.utc), usegmt=True)
+
+
+def is_fresh(request: Request, tag: str, stamp: datetime) -> bool:
+    """
+    True when the client's cached copy is current. ``If-None-Match`` wins
+    over ``If-Modified-Since``, which only has one second resolution: the
+    stamp is compared at full precision, so a change later within the
+    second of a cached copy counts as modified rather than risk a stale 304.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = {value.strip() for value in if_none_match.split(",")}
+        return tag in candidates or "*" in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return stamp.astimezone(timezone.utc) <= since
+    return False
+
+
+def validators(tag: str, stamp: datetime) -> dict:
+    return {"ETag": tag, "Last-Modified": _http_date(stamp), "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(tag: str, stamp: datetime) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators(tag, stamp))
+
+
+def with_validators(response: Response, tag: str, stamp: datetime) -> Response:
+    response.headers.update(validators(tag, stamp))
+    return response
@@ -1,13 +1,65 @@
+import os
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from constants import DatabaseConstants
+from metrics import TimedQueuePool, instrument_pool, instrument_queries
 
 DATABASE_URL = DatabaseConstants.POSTGRESQL_DATABASE_URL
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", -1)),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+}
+
+# Nothing connects at import time: the app creates its engine in the lifespan
+# hook (init_async_engine) and scripts ask for a sync engine (get_engine).
+engine = None
+async_engine = None
 
-engine = create_engine(
-    DATABASE_URL
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = sessionmaker(
+    class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
+Base = declarative_base()
+
+
+def get_engine():
+    """Synchronous engine for alembic, maintenance commands and benchmarks."""
+    global engine
+    if engine is None:
+        engine = create_engine(DATABASE_URL)
+        SessionLocal.configure(bind=engine)
+    return engine
+
+
+def init_async_engine():
+    """Engine behind request handlers, so queries never block the event loop."""
+    global async_engine
+    if async_engine is None:
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL, poolclass=TimedQueuePool, **POOL_SETTINGS
+        )
+        instrument_pool(async_engine.sync_engine)
+        instrument_queries(async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+    return async_engine
+
+
+async def dispose_async_engine():
+    global async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,119 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2022-12-03 10:00:00.000000
+
+Databases that were created by ``Base.metadata.create_all`` before migrations
+existed already have these tables; mark them with ``alembic stamp 0001``
+instead of running this revision.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+IMPORTANCE = ('Essential', 'Have to have', 'Nice to have', 'Should not have')
+
+
+def _custom_type_table(name: str) -> None:
+    op.create_table(
+        name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f(f'ix_{name}_id'), name, ['id'], unique=False)
+
+
+def _transaction_columns(type_table: str):
+    return [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('t_type', sa.Integer(), nullable=True),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['t_type'], [f'{type_table}.id']),
+        sa.PrimaryKeyConstraint('id'),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=50), nullable=True),
+        sa.Column('username', sa.String(length=45), nullable=True),
+        sa.Column('first_name', sa.String(length=45), nullable=True),
+        sa.Column('last_name', sa.String(length=45), nullable=True),
+        sa.Column('hashed_password', sa.String(length=200), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+    op.create_index(op.f('ix_users_first_name'), 'users', ['first_name'], unique=True)
+    op.create_index(op.f('ix_users_last_name'), 'users', ['last_name'], unique=True)
+
+    _custom_type_table('accounttypes')
+    _custom_type_table('incometypes')
+    _custom_type_table('expensetypes')
+
+    op.create_table(
+        'accounts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('card_type', sa.Integer(), nullable=True),
+        sa.Column('balance', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['card_type'], ['accounttypes.id']),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_accounts_id'), 'accounts', ['id'], unique=False)
+
+    op.create_table('incomes', *_transaction_columns('incometypes'))
+    op.create_index(op.f('ix_incomes_id'), 'incomes', ['id'], unique=False)
+
+    op.create_table(
+        'expenses',
+        *_transaction_columns('expensetypes'),
+        sa.Column('importance', sa.Enum(*IMPORTANCE, name='importance_enum'), nullable=True),
+    )
+    op.create_index(op.f('ix_expenses_id'), 'expenses', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('expenses')
+    op.drop_table('incomes')
+    op.drop_table('accounts')
+    op.drop_table('expensetypes')
+    op.drop_table('incometypes')
+    op.drop_table('accounttypes')
+    op.drop_table('users')
+    sa.Enum(name='importance_enum').drop(op.get_bind(), checkfirst=True)
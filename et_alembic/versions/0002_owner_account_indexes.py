@@ -0,0 +1,71 @@
+"""owner/account/is_active indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2022-12-03 10:30:00.000000
+
+Indexes are built CONCURRENTLY so a live database keeps taking writes while
+the migration runs; that needs to happen outside of a transaction.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+TRANSACTION_TABLES = ('incomes', 'expenses')
+CUSTOM_TYPE_TABLES = ('accounttypes', 'incometypes', 'expensetypes')
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in TRANSACTION_TABLES:
+            op.create_index(
+                f'ix_{table}_owner_account_created',
+                table,
+                ['owner_id', 'account_id', 'created_at'],
+                postgresql_concurrently=True,
+            )
+            op.create_index(
+                f'ix_{table}_active_owner_account_created',
+                table,
+                ['owner_id', 'account_id', 'created_at', 'id'],
+                postgresql_where=sa.text('is_active'),
+                postgresql_concurrently=True,
+            )
+        op.create_index(
+            'ix_accounts_active_owner',
+            'accounts',
+            ['owner_id'],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True,
+        )
+        for table in CUSTOM_TYPE_TABLES:
+            op.create_index(
+                f'ix_{table}_owner', table, ['owner_id'], postgresql_concurrently=True
+            )
+    for table in TRANSACTION_TABLES + ('accounts',):
+        op.execute(f'ANALYZE {table}')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in CUSTOM_TYPE_TABLES:
+            op.drop_index(f'ix_{table}_owner', table_name=table, postgresql_concurrently=True)
+        op.drop_index('ix_accounts_active_owner', table_name='accounts', postgresql_concurrently=True)
+        for table in TRANSACTION_TABLES:
+            op.drop_index(
+                f'ix_{table}_active_owner_account_created',
+                table_name=table,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f'ix_{table}_owner_account_created',
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,88 @@
+"""monthly income and expense rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2022-12-10 09:00:00.000000
+
+Run ``python rollups.py backfill`` once after upgrading to fill the tables
+from existing transactions. The type and importance are part of the rollup
+keys, so the upgrade refuses to run while transactions without them exist;
+give those rows a type (and expenses an importance) first.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def _rollup_columns(type_table: str):
+    return [
+        sa.Column('account_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('t_type', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('total', sa.Float(), nullable=True),
+        sa.Column('count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['t_type'], [f'{type_table}.id']),
+    ]
+
+
+def _untyped_rows() -> dict:
+    bind = op.get_bind()
+    return {
+        'incomes': bind.execute(
+            sa.text('SELECT count(*) FROM incomes WHERE t_type IS NULL')
+        ).scalar(),
+        'expenses': bind.execute(
+            sa.text('SELECT count(*) FROM expenses WHERE t_type IS NULL OR importance IS NULL')
+        ).scalar(),
+    }
+
+
+def upgrade() -> None:
+    untyped = {table: count for table, count in _untyped_rows().items() if count}
+    if untyped:
+        raise RuntimeError(
+            'transactions without a type or importance can not be rolled up ('
+            + ', '.join(f'{count} in {table}' for table, count in untyped.items())
+            + '); set t_type (and importance on expenses) on them and upgrade again'
+        )
+    op.create_table(
+        'monthly_income_totals',
+        *_rollup_columns('incometypes'),
+        sa.PrimaryKeyConstraint('account_id', 'month', 't_type'),
+    )
+    op.create_index(
+        'ix_monthly_income_totals_owner_month',
+        'monthly_income_totals',
+        ['owner_id', 'month'],
+    )
+    op.create_table(
+        'monthly_expense_totals',
+        *_rollup_columns('expensetypes'),
+        sa.Column(
+            'importance',
+            postgresql.ENUM(name='importance_enum', create_type=False),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint('account_id', 'month', 't_type', 'importance'),
+    )
+    op.create_index(
+        'ix_monthly_expense_totals_owner_month',
+        'monthly_expense_totals',
+        ['owner_id', 'month'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('monthly_expense_totals')
+    op.drop_table('monthly_income_totals')
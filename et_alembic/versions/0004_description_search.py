@@ -0,0 +1,47 @@
+"""full-text and trigram search indexes on descriptions
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2022-12-17 11:00:00.000000
+
+The tsvector is an indexed expression rather than a stored column, so
+adding it does not rewrite incomes/expenses; search.py queries the same
+expression. btree_gin lets owner_id sit in the same GIN index, so a
+search only visits the user's own rows. Built CONCURRENTLY like 0002.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+TRANSACTION_TABLES = ('incomes', 'expenses')
+DOCUMENT = "to_tsvector('simple', coalesce(description, ''))"
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    with op.get_context().autocommit_block():
+        for table in TRANSACTION_TABLES:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_owner_search '
+                f'ON {table} USING gin (owner_id, ({DOCUMENT}))'
+            )
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_owner_description_trgm '
+                f'ON {table} USING gin (owner_id, description gin_trgm_ops)'
+            )
+    for table in TRANSACTION_TABLES:
+        op.execute(f'ANALYZE {table}')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in TRANSACTION_TABLES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_owner_description_trgm')
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_owner_search')
@@ -0,0 +1,195 @@
+"""partition incomes and expenses by created_at month
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2022-12-24 10:00:00.000000
+
+The conversion runs while the app keeps writing:
+
+1. create ``<table>_partitioned`` (same columns, primary key (id, created_at),
+   monthly partitions from the oldest row to a few months ahead plus a
+   default partition, and all indexes) and a trigger on the old table that
+   mirrors every insert/update/delete into it;
+2. copy the existing rows over in id ranges of BATCH_SIZE, each batch its
+   own transaction, so no long lock or transaction is held;
+3. in one short transaction, swap the names. The old table stays around as
+   ``<table>_unpartitioned``. Drop it once you have checked the row counts.
+
+Rows with a NULL created_at cannot be partitioned. They get their
+modified_at (or the migration time) first.
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+import partitions
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+PARTITIONED_TABLES = partitions.PARTITIONED_TABLES
+BATCH_SIZE = 50_000
+
+COLUMNS = {
+    'incomes': ['amount', 'modified_at', 'is_active', 't_type', 'description', 'owner_id', 'account_id'],
+    'expenses': ['amount', 'modified_at', 'is_active', 't_type', 'description', 'owner_id', 'account_id',
+                 'importance'],
+}
+TYPE_TABLES = {'incomes': 'incometypes', 'expenses': 'expensetypes'}
+DOCUMENT = "to_tsvector('simple', coalesce(description, ''))"
+
+
+def _indexes(table: str):
+    """(name, definition) of every index the partitioned table needs."""
+    return [
+        (f'ix_{table}_id', '(id)'),
+        (f'ix_{table}_owner_account_created', '(owner_id, account_id, created_at)'),
+        (f'ix_{table}_active_owner_account_created',
+         '(owner_id, account_id, created_at, id) WHERE is_active'),
+        (f'ix_{table}_owner_search', f'USING gin (owner_id, ({DOCUMENT}))'),
+        (f'ix_{table}_owner_description_trgm', 'USING gin (owner_id, description gin_trgm_ops)'),
+    ]
+
+
+def _prepare(table: str):
+    new = f'{table}_partitioned'
+    op.execute(
+        f'UPDATE {table} SET created_at = coalesce(modified_at, now()) WHERE created_at IS NULL'
+    )
+    op.execute(
+        f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+    )
+    op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY (id, created_at)')
+    op.execute(
+        f'ALTER TABLE {new} ADD FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE'
+    )
+    op.execute(f'ALTER TABLE {new} ADD FOREIGN KEY (owner_id) REFERENCES users (id)')
+    op.execute(f'ALTER TABLE {new} ADD FOREIGN KEY (t_type) REFERENCES {TYPE_TABLES[table]} (id)')
+
+    first, last = op.get_bind().execute(
+        sa.text(f'SELECT min(created_at), max(created_at) FROM {table}')
+    ).one()
+    for ddl in _partition_ddl(table, new, first.date() if first else None, last.date() if last else None):
+        op.execute(ddl)
+
+    # built while the table is empty; CONCURRENTLY is not available on partitioned tables
+    for name, definition in _indexes(table):
+        op.execute(f'CREATE INDEX {name}_p ON {new} {definition}')
+
+    columns = COLUMNS[table]
+    assignments = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+    op.execute(f'''
+        CREATE FUNCTION {table}_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {new} WHERE id = OLD.id AND created_at = OLD.created_at;
+                RETURN OLD;
+            END IF;
+            NEW.created_at := coalesce(NEW.created_at, NEW.modified_at, now());
+            IF TG_OP = 'UPDATE' AND NEW.created_at IS DISTINCT FROM OLD.created_at THEN
+                DELETE FROM {new} WHERE id = OLD.id AND created_at = OLD.created_at;
+            END IF;
+            INSERT INTO {new} SELECT NEW.*
+                ON CONFLICT (id, created_at) DO UPDATE SET {assignments};
+            RETURN NEW;
+        END $$
+    ''')
+    op.execute(
+        f'CREATE TRIGGER {table}_mirror BEFORE INSERT OR UPDATE OR DELETE ON {table} '
+        f'FOR EACH ROW EXECUTE FUNCTION {table}_mirror()'
+    )
+
+
+def _partition_ddl(table: str, parent: str, first, last):
+    """
+    The default and monthly partitions of ``parent``, named after ``table``,
+    from the oldest row's month to the newest one or a few months ahead.
+    """
+    yield partitions.default_partition_ddl(table, parent)
+    this_month = date.today().replace(day=1)
+    month = (first or this_month).replace(day=1)
+    end = max(
+        partitions.add_months(this_month, partitions.PARTITION_MONTHS_AHEAD),
+        (last or this_month).replace(day=1),
+    )
+    while month <= end:
+        yield partitions.partition_ddl(table, month, parent)
+        month = partitions.add_months(month, 1)
+
+
+def _copy(table: str):
+    """Copy the rows in id batches, one transaction each, skipping mirrored ones."""
+    new = f'{table}_partitioned'
+    bind = op.get_bind()
+    low, high = bind.execute(sa.text(f'SELECT min(id), max(id) FROM {table}')).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH_SIZE):
+        op.execute(
+            f'INSERT INTO {new} SELECT * FROM {table} '
+            f'WHERE id >= {start} AND id < {start + BATCH_SIZE} ON CONFLICT DO NOTHING'
+        )
+
+
+def _swap(table: str):
+    new = f'{table}_partitioned'
+    old = f'{table}_unpartitioned'
+    bind = op.get_bind()
+    op.execute(f'LOCK TABLE {table}, {new} IN ACCESS EXCLUSIVE MODE')
+    op.execute(f'DROP TRIGGER {table}_mirror ON {table}')
+    op.execute(f'DROP FUNCTION {table}_mirror()')
+    old_indexes = bind.execute(
+        sa.text('SELECT indexname FROM pg_indexes WHERE tablename = :table'), {'table': table}
+    ).scalars().all()
+    op.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    for name in old_indexes:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name}_old')
+    op.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    op.execute(f'ALTER INDEX {new}_pkey RENAME TO {table}_pkey')
+    for name, _ in _indexes(table):
+        op.execute(f'ALTER INDEX {name}_p RENAME TO {name}')
+    # keep the id sequence when the old table is dropped
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+
+
+def upgrade() -> None:
+    for table in PARTITIONED_TABLES:
+        _prepare(table)
+    with op.get_context().autocommit_block():
+        for table in PARTITIONED_TABLES:
+            _copy(table)
+    for table in PARTITIONED_TABLES:
+        _swap(table)
+    # rows mirrored in for a month without a partition (e.g. the month turned
+    # during the copy) went to the default partition, give them their own
+    partitions.ensure_partitions(op.get_bind())
+    with op.get_context().autocommit_block():
+        for table in PARTITIONED_TABLES:
+            op.execute(f'ANALYZE {table}')
+
+
+def downgrade() -> None:
+    # offline: copies everything back into plain tables in one transaction
+    for table in PARTITIONED_TABLES:
+        plain = f'{table}_plain'
+        op.execute(f'DROP TABLE IF EXISTS {table}_unpartitioned')
+        op.execute(f'CREATE TABLE {plain} (LIKE {table} INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO {plain} SELECT * FROM {table}')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {plain}.id')
+        op.execute(f'DROP TABLE {table}')
+        op.execute(f'ALTER TABLE {plain} RENAME TO {table}')
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)')
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN created_at DROP NOT NULL')
+        op.execute(
+            f'ALTER TABLE {table} ADD FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE'
+        )
+        op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY (owner_id) REFERENCES users (id)')
+        op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY (t_type) REFERENCES {TYPE_TABLES[table]} (id)')
+        for name, definition in _indexes(table):
+            op.execute(f'CREATE INDEX {name} ON {table} {definition}')
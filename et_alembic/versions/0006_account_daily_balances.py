@@ -0,0 +1,37 @@
+"""end-of-day card balances
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2022-12-31 10:00:00.000000
+
+Run ``python snapshots.py backfill`` once after upgrading to fill the table
+from existing transactions.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'account_daily_balances',
+        sa.Column('account_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('net', sa.Float(), nullable=True),
+        sa.Column('balance', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('account_id', 'day'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('account_daily_balances')
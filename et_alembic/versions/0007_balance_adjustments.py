@@ -0,0 +1,85 @@
+"""balance adjustments of each card
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2023-01-07 10:00:00.000000
+
+A card's balance should be the sum of its adjustments (the balance it was
+created with, balances set by hand) plus its active transactions, which is
+what ``python reconcile.py`` checks. Existing cards have no record of either,
+so each card whose balance its transactions do not explain gets one
+``migration`` adjustment holding the difference. It mixes the opening
+balance with any drift from before the upgrade, which cannot be told apart,
+so the migration logs the count and the largest ones and ``python
+reconcile.py --adjustments`` lists them. The transaction totals are one
+grouped pass over each table rather than a subquery per card.
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger(f'alembic.{__name__}')
+SHOW = 20
+
+
+def upgrade() -> None:
+    op.create_table(
+        'balance_adjustments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=True),
+        sa.Column('amount', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_balance_adjustments_id'), 'balance_adjustments', ['id'], unique=False)
+    op.create_index(
+        'ix_balance_adjustments_owner_account', 'balance_adjustments', ['owner_id', 'account_id']
+    )
+
+    # writes wait so balances and transactions are read at the same moment
+    op.execute('LOCK TABLE accounts, incomes, expenses IN SHARE MODE')
+    op.execute('''
+        INSERT INTO balance_adjustments (kind, amount, created_at, owner_id, account_id)
+        SELECT 'migration', coalesce(accounts.balance, 0) - coalesce(totals.net, 0), now(),
+               accounts.owner_id, accounts.id
+        FROM accounts
+        LEFT JOIN (
+            SELECT account_id, sum(signed) AS net FROM (
+                SELECT account_id, amount AS signed FROM incomes WHERE is_active
+                UNION ALL
+                SELECT account_id, -amount FROM expenses WHERE is_active
+            ) AS signed
+            GROUP BY account_id
+        ) AS totals ON totals.account_id = accounts.id
+        WHERE abs(coalesce(accounts.balance, 0) - coalesce(totals.net, 0)) > 0.005
+    ''')
+
+    bind = op.get_bind()
+    count, total = bind.execute(
+        sa.text("SELECT count(*), coalesce(sum(abs(amount)), 0) FROM balance_adjustments")
+    ).one()
+    logger.info('%d cards hold %.2f their transactions do not explain', count, total)
+    largest = bind.execute(sa.text(
+        'SELECT account_id, owner_id, amount FROM balance_adjustments ORDER BY abs(amount) DESC LIMIT :show'
+    ), {'show': SHOW})
+    for account_id, owner_id, amount in largest:
+        logger.info('  card %d (owner %d): %+.2f', account_id, owner_id, amount)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_balance_adjustments_owner_account', table_name='balance_adjustments')
+    op.drop_index(op.f('ix_balance_adjustments_id'), table_name='balance_adjustments')
+    op.drop_table('balance_adjustments')
@@ -0,0 +1,69 @@
+"""recurring transaction templates and their occurrences
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2023-01-14 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'recurring_transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=True),
+        sa.Column('t_type', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Float(), nullable=True),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column(
+            'importance',
+            postgresql.ENUM(name='importance_enum', create_type=False),
+            nullable=True,
+        ),
+        sa.Column('frequency', sa.String(length=10), nullable=True),
+        sa.Column('anchor_day', sa.Integer(), nullable=True),
+        sa.Column('next_due', sa.DateTime(), nullable=True),
+        sa.Column('ends_on', sa.Date(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_recurring_transactions_id'), 'recurring_transactions', ['id'], unique=False)
+    op.create_index(
+        'ix_recurring_transactions_active_due',
+        'recurring_transactions',
+        ['next_due'],
+        postgresql_where=sa.text('is_active'),
+    )
+    op.create_index(
+        'ix_recurring_transactions_owner_account',
+        'recurring_transactions',
+        ['owner_id', 'account_id'],
+    )
+    op.create_table(
+        'recurring_occurrences',
+        sa.Column('recurring_id', sa.Integer(), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['recurring_id'], ['recurring_transactions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('recurring_id', 'due_at'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('recurring_occurrences')
+    op.drop_table('recurring_transactions')
@@ -0,0 +1,76 @@
+"""monthly budgets, their running totals and alerts
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2023-01-21 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'budgets',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('t_type', sa.Integer(), nullable=True),
+        sa.Column(
+            'importance',
+            postgresql.ENUM(name='importance_enum', create_type=False),
+            nullable=True,
+        ),
+        sa.Column('amount', sa.Float(), nullable=True),
+        sa.Column('alert_ratio', sa.Float(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['t_type'], ['expensetypes.id']),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_budgets_id'), 'budgets', ['id'], unique=False)
+    op.create_index(
+        'ix_budgets_active_owner', 'budgets', ['owner_id'], postgresql_where=sa.text('is_active')
+    )
+    op.create_table(
+        'budget_totals',
+        sa.Column('budget_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('spent', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['budget_id'], ['budgets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('budget_id', 'month'),
+    )
+    op.create_table(
+        'budget_alerts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('budget_id', sa.Integer(), nullable=True),
+        sa.Column('month', sa.Date(), nullable=True),
+        sa.Column('threshold', sa.Float(), nullable=True),
+        sa.Column('spent', sa.Float(), nullable=True),
+        sa.Column('seen', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['budget_id'], ['budgets.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('budget_id', 'month', 'threshold'),
+    )
+    op.create_index(op.f('ix_budget_alerts_id'), 'budget_alerts', ['id'], unique=False)
+    op.create_index(
+        'ix_budget_alerts_unseen_owner', 'budget_alerts', ['owner_id'], postgresql_where=sa.text('NOT seen')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('budget_alerts')
+    op.drop_table('budget_totals')
+    op.drop_table('budgets')
@@ -0,0 +1,28 @@
+"""version stamp of an owner's card pages
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2023-01-28 10:00:00.000000
+
+Type, budget and alert changes used to bump ``modified_at`` on all of the
+owner's cards to invalidate the cached card pages. They bump this column
+instead, so ``accounts.modified_at`` only moves when a card changes.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('pages_modified_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'pages_modified_at')
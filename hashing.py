@@ -0,0 +1,63 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from passlib.context import CryptContext
+
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", os.cpu_count() or 1))
+HASHING_MAX_PENDING = int(os.getenv("HASHING_MAX_PENDING", 32))
+
+
+class HashingPoolFull(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated thread pool so a burst of logins can not starve
+    the event loop. bcrypt releases the GIL while it works, so threads give real
+    parallelism. Once ``max_pending`` calls are queued behind the busy workers
+    new calls fail straight away with :class:`HashingPoolFull` instead of
+    piling up.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, max_pending: int):
+        self.context = context
+        self.workers = workers
+        self.max_pending = max_pending
+        self.in_flight = 0
+        # in_flight is released from the worker threads
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+
+    def _release(self, _):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_pending:
+                raise HashingPoolFull()
+            self.in_flight += 1
+        # the slot is held until the executor is done with the call: a caller
+        # cancelled mid-hash (client gone) leaves bcrypt running in its thread
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+password_hasher = PasswordHasher(bcrypt_context, HASHING_WORKERS, HASHING_MAX_PENDING)
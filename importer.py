@@ -0,0 +1,258 @@
+"""
+Bulk import of bank statements (CSV or OFX) into one card.
+
+The upload is read in fixed size chunks and parsed incrementally, rows are
+written with executemany batches and the card balance, its daily history,
+the analytics rollups and the budget totals are updated once at the end.
+Everything happens in the caller's transaction, so a bad row anywhere in the
+file leaves the card untouched.
+"""
+import codecs
+import csv
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from budgets import BudgetDeltas
+from ledger import apply_balance_delta, insert_transactions
+from rollups import RollupTotals
+from snapshots import DailyDeltas
+
+CHUNK_SIZE = 256 * 1024
+BATCH_SIZE = 5000
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.S | re.I)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportMapping:
+    date_column: str = "date"
+    amount_column: str = "amount"
+    description_column: str = "description"
+    type_column: Optional[str] = None
+    date_format: str = "%Y-%m-%d"
+    income_type: Optional[int] = None
+    expense_type: Optional[int] = None
+    importance: str = "Essential"
+
+
+@dataclass
+class ImportResult:
+    incomes: int = 0
+    expenses: int = 0
+    net: float = 0.0
+    balance: Optional[float] = None
+
+    @property
+    def rows(self):
+        return self.incomes + self.expenses
+
+
+async def _text_chunks(upload, chunk_size: int):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    while True:
+        chunk = await upload.read(chunk_size)
+        yield decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            return
+
+
+async def _csv_records(upload, chunk_size: int):
+    """
+    Yield parsed CSV records. A record is only complete once it has an even
+    number of quote characters, so quoted fields may contain newlines and may
+    straddle chunk boundaries.
+    """
+    pending = ""
+    async for text in _text_chunks(upload, chunk_size):
+        pending += text
+        lines = pending.split("\n")
+        pending = lines.pop()
+        complete, partial = [], []
+        for line in lines:
+            partial.append(line)
+            record = "\n".join(partial)
+            if record.count('"') % 2 == 0:
+                complete.append(record)
+                partial = []
+        if partial:
+            pending = "\n".join(partial) + "\n" + pending
+        for record in csv.reader(complete):
+            yield record
+    if pending.strip():
+        for record in csv.reader([pending]):
+            yield record
+
+
+async def _ofx_records(upload, chunk_size: int):
+    pending = ""
+    async for text in _text_chunks(upload, chunk_size):
+        pending += text
+        end = 0
+        for match in OFX_TRANSACTION.finditer(pending):
+            end = match.end()
+            yield {
+                tag.upper(): value.strip()
+                for tag, value in OFX_FIELD.findall(match.group(1))
+            }
+        pending = pending[end:]
+
+
+def _ofx_row(fields: dict):
+    posted = fields.get("DTPOSTED", "")
+    if len(posted) >= 14:
+        moment = datetime.strptime(posted[:14], "%Y%m%d%H%M%S")
+    else:
+        moment = datetime.strptime(posted[:8], "%Y%m%d")
+    description = fields.get("NAME") or fields.get("MEMO") or ""
+    return moment, float(fields["TRNAMT"]), description, None
+
+
+async def _rows(upload, file_format: str, mapping: ImportMapping, chunk_size: int):
+    """Yield ``(line, moment, amount, description, type_name)`` for every usable record."""
+    if file_format == "ofx":
+        records = _ofx_records(upload, chunk_size)
+    else:
+        records = _csv_records(upload, chunk_size)
+    header = None
+
+    line = 0
+    async for record in records:
+        line += 1
+        try:
+            if file_format == "ofx":
+                moment, amount, description, type_name = _ofx_row(record)
+            else:
+                if header is None:
+                    header = {name.strip(): index for index, name in enumerate(record)}
+                    continue
+                if not any(record):
+                    continue
+                moment = datetime.strptime(
+                    record[header[mapping.date_column]].strip(), mapping.date_format
+                )
+                amount = float(record[header[mapping.amount_column]].replace(",", ""))
+                description = record[header[mapping.description_column]]
+                type_name = (
+                    record[header[mapping.type_column]] if mapping.type_column else None
+                )
+        except (KeyError, IndexError, ValueError) as exc:
+            raise ImportRowError(f"row {line}: {exc}") from exc
+        yield line, moment, amount, description, type_name
+
+
+async def _type_lookup(db: AsyncSession, owner_id: int):
+    lookup = {}
+    for table, kind in ((models.IncomeTypes, "income"), (models.ExpenseTypes, "expense")):
+        rows = await db.execute(
+            select(table.id, table.name)
+            .where(table.owner_id == owner_id)
+            .where(table.is_active == True)
+        )
+        for type_id, name in rows:
+            lookup.setdefault((name or "").strip().lower(), (kind, type_id))
+    return lookup
+
+
+async def import_transactions(
+    db: AsyncSession,
+    upload,
+    file_format: str,
+    mapping: ImportMapping,
+    owner_id: int,
+    account_id: int,
+    chunk_size: int = CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    prepare=None,
+) -> ImportResult:
+    """
+    Stream ``upload`` (anything with an async ``read(size)``) into the card.
+
+    Positive amounts become incomes of ``mapping.income_type`` and negative
+    ones expenses of ``mapping.expense_type``, unless ``mapping.type_column``
+    names one of the user's income or expense types. Raises
+    :class:`ImportRowError` on the first row that can not be used; the caller
+    is expected to roll back.
+
+    With ``prepare``, the upload is read twice: first for the set of months
+    it covers, which is awaited as ``prepare(months)`` before anything is
+    written (so their partitions can be created outside this transaction),
+    then for the rows themselves. ``upload`` must support ``seek`` then.
+    """
+    card = await db.scalar(
+        select(models.Accounts.id)
+        .where(models.Accounts.id == account_id)
+        .where(models.Accounts.owner_id == owner_id)
+    )
+    if card is None:
+        raise ImportRowError("card not found")
+
+    if prepare is not None:
+        months = set()
+        async for _, moment, _, _, _ in _rows(upload, file_format, mapping, chunk_size):
+            months.add(moment.date().replace(day=1))
+        await prepare(months)
+        await upload.seek(0)
+
+    types = await _type_lookup(db, owner_id)
+    result = ImportResult()
+    totals = RollupTotals()
+    spend = BudgetDeltas()
+    days = DailyDeltas()
+    incomes, expenses = [], []
+    now = datetime.now()
+
+    async def flush():
+        result.net += await insert_transactions(db, incomes, expenses, totals, spend, days)
+        incomes.clear()
+        expenses.clear()
+
+    async for line, moment, amount, description, type_name in _rows(
+        upload, file_format, mapping, chunk_size
+    ):
+        kind, type_id = (None, None)
+        if type_name:
+            kind, type_id = types.get(type_name.strip().lower(), (None, None))
+        if kind is None:
+            kind = "income" if amount >= 0 else "expense"
+            type_id = mapping.income_type if kind == "income" else mapping.expense_type
+        if type_id is None:
+            raise ImportRowError(f"row {line}: no {kind} type to file it under")
+
+        row = {
+            "amount": abs(amount),
+            "description": description[:200],
+            "is_active": True,
+            "t_type": type_id,
+            "created_at": moment,
+            "modified_at": now,
+            "owner_id": owner_id,
+            "account_id": account_id,
+        }
+        if kind == "income":
+            incomes.append(row)
+            result.incomes += 1
+        else:
+            row["importance"] = mapping.importance
+            expenses.append(row)
+            result.expenses += 1
+
+        if len(incomes) + len(expenses) >= batch_size:
+            await flush()
+
+    await flush()
+    await totals.flush(db)
+    await spend.flush(db)
+    result.balance = await apply_balance_delta(db, account_id, owner_id, result.net)
+    await days.flush(db)
+    return result
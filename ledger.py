@@ -0,0 +1,530 @@
+"""
+Every write that touches incomes or expenses goes through here, so the card
+balance, its daily history, the analytics rollups and the budget totals
+always move together with the rows. None of these functions commit; the
+caller owns the transaction and rolls back when a function returns None.
+
+Writers lock rows in one order, so two of them never wait on each other in
+a cycle: the transaction row, the rollup rows, the budget totals, the card
+(``apply_balance_delta``) and then the daily balances. Bulk writers keep it
+by flushing ``RollupTotals``, then ``BudgetDeltas``, then applying the
+balance and flushing ``DailyDeltas``.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import String, cast, func, insert, literal, null, select, tuple_, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import budgets
+import models
+import rollups
+import snapshots
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor
+
+
+async def apply_balance_delta(
+    db: AsyncSession, account_id: int, owner_id: int, delta: float
+) -> Optional[float]:
+    """
+    Add ``delta`` to the account balance in the database and return the new
+    balance, or None when the account does not belong to ``owner_id``.
+
+    The arithmetic happens inside a single ``UPDATE ... RETURNING`` so
+    concurrent writes to the same card serialise on the row lock instead of
+    overwriting each other's read-modify-write. It also bumps the card's
+    ``modified_at``, which the card pages use as their version stamp, so
+    it is called even when ``delta`` is zero.
+    """
+    return await db.scalar(
+        update(models.Accounts)
+        .where(models.Accounts.id == account_id)
+        .where(models.Accounts.owner_id == owner_id)
+        .values(balance=models.Accounts.balance + delta, modified_at=datetime.now())
+        .returning(models.Accounts.balance)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def set_balance(
+    db: AsyncSession, account_id: int, owner_id: int, balance: float
+) -> Optional[float]:
+    """
+    Set a card balance typed in by hand and return it, or None when the card
+    does not belong to ``owner_id``. The card row is locked before the
+    difference to the current balance is taken, and the difference is then
+    applied like any other write: through ``apply_balance_delta``, as a
+    manual adjustment and in the daily history.
+    """
+    current = (
+        await db.execute(
+            select(models.Accounts.balance)
+            .where(models.Accounts.id == account_id)
+            .where(models.Accounts.owner_id == owner_id)
+            .with_for_update()
+        )
+    ).first()
+    if current is None:
+        return None
+    delta = balance - (current.balance or 0)
+    new_balance = await apply_balance_delta(db, account_id, owner_id, delta)
+    record_adjustment(db, account_id, owner_id, "manual", delta)
+    await snapshots.record(db, account_id, owner_id, datetime.now().date(), delta)
+    return new_balance
+
+
+def record_adjustment(db: AsyncSession, account_id: int, owner_id: int, kind: str, amount: float):
+    """
+    Note a balance change that is not a transaction (see
+    ``models.ADJUSTMENT_KINDS``), so reconciliation expects it and can list it.
+    """
+    if amount == 0:
+        return
+    adjustment = models.BalanceAdjustments()
+    adjustment.kind = kind
+    adjustment.amount = amount
+    adjustment.created_at = datetime.now()
+    adjustment.owner_id = owner_id
+    adjustment.account_id = account_id
+    db.add(adjustment)
+
+
+def point_lookup(table, account_id: int, transaction_id: int, created_at: Optional[datetime] = None):
+    """
+    Select one transaction of a card. Pass its ``created_at`` when the caller
+    knows it (the edit and delete links carry it) so Postgres only probes
+    that month's partition instead of every one.
+    """
+    query = select(table).where(table.account_id == account_id).where(table.id == transaction_id)
+    if created_at is not None:
+        query = query.where(table.created_at == created_at)
+    return query
+
+
+async def _locked(
+    db: AsyncSession, table, account_id: int, transaction_id: int, created_at: Optional[datetime]
+):
+    row = await db.scalar(point_lookup(table, account_id, transaction_id, created_at).with_for_update())
+    if row is None or not row.is_active:
+        return None
+    return row
+
+
+async def create_income(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    t_type: int,
+    amount: float,
+    description: str,
+) -> Optional[models.Incomes]:
+    income_model = models.Incomes()
+    income_model.amount = amount
+    income_model.description = description
+    income_model.is_active = True
+    income_model.t_type = t_type
+    income_model.created_at = datetime.now()
+    income_model.modified_at = datetime.now()
+    income_model.owner_id = owner_id
+    income_model.account_id = account_id
+    db.add(income_model)
+    await rollups.record_income(db, income_model, amount, 1)
+
+    if await apply_balance_delta(db, account_id, owner_id, amount) is None:
+        return None
+    await snapshots.record(db, account_id, owner_id, income_model.created_at.date(), amount)
+    return income_model
+
+
+async def update_income(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    transaction_id: int,
+    t_type: int,
+    amount: float,
+    description: str,
+    created_at: Optional[datetime] = None,
+) -> Optional[models.Incomes]:
+    income_model = await _locked(db, models.Incomes, account_id, transaction_id, created_at)
+    if income_model is None:
+        return None
+
+    income_diff = amount - income_model.amount
+    rebucket = income_diff != 0 or income_model.t_type != t_type
+    if rebucket:
+        await rollups.record_income(db, income_model, -income_model.amount, -1)
+    income_model.amount = amount
+    income_model.description = description
+    income_model.t_type = t_type
+    income_model.modified_at = datetime.now()
+    if rebucket:
+        await rollups.record_income(db, income_model, amount, 1)
+
+    if await apply_balance_delta(db, account_id, owner_id, income_diff) is None:
+        return None
+    await snapshots.record(db, account_id, owner_id, income_model.created_at.date(), income_diff)
+    return income_model
+
+
+async def delete_income(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    transaction_id: int,
+    created_at: Optional[datetime] = None,
+) -> Optional[models.Incomes]:
+    income_model = await _locked(db, models.Incomes, account_id, transaction_id, created_at)
+    if income_model is None:
+        return None
+
+    income_model.is_active = False
+    income_model.modified_at = datetime.now()
+    await rollups.record_income(db, income_model, -income_model.amount, -1)
+
+    if await apply_balance_delta(db, account_id, owner_id, -income_model.amount) is None:
+        return None
+    await snapshots.record(
+        db, account_id, owner_id, income_model.created_at.date(), -income_model.amount
+    )
+    return income_model
+
+
+async def create_expense(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    t_type: int,
+    amount: float,
+    description: str,
+    importance: str,
+) -> Optional[models.Expenses]:
+    expense_model = models.Expenses()
+    expense_model.amount = amount
+    expense_model.description = description
+    expense_model.is_active = True
+    expense_model.t_type = t_type
+    expense_model.importance = importance
+    expense_model.created_at = datetime.now()
+    expense_model.modified_at = datetime.now()
+    expense_model.owner_id = owner_id
+    expense_model.account_id = account_id
+    db.add(expense_model)
+    await rollups.record_expense(db, expense_model, amount, 1)
+    await budgets.record_expense(db, expense_model, amount)
+
+    if await apply_balance_delta(db, account_id, owner_id, -amount) is None:
+        return None
+    await snapshots.record(db, account_id, owner_id, expense_model.created_at.date(), -amount)
+    return expense_model
+
+
+async def update_expense(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    transaction_id: int,
+    t_type: int,
+    amount: float,
+    description: str,
+    importance: Optional[str] = None,
+    created_at: Optional[datetime] = None,
+) -> Optional[models.Expenses]:
+    expense_model = await _locked(db, models.Expenses, account_id, transaction_id, created_at)
+    if expense_model is None:
+        return None
+
+    importance = importance or expense_model.importance
+    exp_diff = expense_model.amount - amount
+    rebucket = (
+        exp_diff != 0
+        or expense_model.t_type != t_type
+        or expense_model.importance != importance
+    )
+    old_key, old_amount = budgets.expense_key(expense_model), expense_model.amount
+    if rebucket:
+        await rollups.record_expense(db, expense_model, -expense_model.amount, -1)
+    expense_model.amount = amount
+    expense_model.description = description
+    expense_model.t_type = t_type
+    expense_model.importance = importance
+    expense_model.modified_at = datetime.now()
+    if rebucket:
+        await rollups.record_expense(db, expense_model, amount, 1)
+        new_key = budgets.expense_key(expense_model)
+        spend = {old_key: -old_amount}
+        spend[new_key] = spend.get(new_key, 0.0) + amount
+        await budgets.record(db, spend)
+
+    if await apply_balance_delta(db, account_id, owner_id, exp_diff) is None:
+        return None
+    await snapshots.record(db, account_id, owner_id, expense_model.created_at.date(), exp_diff)
+    return expense_model
+
+
+async def delete_expense(
+    db: AsyncSession,
+    owner_id: int,
+    account_id: int,
+    transaction_id: int,
+    created_at: Optional[datetime] = None,
+) -> Optional[models.Expenses]:
+    expense_model = await _locked(db, models.Expenses, account_id, transaction_id, created_at)
+    if expense_model is None:
+        return None
+
+    expense_model.is_active = False
+    expense_model.modified_at = datetime.now()
+    await rollups.record_expense(db, expense_model, -expense_model.amount, -1)
+    await budgets.record_expense(db, expense_model, -expense_model.amount)
+
+    if await apply_balance_delta(db, account_id, owner_id, expense_model.amount) is None:
+        return None
+    await snapshots.record(
+        db, account_id, owner_id, expense_model.created_at.date(), expense_model.amount
+    )
+    return expense_model
+
+
+async def insert_transactions(
+    db: AsyncSession,
+    incomes: list,
+    expenses: list,
+    totals: rollups.RollupTotals,
+    spend: budgets.BudgetDeltas,
+    days: snapshots.DailyDeltas,
+) -> float:
+    """
+    Bulk insert already validated income and expense rows (dicts of column
+    values) with one executemany per table, adding them to ``totals``,
+    ``spend`` and ``days``. Returns their net effect on the balance. The
+    caller flushes ``totals``, then ``spend``, applies the balance and then
+    flushes ``days``, once per import and in that lock order.
+    """
+    net = 0.0
+    if incomes:
+        await db.execute(insert(models.Incomes), incomes)
+        for row in incomes:
+            totals.add_income(row)
+            days.add(row, row["amount"])
+            net += row["amount"]
+    if expenses:
+        await db.execute(insert(models.Expenses), expenses)
+        for row in expenses:
+            totals.add_expense(row)
+            spend.add(row)
+            days.add(row, -row["amount"])
+            net -= row["amount"]
+    return net
+
+
+def date_bounds(query, column, start: Optional[date], end: Optional[date]):
+    """Keep rows of ``column`` from the start of ``start`` to the end of ``end``, both optional."""
+    if start is not None:
+        query = query.where(column >= datetime.combine(start, time.min))
+    if end is not None:
+        query = query.where(column < datetime.combine(end + timedelta(days=1), time.min))
+    return query
+
+
+def income_listing(
+    owner_id: int, account_id: int, start: Optional[date] = None, end: Optional[date] = None
+):
+    """Columns the transaction list shows for a card's active incomes."""
+    query = (
+        select(
+            models.Incomes.id,
+            models.Incomes.description,
+            models.Incomes.amount,
+            models.Incomes.created_at,
+            models.Incomes.t_type,
+            models.IncomeTypes.name.label("type_name"),
+        )
+        .join(models.IncomeTypes)
+        .where(models.Incomes.account_id == account_id)
+        .where(models.Incomes.owner_id == owner_id)
+        .where(models.Incomes.is_active == True)
+    )
+    return date_bounds(query, models.Incomes.created_at, start, end)
+
+
+def expense_listing(
+    owner_id: int, account_id: int, start: Optional[date] = None, end: Optional[date] = None
+):
+    """Columns the transaction list shows for a card's active expenses."""
+    query = (
+        select(
+            models.Expenses.id,
+            models.Expenses.description,
+            models.Expenses.amount,
+            models.Expenses.importance,
+            models.Expenses.created_at,
+            models.Expenses.t_type,
+            models.ExpenseTypes.name.label("type_name"),
+        )
+        .join(models.ExpenseTypes)
+        .where(models.Expenses.account_id == account_id)
+        .where(models.Expenses.owner_id == owner_id)
+        .where(models.Expenses.is_active == True)
+    )
+    return date_bounds(query, models.Expenses.created_at, start, end)
+
+
+def _feed_branches(owner_id: int, account_id: int):
+    """``(table, seq, signed, query)`` for the income and the expense side of the feed."""
+    branches = []
+    for table, seq, kind, signed, importance, types in (
+        (models.Incomes, models.Incomes.id * 2, "income", models.Incomes.amount,
+         cast(null(), String), models.IncomeTypes),
+        (models.Expenses, models.Expenses.id * 2 + 1, "expense", -models.Expenses.amount,
+         cast(models.Expenses.importance, String), models.ExpenseTypes),
+    ):
+        query = (
+            select(
+                seq.label("seq"),
+                table.id,
+                literal(kind).label("kind"),
+                table.description,
+                table.amount,
+                signed.label("signed"),
+                importance.label("importance"),
+                table.created_at,
+                table.t_type,
+                types.name.label("type_name"),
+            )
+            .join(types)
+            .where(table.account_id == account_id)
+            .where(table.owner_id == owner_id)
+            .where(table.is_active == True)
+        )
+        branches.append((table, seq, signed, query))
+    return branches
+
+
+# adjustments the daily balances count from their created_at on; 'migration'
+# entries were in the balance before the history starts
+DATED_ADJUSTMENTS = ("opening", "manual")
+
+
+def _adjustments(owner_id: int, account_id: int, since=None, until=None):
+    """
+    The card's dated balance adjustments created in ``[since, until)`` as a
+    scalar expression; the bounds may be columns of the enclosing query. An
+    adjustment sorts after the transactions of its exact moment.
+    """
+    table = models.BalanceAdjustments
+    query = (
+        select(func.coalesce(func.sum(table.amount), 0))
+        .where(table.account_id == account_id)
+        .where(table.owner_id == owner_id)
+        .where(table.kind.in_(DATED_ADJUSTMENTS))
+    )
+    if since is not None:
+        query = query.where(table.created_at >= since)
+    if until is not None:
+        query = query.where(table.created_at < until)
+    return query.scalar_subquery()
+
+
+def _cursor_balance(owner_id: int, account_id: int, cursor: tuple, inclusive: bool):
+    """
+    The card balance right after the cursor row (right before it, when
+    ``inclusive``): the closing balance of the cursor's day less that day's
+    rows and balance adjustments that sort after it.
+    """
+    created_at, _ = cursor
+    next_day = datetime.combine(created_at.date() + timedelta(days=1), time.min)
+    parts = []
+    for table, seq, signed, _ in _feed_branches(owner_id, account_id):
+        key = tuple_(table.created_at, seq)
+        parts.append(
+            select(signed.label("signed"))
+            .where(table.account_id == account_id)
+            .where(table.owner_id == owner_id)
+            .where(table.is_active == True)
+            .where(table.created_at >= created_at)
+            .where(table.created_at < next_day)
+            .where(key >= tuple_(*cursor) if inclusive else key > tuple_(*cursor))
+        )
+    rows = union_all(*parts).subquery("same_day")
+    later = select(func.coalesce(func.sum(rows.c.signed), 0)).scalar_subquery()
+    return (
+        snapshots.closing_expression(account_id, created_at.date())
+        - later
+        - _adjustments(owner_id, account_id, created_at, next_day)
+    )
+
+
+def feed_listing(
+    owner_id: int,
+    account_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    """
+    One page of a card's active incomes and expenses interleaved newest
+    first, each with ``balance_after``: the card balance right after that
+    transaction.
+
+    Returns ``(query, feed)``; page it with ``keyset_page`` on
+    ``feed.c.created_at`` and ``feed.c.seq`` with the same cursors and
+    limit. ``seq`` is ``2 * id`` for incomes and ``2 * id + 1`` for
+    expenses so rows from the two tables never tie on the pagination key.
+
+    The dates and the cursor go into both branches, which take at most
+    ``limit + 1`` rows each, so only the page window is read. The running
+    balance starts from the page edge: the stored balance on the first
+    page, the closing balance of ``end`` from the daily history when
+    ``end`` is given, or the cursor day's closing balance less that day's
+    rows past the cursor. Balance adjustments between a row and the page
+    edge (hand-set balances) are taken out the same way.
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+    parts = []
+    for table, seq, _, branch in _feed_branches(owner_id, account_id):
+        branch = date_bounds(branch, table.created_at, start, end)
+        key = tuple_(table.created_at, seq)
+        if before_key is not None:
+            branch = branch.where(key > tuple_(*before_key)).order_by(table.created_at, table.id)
+        else:
+            if after_key is not None:
+                branch = branch.where(key < tuple_(*after_key))
+            branch = branch.order_by(table.created_at.desc(), table.id.desc())
+        parts.append(select(branch.limit(limit + 1).subquery()))
+    combined = union_all(*parts).subquery("combined")
+
+    if before_key is not None:
+        # the balance right after the cursor row, plus everything up to the row
+        start_balance = _cursor_balance(owner_id, account_id, before_key, inclusive=False)
+        running = func.sum(combined.c.signed).over(
+            order_by=(combined.c.created_at, combined.c.seq), rows=(None, 0)
+        )
+        between = _adjustments(owner_id, account_id, before_key[0], combined.c.created_at)
+        balance_after = start_balance + running + between
+    else:
+        # the balance right before the page edge, less everything newer than the row
+        edge = None
+        if after_key is not None:
+            start_balance = _cursor_balance(owner_id, account_id, after_key, inclusive=True)
+            edge = after_key[0]
+        elif end is not None:
+            start_balance = snapshots.closing_expression(account_id, end)
+            edge = datetime.combine(end + timedelta(days=1), time.min)
+        else:
+            start_balance = (
+                select(models.Accounts.balance)
+                .where(models.Accounts.id == account_id)
+                .where(models.Accounts.owner_id == owner_id)
+                .scalar_subquery()
+            )
+        newer = func.sum(combined.c.signed).over(
+            order_by=(combined.c.created_at.desc(), combined.c.seq.desc()), rows=(None, -1)
+        )
+        between = _adjustments(owner_id, account_id, combined.c.created_at, edge)
+        balance_after = start_balance - func.coalesce(newer, 0) - between
+    feed = select(combined, balance_after.label("balance_after")).subquery("feed")
+    return select(feed), feed
@@ -0,0 +1,101 @@
+"""
+In-process cache of each user's account, income and expense types.
+
+The add/edit forms read these small lists on every page view. Entries are
+keyed by ``(user_id, kind)``, bounded in number (least recently used are
+dropped first) and expire after a TTL. Writes in routers/custom_data.py
+invalidate the affected entry straight away; the TTL bounds how long other
+worker processes can serve a stale list.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+TYPE_CACHE_SIZE = int(os.getenv("TYPE_CACHE_SIZE", 4096))
+TYPE_CACHE_TTL = float(os.getenv("TYPE_CACHE_TTL", 300))
+
+TYPE_MODELS = {
+    "account-type": models.AccountTypes,
+    "income-type": models.IncomeTypes,
+    "expense-type": models.ExpenseTypes,
+}
+
+
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            if expires_at is None:
+                expires_at = time.monotonic() + self.ttl
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+type_cache = LRUCache(TYPE_CACHE_SIZE, TYPE_CACHE_TTL)
+
+
+async def get_types(
+    db: AsyncSession, user_id: int, kind: str, active_only: bool = False
+):
+    """
+    The user's types of ``kind`` ("account-type", "income-type" or
+    "expense-type") as read-only rows with id, name, description and
+    is_active.
+    """
+    rows = type_cache.get((user_id, kind))
+    if rows is None:
+        table = TYPE_MODELS[kind]
+        rows = (
+            await db.execute(
+                select(table.id, table.name, table.description, table.is_active)
+                .where(table.owner_id == user_id)
+                .order_by(table.id)
+            )
+        ).all()
+        type_cache.set((user_id, kind), rows)
+    if active_only:
+        return [row for row in rows if row.is_active]
+    return rows
+
+
+def invalidate_types(user_id: int, kind: str):
+    type_cache.invalidate((user_id, kind))
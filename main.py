@@ -1,21 +1,57 @@
-from fastapi import FastAPI, status
-from starlette.staticfiles import StaticFiles
-from starlette.responses import RedirectResponse
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
-import models
-from database import engine
-from routers import auth, cards, custom_data, transactions
+from fastapi import Depends, FastAPI, status
+from starlette.responses import PlainTextResponse, RedirectResponse
 
-app = FastAPI()
+from assets import PrecompressedStaticFiles
+import database
+from database import dispose_async_engine, init_async_engine
+from hashing import password_hasher
+from metrics import RequestMetricsMiddleware, render_prometheus
+import partitions
+import recurring
+from templating import precompile_templates
+from routers import analytics, api_v1, auth, budgets, cards, custom_data, stats, transactions
 
-models.Base.metadata.create_all(bind=engine)
 
-app.mount("/static", StaticFiles(directory='static'), name='static')
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the schema is owned by alembic (see README), startup never touches it
+    init_async_engine()
+    precompile_templates()
+    background = [
+        asyncio.create_task(partitions.maintain(database.async_engine)),
+        asyncio.create_task(recurring.run()),
+    ]
+    yield
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    password_hasher.shutdown()
+    await dispose_async_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware, routes=app.router.routes)
+
+app.mount("/static", PrecompressedStaticFiles(directory='static'), name='static')
 
 @app.get("/")
 async def root():
     return RedirectResponse(url='/cards', status_code=status.HTTP_302_FOUND)
 
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+    dependencies=[Depends(stats.require_stats_token)],
+)
+async def prometheus_metrics():
+    pool = database.async_engine.sync_engine.pool if database.async_engine else None
+    return PlainTextResponse(render_prometheus(pool), media_type="text/plain; version=0.0.4")
+
 app.include_router(
     auth.router,
     prefix="/auth",
@@ -39,4 +75,29 @@ app.include_router(
     prefix='/transactions',
     tags=['transactions'],
     responses={404: {"description": "Not found"}}
-)
\ No newline at end of file
+)
+app.include_router(
+    budgets.router,
+    prefix='/budgets',
+    tags=['budgets'],
+    responses={404: {"description": "Not found"}}
+)
+app.include_router(
+    analytics.router,
+    prefix='/analytics',
+    tags=['analytics'],
+    responses={404: {"description": "Not found"}}
+)
+
+app.include_router(
+    api_v1.router,
+    prefix='/api/v1',
+    tags=['api'],
+    responses={401: {"description": "Not authenticated"}, 404: {"description": "Not found"}}
+)
+
+app.include_router(
+    stats.router,
+    prefix='/stats',
+    tags=['stats'],
+)
@@ -0,0 +1,289 @@
+"""
+Process-local counters and histograms for operational visibility.
+"""
+import bisect
+import logging
+import os
+import time
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# milliseconds
+LATENCY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# requests issuing more SQL statements than this are logged as warnings
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 10))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs, the last bound being +Inf."""
+        running = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in self.cumulative()
+            },
+        }
+
+
+class PoolStats:
+    def __init__(self):
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.wait_ms = Histogram()
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.wait_ms.observe((time.perf_counter() - started) * 1000)
+
+
+def instrument_pool(engine):
+    """Count connection churn and checkouts on ``engine`` (a sync Engine)."""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_stats.connects += 1
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        pool_stats.closes += 1
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.invalidations += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_stats.checkins += 1
+
+
+def pool_snapshot(pool, settings: dict):
+    return {
+        "settings": settings,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "connects": pool_stats.connects,
+        "closes": pool_stats.closes,
+        "invalidations": pool_stats.invalidations,
+        "checkouts": pool_stats.checkouts,
+        "checkins": pool_stats.checkins,
+        "timeouts": pool_stats.timeouts,
+        "wait_ms": pool_stats.wait_ms.snapshot(),
+    }
+
+
+class RequestSQL:
+    __slots__ = ("queries", "db_ms")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+
+
+# set by RequestMetricsMiddleware for the duration of each request
+current_request_sql: ContextVar = ContextVar("current_request_sql", default=None)
+
+
+def instrument_queries(engine):
+    """Count statements and time spent in the database per request on ``engine``."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        sql = current_request_sql.get()
+        if sql is not None:
+            sql.queries += 1
+            sql.db_ms += (time.perf_counter() - started) * 1000
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(exception_context):
+        # after_cursor_execute does not run for failed statements
+        if exception_context.connection is not None:
+            started = exception_context.connection.info.get("query_started")
+            if started:
+                started.pop()
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency_ms = Histogram()
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_ms = Histogram()
+        self.over_budget = 0
+
+
+route_stats = {}
+_route_stats_lock = Lock()
+
+
+def stats_for(method: str, route: str) -> RouteStats:
+    key = (method, route)
+    stats = route_stats.get(key)
+    if stats is None:
+        with _route_stats_lock:
+            stats = route_stats.setdefault(key, RouteStats())
+    return stats
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording per route latency, SQL statement count and
+    database time. Routes are labelled by their path template (``/cards/{card_id}``),
+    so ids in URLs do not multiply the series.
+    """
+
+    def __init__(self, app, routes, query_budget: int = QUERY_BUDGET):
+        self.app = app
+        self.routes = routes
+        self.query_budget = query_budget
+
+    def route_template(self, scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sql = RequestSQL()
+        token = current_request_sql.set(sql)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            current_request_sql.reset(token)
+            route = self.route_template(scope)
+            stats = stats_for(scope["method"], route)
+            stats.latency_ms.observe(elapsed_ms)
+            stats.queries.observe(sql.queries)
+            stats.db_ms.observe(sql.db_ms)
+            if sql.queries > self.query_budget:
+                stats.over_budget += 1
+                logger.warning(
+                    "%s %s issued %d SQL statements (budget %d, %.1f ms in the database)",
+                    scope["method"],
+                    scope["path"],
+                    sql.queries,
+                    self.query_budget,
+                    sql.db_ms,
+                )
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels):
+    for bound, count in histogram.cumulative():
+        le = "+Inf" if bound == float("inf") else str(bound)
+        yield f"{name}_bucket{_labels(**labels, le=le)} {count}"
+    yield f"{name}_sum{_labels(**labels)} {histogram.total}"
+    yield f"{name}_count{_labels(**labels)} {histogram.count}"
+
+
+def render_prometheus(pool=None) -> str:
+    """All metrics in the Prometheus text exposition format."""
+    families = (
+        ("et_request_duration_milliseconds", "histogram", "Request latency by route.", "latency_ms"),
+        ("et_request_sql_statements", "histogram", "SQL statements issued per request.", "queries"),
+        ("et_request_db_milliseconds", "histogram", "Time spent in the database per request.", "db_ms"),
+    )
+    routes = sorted(route_stats.items())
+    lines = []
+    for name, kind, help_text, attribute in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (method, route), stats in routes:
+            lines.extend(_histogram_lines(name, getattr(stats, attribute), method=method, route=route))
+
+    lines.append("# HELP et_request_over_query_budget_total Requests that went over QUERY_BUDGET.")
+    lines.append("# TYPE et_request_over_query_budget_total counter")
+    for (method, route), stats in routes:
+        lines.append(f"et_request_over_query_budget_total{_labels(method=method, route=route)} {stats.over_budget}")
+
+    counters = (
+        ("connects", pool_stats.connects),
+        ("closes", pool_stats.closes),
+        ("invalidations", pool_stats.invalidations),
+        ("checkouts", pool_stats.checkouts),
+        ("checkins", pool_stats.checkins),
+        ("timeouts", pool_stats.timeouts),
+    )
+    for event_name, value in counters:
+        lines.append(f"# TYPE et_db_pool_{event_name}_total counter")
+        lines.append(f"et_db_pool_{event_name}_total {value}")
+    lines.append("# TYPE et_db_pool_wait_milliseconds histogram")
+    lines.extend(_histogram_lines("et_db_pool_wait_milliseconds", pool_stats.wait_ms))
+    if pool is not None:
+        for gauge, value in (("checked_out", pool.checkedout()), ("overflow", pool.overflow())):
+            lines.append(f"# TYPE et_db_pool_{gauge} gauge")
+            lines.append(f"et_db_pool_{gauge} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,13 @@
-from sqlalchemy import Boolean, Column, Integer, String, Float, ForeignKey, DateTime, Enum
+from sqlalchemy import DDL, Boolean, Column, Integer, String, Float, ForeignKey, Date, DateTime, Enum, Index, UniqueConstraint, event, text
 from sqlalchemy.orm import relationship
 from database import Base
+from partitions import create_initial_partitions
 
 IMPORTANCE = ('Essential', 'Have to have', 'Nice to have', 'Should not have')
+FREQUENCIES = ('weekly', 'monthly')
+# opening: the balance a card was created with; manual: a balance set by hand;
+# migration: what existing cards held beyond their transactions at migration 0007
+ADJUSTMENT_KINDS = ('opening', 'manual', 'migration')
 
 class Users(Base):
     __tablename__ = 'users'
@@ -15,6 +20,8 @@ class Users(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime)
     modified_at = Column(DateTime)
+    # version stamp of the card pages for changes outside the cards, see conditional.py
+    pages_modified_at = Column(DateTime)
 
     accounts = relationship("Accounts", back_populates='owner', cascade='all,delete', passive_deletes=all)
     accounttypes = relationship("AccountTypes", back_populates='owner', cascade='all,delete', passive_deletes=all)
@@ -23,6 +30,9 @@ class Users(Base):
 
 class Accounts(Base):
     __tablename__ = 'accounts'
+    __table_args__ = (
+        Index('ix_accounts_active_owner', 'owner_id', postgresql_where=text('is_active')),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
     description = Column(String(200))
@@ -40,9 +50,19 @@ class Accounts(Base):
 
 class Incomes(Base):
     __tablename__ = 'incomes'
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        Index('ix_incomes_owner_account_created', 'owner_id', 'account_id', 'created_at'),
+        Index(
+            'ix_incomes_active_owner_account_created',
+            'owner_id', 'account_id', 'created_at', 'id',
+            postgresql_where=text('is_active'),
+        ),
+        # monthly partitions, see partitions.py; the key has to be part of the primary key
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     amount = Column(Float)
-    created_at = Column(DateTime)
+    created_at = Column(DateTime, primary_key=True)
     modified_at = Column(DateTime)
     is_active = Column(Boolean, default=True)
     t_type = Column(Integer, ForeignKey('incometypes.id'))
@@ -54,9 +74,19 @@ class Incomes(Base):
 
 class Expenses(Base):
     __tablename__ = 'expenses'
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        Index('ix_expenses_owner_account_created', 'owner_id', 'account_id', 'created_at'),
+        Index(
+            'ix_expenses_active_owner_account_created',
+            'owner_id', 'account_id', 'created_at', 'id',
+            postgresql_where=text('is_active'),
+        ),
+        # monthly partitions, see partitions.py; the key has to be part of the primary key
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     amount = Column(Float)
-    created_at = Column(DateTime)
+    created_at = Column(DateTime, primary_key=True)
     modified_at = Column(DateTime)
     is_active = Column(Boolean, default=True)
     t_type = Column(Integer, ForeignKey('expensetypes.id'))
@@ -70,6 +100,9 @@ class Expenses(Base):
 
 class AccountTypes(Base):
     __tablename__ = 'accounttypes'
+    __table_args__ = (
+        Index('ix_accounttypes_owner', 'owner_id'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
     description = Column(String(200))
@@ -83,6 +116,9 @@ class AccountTypes(Base):
 
 class IncomeTypes(Base):
     __tablename__ = 'incometypes'
+    __table_args__ = (
+        Index('ix_incometypes_owner', 'owner_id'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
     description = Column(String(200))
@@ -96,6 +132,9 @@ class IncomeTypes(Base):
 
 class ExpenseTypes(Base):
     __tablename__ = 'expensetypes'
+    __table_args__ = (
+        Index('ix_expensetypes_owner', 'owner_id'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
     description = Column(String(200))
@@ -104,4 +143,151 @@ class ExpenseTypes(Base):
     modified_at = Column(DateTime)
     owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
 
-    owner = relationship('Users', back_populates='expensetypes')
\ No newline at end of file
+    owner = relationship('Users', back_populates='expensetypes')
+
+
+class MonthlyIncomeTotals(Base):
+    __tablename__ = 'monthly_income_totals'
+    __table_args__ = (
+        Index('ix_monthly_income_totals_owner_month', 'owner_id', 'month'),
+    )
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    t_type = Column(Integer, ForeignKey('incometypes.id'), primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    total = Column(Float, default=0)
+    count = Column(Integer, default=0)
+
+
+class MonthlyExpenseTotals(Base):
+    __tablename__ = 'monthly_expense_totals'
+    __table_args__ = (
+        Index('ix_monthly_expense_totals_owner_month', 'owner_id', 'month'),
+    )
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    t_type = Column(Integer, ForeignKey('expensetypes.id'), primary_key=True)
+    importance = Column(Enum(*IMPORTANCE, name='importance_enum'), primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    total = Column(Float, default=0)
+    count = Column(Integer, default=0)
+
+
+class AccountDailyBalances(Base):
+    __tablename__ = 'account_daily_balances'
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    net = Column(Float, default=0)
+    balance = Column(Float, default=0)
+
+
+class BalanceAdjustments(Base):
+    """Balance changes that are not transactions, so reconcile.py can tell them from drift."""
+    __tablename__ = 'balance_adjustments'
+    __table_args__ = (
+        Index('ix_balance_adjustments_owner_account', 'owner_id', 'account_id'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(10))
+    amount = Column(Float)
+    created_at = Column(DateTime)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'))
+
+
+class RecurringTransactions(Base):
+    __tablename__ = 'recurring_transactions'
+    __table_args__ = (
+        Index('ix_recurring_transactions_active_due', 'next_due', postgresql_where=text('is_active')),
+        Index('ix_recurring_transactions_owner_account', 'owner_id', 'account_id'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(10))
+    # incometypes.id or expensetypes.id, depending on kind
+    t_type = Column(Integer)
+    amount = Column(Float)
+    description = Column(String(200))
+    importance = Column(Enum(*IMPORTANCE, name='importance_enum'))
+    frequency = Column(String(10))
+    # day of the month monthly occurrences fall on, clamped to short months
+    anchor_day = Column(Integer)
+    next_due = Column(DateTime)
+    ends_on = Column(Date)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime)
+    modified_at = Column(DateTime)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'))
+
+
+class RecurringOccurrences(Base):
+    """One row per materialized occurrence, so none is ever booked twice."""
+    __tablename__ = 'recurring_occurrences'
+    recurring_id = Column(
+        Integer, ForeignKey('recurring_transactions.id', ondelete='CASCADE'), primary_key=True
+    )
+    due_at = Column(DateTime, primary_key=True)
+
+
+class Budgets(Base):
+    __tablename__ = 'budgets'
+    __table_args__ = (
+        Index('ix_budgets_active_owner', 'owner_id', postgresql_where=text('is_active')),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    # a budget covers either one expense type or one importance level
+    t_type = Column(Integer, ForeignKey('expensetypes.id'))
+    importance = Column(Enum(*IMPORTANCE, name='importance_enum'))
+    amount = Column(Float)
+    alert_ratio = Column(Float, default=0.8)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime)
+    modified_at = Column(DateTime)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+
+
+class BudgetTotals(Base):
+    __tablename__ = 'budget_totals'
+    budget_id = Column(Integer, ForeignKey('budgets.id', ondelete='CASCADE'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    spent = Column(Float, default=0)
+
+
+class BudgetAlerts(Base):
+    __tablename__ = 'budget_alerts'
+    __table_args__ = (
+        UniqueConstraint('budget_id', 'month', 'threshold'),
+        Index('ix_budget_alerts_unseen_owner', 'owner_id', postgresql_where=text('NOT seen')),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    budget_id = Column(Integer, ForeignKey('budgets.id', ondelete='CASCADE'))
+    month = Column(Date)
+    threshold = Column(Float)
+    spent = Column(Float)
+    seen = Column(Boolean, default=False)
+    created_at = Column(DateTime)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+
+
+# Search indexes (see search.py). They are GIN indexes over postgres-only
+# expressions and operator classes, so they are emitted for postgres only and
+# other databases (the SQLite benchmark seed) get the plain tables.
+SEARCH_EXTENSIONS = ('pg_trgm', 'btree_gin')
+SEARCH_DOCUMENT = "to_tsvector('simple', coalesce(description, ''))"
+
+for _extension in SEARCH_EXTENSIONS:
+    event.listen(
+        Base.metadata,
+        'before_create',
+        DDL(f'CREATE EXTENSION IF NOT EXISTS {_extension}').execute_if(dialect='postgresql'),
+    )
+for _table in (Incomes.__table__, Expenses.__table__):
+    event.listen(_table, 'after_create', create_initial_partitions)
+    event.listen(_table, 'after_create', DDL(
+        f'CREATE INDEX ix_{_table.name}_owner_search ON {_table.name} USING gin (owner_id, ({SEARCH_DOCUMENT}))'
+    ).execute_if(dialect='postgresql'))
+    event.listen(_table, 'after_create', DDL(
+        f'CREATE INDEX ix_{_table.name}_owner_description_trgm ON {_table.name} '
+        f'USING gin (owner_id, description gin_trgm_ops)'
+    ).execute_if(dialect='postgresql'))
@@ -0,0 +1,69 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+async def keyset_page(
+    db, query, created_col, id_col, after=None, before=None, limit=DEFAULT_PAGE_SIZE
+):
+    """
+    Return one page of the ``query`` select ordered newest first by (created_at, id).
+
+    ``after`` walks towards older rows and ``before`` towards newer rows; both
+    are cursors produced by :func:`encode_cursor`. The result is
+    ``(rows, next_cursor, prev_cursor)`` where a cursor is None when there is
+    nothing further in that direction. The cursor is read back from the rows
+    by the two columns' names, so both have to be selected.
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+    key = tuple_(created_col, id_col)
+
+    if before_key is not None:
+        query = query.where(key > tuple_(*before_key))
+        query = query.order_by(created_col.asc(), id_col.asc())
+    else:
+        if after_key is not None:
+            query = query.where(key < tuple_(*after_key))
+        query = query.order_by(created_col.desc(), id_col.desc())
+
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if before_key is not None:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = after_key is not None, has_more
+
+    def cursor_of(row):
+        return encode_cursor(getattr(row, created_col.key), getattr(row, id_col.key))
+
+    next_cursor = prev_cursor = None
+    if rows and has_older:
+        next_cursor = cursor_of(rows[-1])
+    if rows and has_newer:
+        prev_cursor = cursor_of(rows[0])
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,204 @@
+"""
+Monthly range partitions of the incomes and expenses tables.
+
+Both tables are partitioned by ``created_at`` (migration 0005), one partition
+per calendar month named like ``incomes_2023_01``, plus a ``_default``
+partition that only catches rows outside every monthly range. Partitions
+should exist before rows for their month arrive, so ``ensure_partitions``
+keeps ``PARTITION_MONTHS_AHEAD`` months ready, and it moves rows that did
+land in the default partition into partitions of their own. The app runs it
+once a day in the background (see ``maintain``), one month per transaction;
+``python partitions.py ensure`` does the same from cron or a deploy script.
+Imports create the months they cover before writing them.
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("incomes", "expenses")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 24 * 3600))
+# pg_try_advisory_xact_lock key, so only one worker creates partitions at a time
+ADVISORY_LOCK_KEY = 0x45545061
+# how long one partition's DDL may queue for the parent table's lock before giving up until the next run
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_ddl(table: str, month: date, parent: Optional[str] = None) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {parent or table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def default_partition_ddl(table: str, parent: Optional[str] = None) -> str:
+    return f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {parent or table} DEFAULT"
+
+
+def _exists(conn, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def default_months(conn, table: str) -> list:
+    """The months that have rows in ``table``'s default partition, which should stay empty."""
+    if not _exists(conn, f"{table}_default"):
+        return []
+    rows = conn.execute(
+        text(f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {table}_default")
+    )
+    return sorted(month for (month,) in rows)
+
+
+def create_partition(conn, table: str, month: date):
+    """
+    Create ``table``'s partition for ``month``. Postgres refuses that while
+    the default partition holds rows of the month (back-dated imports, seeded
+    history), so then the default is detached, its rows of the month moved
+    into the new partition and the default attached again, all in the
+    caller's transaction.
+    """
+    default = f"{table}_default"
+    bounds = {"start": month, "end": add_months(month, 1)}
+    in_range = "created_at >= :start AND created_at < :end"
+    stray = _exists(conn, default) and conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"), bounds
+    ).scalar()
+    if not stray:
+        conn.execute(text(partition_ddl(table, month)))
+        return
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(partition_ddl(table, month)))
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {default} WHERE {in_range}"), bounds)
+    conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"), bounds)
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+
+
+def missing_partitions(
+    conn,
+    first: Optional[date] = None,
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+    months: Optional[set] = None,
+) -> list:
+    """
+    ``(table, month)`` of the monthly partitions that do not exist yet: from
+    ``first`` (default: this month) to ``months_ahead`` months from now plus
+    every month with rows in the default partition, or exactly ``months``
+    when given.
+    """
+    if months is None:
+        this_month = date.today().replace(day=1)
+        month = (first or this_month).replace(day=1)
+        last = add_months(this_month, months_ahead)
+        wanted = []
+        while month <= last:
+            wanted.append(month)
+            month = add_months(month, 1)
+    missing = []
+    for table in PARTITIONED_TABLES:
+        if months is None:
+            table_months = set(wanted).union(default_months(conn, table))
+        else:
+            table_months = {month.replace(day=1) for month in months}
+        # skip existing ones without taking CREATE TABLE's lock on the parent
+        missing += [
+            (table, month) for month in sorted(table_months)
+            if not _exists(conn, partition_name(table, month))
+        ]
+    return missing
+
+
+def ensure_partitions(
+    conn, first: Optional[date] = None, months_ahead: int = PARTITION_MONTHS_AHEAD
+) -> list:
+    """
+    Create the partitions ``missing_partitions`` lists, all in the caller's
+    transaction on a sync connection (migrations, seeds). Returns the names
+    of the partitions it created.
+    """
+    created = []
+    for table, month in missing_partitions(conn, first, months_ahead):
+        create_partition(conn, table, month)
+        created.append(partition_name(table, month))
+    return created
+
+
+def create_initial_partitions(table, connection, **kw):
+    """``after_create`` hook for create_all: a default and the current months."""
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(default_partition_ddl(table.name)))
+    this_month = date.today().replace(day=1)
+    for offset in range(PARTITION_MONTHS_AHEAD + 1):
+        connection.execute(text(partition_ddl(table.name, add_months(this_month, offset))))
+
+
+async def ensure_partitions_once(engine, months: Optional[set] = None) -> list:
+    """
+    Create the missing partitions (see ``missing_partitions``) one per
+    transaction, so the parent table is locked for one month's DDL at a time
+    and never longer than ``PARTITION_LOCK_TIMEOUT`` is spent queueing for
+    it. With ``months`` it waits for a concurrent run instead of leaving the
+    work to it, since the caller is about to write those months.
+    """
+    async with engine.connect() as conn:
+        missing = await conn.run_sync(missing_partitions, months=months)
+    created = []
+    for table, month in missing:
+        async with engine.begin() as conn:
+            if months is None:
+                locked = await conn.scalar(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+                )
+                if not locked:
+                    break
+            else:
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            await conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+            name = partition_name(table, month)
+            if not await conn.run_sync(_exists, name):
+                await conn.run_sync(create_partition, table, month)
+                created.append(name)
+    return created
+
+
+async def ensure_logged(engine, months: Optional[set] = None):
+    """``ensure_partitions_once`` for callers that must not fail on it; ``maintain`` retries."""
+    try:
+        created = await ensure_partitions_once(engine, months)
+        if created:
+            logger.info("created partitions %s", ", ".join(created))
+    except Exception:
+        logger.exception("creating partitions failed")
+
+
+async def maintain(engine, interval: float = MAINTENANCE_INTERVAL):
+    """Background task: keep future partitions in place while the app runs."""
+    while True:
+        await ensure_logged(engine)
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["ensure"]:
+        raise SystemExit("usage: python partitions.py ensure")
+    from database import get_engine
+
+    with get_engine().begin() as conn:
+        names = ensure_partitions(conn)
+    print("created: " + (", ".join(names) or "nothing, all partitions exist"))
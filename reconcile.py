@@ -0,0 +1,243 @@
+"""
+Check every card balance against its transactions, and optionally repair it.
+
+A card should hold its balance adjustments (the balance it was created with,
+balances set by hand, see ``models.ADJUSTMENT_KINDS``) plus its active
+incomes minus its active expenses. Anything else, such as a lost update, is
+drift. ``--adjustments`` lists the manual and migration adjustments, which
+are the other places a balance changed without a transaction. Cards are
+split by owner into ranges of about ``--chunk``
+cards; each range is one grouped query (``GROUP BY account_id`` over both
+transaction tables, read through the owner indexes) run by a pool of worker
+processes, each with its own connection. ``--repair`` then fixes the cards
+that drifted one at a time, under the card's row lock, so it can run while
+the app is taking writes.
+
+    python reconcile.py
+    python reconcile.py --workers 8 --chunk 5000 --repair
+    python reconcile.py --adjustments
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select, union_all, update
+
+import models
+import snapshots
+from database import get_engine
+
+TOLERANCE = 0.005
+CHUNK_SIZE = 5000
+SHOW = 50
+
+
+@dataclass
+class Drift:
+    account_id: int
+    owner_id: int
+    balance: float
+    expected: float
+    repaired: bool = False
+
+    @property
+    def difference(self) -> float:
+        return self.balance - self.expected
+
+
+def owner_ranges(conn, chunk_size: int = CHUNK_SIZE) -> list:
+    """Contiguous ``(first, last, cards)`` owner id ranges of about ``chunk_size`` cards each."""
+    counts = conn.execute(
+        select(models.Accounts.owner_id, func.count())
+        .group_by(models.Accounts.owner_id)
+        .order_by(models.Accounts.owner_id)
+    )
+    ranges = []
+    first, cards = None, 0
+    for owner_id, count in counts:
+        if first is None:
+            first = owner_id
+        cards += count
+        if cards >= chunk_size:
+            ranges.append((first, owner_id, cards))
+            first, cards = None, 0
+    if first is not None:
+        ranges.append((first, owner_id, cards))
+    return ranges
+
+
+def _expected(*conditions):
+    """``(totals, expected)`` for the transactions and adjustments matching ``conditions(table)``."""
+    adjustments = models.BalanceAdjustments
+    signed = union_all(
+        select(models.Incomes.account_id, models.Incomes.amount.label("signed"))
+        .where(*(condition(models.Incomes) for condition in conditions))
+        .where(models.Incomes.is_active == True),
+        select(models.Expenses.account_id, (-models.Expenses.amount).label("signed"))
+        .where(*(condition(models.Expenses) for condition in conditions))
+        .where(models.Expenses.is_active == True),
+        select(adjustments.account_id, adjustments.amount.label("signed"))
+        .where(*(condition(adjustments) for condition in conditions)),
+    ).subquery("signed")
+    totals = (
+        select(signed.c.account_id, func.sum(signed.c.signed).label("net"))
+        .group_by(signed.c.account_id)
+        .subquery("totals")
+    )
+    expected = func.coalesce(totals.c.net, 0)
+    return totals, expected
+
+
+def drift_query(first_owner: int, last_owner: int, tolerance: float = TOLERANCE):
+    """The cards of owners ``first_owner``..``last_owner`` whose balance is off."""
+    totals, expected = _expected(lambda table: table.owner_id.between(first_owner, last_owner))
+    balance = func.coalesce(models.Accounts.balance, 0)
+    return (
+        select(
+            models.Accounts.id,
+            models.Accounts.owner_id,
+            balance.label("balance"),
+            expected.label("expected"),
+        )
+        .outerjoin(totals, totals.c.account_id == models.Accounts.id)
+        .where(models.Accounts.owner_id.between(first_owner, last_owner))
+        .where(func.abs(balance - expected) > tolerance)
+    )
+
+
+def repair(conn, drift: Drift, tolerance: float = TOLERANCE) -> Optional[Drift]:
+    """
+    Set one card's balance to its expected value in its own transaction.
+
+    The card row is locked before the transactions are summed, so writers
+    that committed earlier are counted and later ones add their own delta on
+    top of the repaired balance. The daily history gets the correction
+    on today's date. Returns None when the card no longer drifts.
+    """
+    card = models.Accounts
+    with conn.begin():
+        balance = conn.scalar(
+            select(func.coalesce(card.balance, 0)).where(card.id == drift.account_id).with_for_update()
+        )
+        totals, expected = _expected(
+            lambda table: table.owner_id == drift.owner_id,
+            lambda table: table.account_id == drift.account_id,
+        )
+        expected = conn.scalar(
+            select(expected)
+            .select_from(card)
+            .outerjoin(totals, totals.c.account_id == card.id)
+            .where(card.id == drift.account_id)
+        )
+        drift = Drift(drift.account_id, drift.owner_id, balance, expected)
+        delta = expected - balance
+        if abs(delta) <= tolerance:
+            return None
+        conn.execute(
+            update(card)
+            .where(card.id == drift.account_id)
+            .values(balance=expected, modified_at=datetime.now())
+        )
+        for statement in snapshots.record_statements(
+            drift.account_id, drift.owner_id, datetime.now().date(), delta
+        ):
+            conn.execute(statement)
+    drift.repaired = True
+    return drift
+
+
+def _init_worker():
+    # drop the connections inherited from the parent, without closing them under it
+    get_engine().dispose(close=False)
+
+
+def check_range(first_owner: int, last_owner: int, fix: bool, tolerance: float) -> list:
+    """Worker task: the drifted cards of one owner range, repaired when ``fix``."""
+    with get_engine().connect() as conn:
+        drifts = [
+            Drift(row.id, row.owner_id, row.balance, row.expected)
+            for row in conn.execute(drift_query(first_owner, last_owner, tolerance))
+        ]
+        if fix:
+            drifts = [repair(conn, drift, tolerance) for drift in drifts]
+    return [drift for drift in drifts if drift is not None]
+
+
+def reconcile(workers: int, chunk_size: int, fix: bool, tolerance: float = TOLERANCE):
+    """Returns ``(cards checked, drifted cards)``."""
+    with get_engine().connect() as conn:
+        ranges = owner_ranges(conn, chunk_size)
+    drifts = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [
+            pool.submit(check_range, first, last, fix, tolerance) for first, last, _ in ranges
+        ]
+        for future in futures:
+            drifts.extend(future.result())
+    return sum(cards for _, _, cards in ranges), drifts
+
+
+def adjustment_listing(limit: int = SHOW):
+    """The largest manual and migration adjustments, with the count and sum of each kind."""
+    adjustments = models.BalanceAdjustments
+    kinds = (
+        select(adjustments.kind, func.count(), func.sum(adjustments.amount))
+        .where(adjustments.kind != "opening")
+        .group_by(adjustments.kind)
+        .order_by(adjustments.kind)
+    )
+    largest = (
+        select(adjustments)
+        .where(adjustments.kind != "opening")
+        .order_by(func.abs(adjustments.amount).desc())
+        .limit(limit)
+    )
+    return kinds, largest
+
+
+def show_adjustments():
+    kinds, largest = adjustment_listing()
+    with get_engine().connect() as conn:
+        for kind, count, total in conn.execute(kinds):
+            print(f"{count} {kind} adjustments, {total:+.2f} in total")
+        for row in conn.scalars(largest):
+            print(f"card {row.account_id} (owner {row.owner_id}): {row.kind} {row.amount:+.2f} "
+                  f"on {row.created_at:%Y-%m-%d %H:%M}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="cards per worker task")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--repair", action="store_true", help="set drifted balances to the expected value")
+    parser.add_argument(
+        "--adjustments", action="store_true", help="list balances set by hand and found by migration 0007"
+    )
+    args = parser.parse_args()
+    if args.adjustments:
+        show_adjustments()
+        return
+
+    started = time.perf_counter()
+    checked, drifts = reconcile(args.workers, args.chunk, args.repair, args.tolerance)
+    drifts.sort(key=lambda drift: abs(drift.difference), reverse=True)
+    for drift in drifts[:SHOW]:
+        print(f"card {drift.account_id} (owner {drift.owner_id}): balance {drift.balance:.2f}, "
+              f"expected {drift.expected:.2f}, off by {drift.difference:+.2f}"
+              + (" - repaired" if drift.repaired else ""))
+    if len(drifts) > SHOW:
+        print(f"... and {len(drifts) - SHOW} more")
+    repaired = sum(drift.repaired for drift in drifts)
+    print(f"checked {checked} cards in {time.perf_counter() - started:.1f}s: "
+          f"{len(drifts)} drifted, {repaired} repaired")
+    if len(drifts) > repaired:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Recurring incomes and expenses (rent, salary, subscriptions).
+
+A template holds the transaction to book, its card and type, a frequency and
+``next_due``. Every app instance runs ``run`` in the background; each pass
+books the due occurrences in batches of up to ``BATCH_SIZE``, one database
+transaction per batch: one executemany per transaction table, one balance
+update per card and one rollup upsert, through the same ledger helpers as
+an import. Occurrences missed while the app was down are caught up.
+
+Nothing is booked twice: an occurrence is only booked when its
+``(template, due_at)`` row could be inserted into ``recurring_occurrences``,
+in the same transaction that books it and advances ``next_due``. An advisory
+lock keeps other workers from doing the same batch in parallel.
+"""
+import asyncio
+import calendar
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+import ledger
+import models
+from budgets import BudgetDeltas
+from rollups import RollupTotals
+from snapshots import DailyDeltas
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", 1000))
+INTERVAL = float(os.getenv("RECURRING_INTERVAL", 60))
+# pg_try_advisory_xact_lock key, see partitions.ADVISORY_LOCK_KEY
+ADVISORY_LOCK_KEY = 0x45545262
+
+
+def next_due(frequency: str, anchor_day: int, due: datetime) -> datetime:
+    """The occurrence after ``due``."""
+    if frequency == "weekly":
+        return due + timedelta(days=7)
+    index = due.year * 12 + due.month
+    year, month = index // 12, index % 12 + 1
+    day = min(anchor_day, calendar.monthrange(year, month)[1])
+    return datetime.combine(date(year, month, day), due.time())
+
+
+def new_template(
+    owner_id: int,
+    account_id: int,
+    kind: str,
+    t_type: int,
+    amount: float,
+    description: str,
+    frequency: str,
+    starts_on: date,
+    ends_on: Optional[date] = None,
+    importance: Optional[str] = None,
+) -> models.RecurringTransactions:
+    """A template whose first occurrence is booked at the start of ``starts_on``."""
+    template = models.RecurringTransactions()
+    template.kind = kind
+    template.t_type = t_type
+    template.amount = amount
+    template.description = description
+    template.importance = importance if kind == "expense" else None
+    template.frequency = frequency
+    template.anchor_day = starts_on.day
+    template.next_due = datetime.combine(starts_on, time.min)
+    template.ends_on = ends_on
+    template.is_active = True
+    template.created_at = datetime.now()
+    template.modified_at = datetime.now()
+    template.owner_id = owner_id
+    template.account_id = account_id
+    return template
+
+
+def listing(owner_id: int, account_id: int):
+    """The card's active templates, next due first."""
+    recurring = models.RecurringTransactions
+    return (
+        select(recurring)
+        .where(recurring.owner_id == owner_id)
+        .where(recurring.account_id == account_id)
+        .where(recurring.is_active == True)
+        .order_by(recurring.next_due, recurring.id)
+    )
+
+
+async def stop(
+    db: AsyncSession, owner_id: int, account_id: int, recurring_id: int
+) -> Optional[models.RecurringTransactions]:
+    """Stop booking a template, or None when it is not the owner's. Does not commit."""
+    recurring = models.RecurringTransactions
+    template = await db.scalar(
+        select(recurring)
+        .where(recurring.id == recurring_id)
+        .where(recurring.owner_id == owner_id)
+        .where(recurring.account_id == account_id)
+        .where(recurring.is_active == True)
+    )
+    if template is None:
+        return None
+    template.is_active = False
+    template.modified_at = datetime.now()
+    return template
+
+
+def _row(template: models.RecurringTransactions, due: datetime, now: datetime) -> dict:
+    row = {
+        "amount": template.amount,
+        "description": template.description,
+        "is_active": True,
+        "t_type": template.t_type,
+        "created_at": due,
+        "modified_at": now,
+        "owner_id": template.owner_id,
+        "account_id": template.account_id,
+    }
+    if template.kind == "expense":
+        row["importance"] = template.importance
+    return row
+
+
+async def materialize_batch(db: AsyncSession, now: datetime) -> tuple:
+    """
+    Book up to ``BATCH_SIZE`` due occurrences. Does not commit. Returns
+    ``(templates advanced, transactions booked)``; ``(0, 0)`` when there
+    is nothing due or another worker holds the lock.
+    """
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(ADVISORY_LOCK_KEY)))
+    if not locked:
+        return 0, 0
+    recurring = models.RecurringTransactions
+    templates = (
+        await db.scalars(
+            select(recurring)
+            .join(models.Accounts, models.Accounts.id == recurring.account_id)
+            .where(recurring.is_active == True)
+            .where(recurring.next_due <= now)
+            .where(models.Accounts.is_active == True)
+            .order_by(recurring.next_due)
+            .limit(BATCH_SIZE)
+            .with_for_update(of=recurring, skip_locked=True)
+        )
+    ).all()
+
+    occurrences = []
+    advanced = 0
+    for template in templates:
+        if len(occurrences) >= BATCH_SIZE:
+            break
+        due = template.next_due
+        while due <= now and len(occurrences) < BATCH_SIZE:
+            if template.ends_on is not None and due.date() > template.ends_on:
+                break
+            occurrences.append((template, due))
+            due = next_due(template.frequency, template.anchor_day, due)
+        template.next_due = due
+        if template.ends_on is not None and due.date() > template.ends_on:
+            template.is_active = False
+        template.modified_at = now
+        advanced += 1
+    if not occurrences:
+        return advanced, 0
+
+    booked = set(
+        (
+            await db.execute(
+                pg_insert(models.RecurringOccurrences)
+                .values([{"recurring_id": template.id, "due_at": due} for template, due in occurrences])
+                .on_conflict_do_nothing()
+                .returning(models.RecurringOccurrences.recurring_id, models.RecurringOccurrences.due_at)
+            )
+        ).all()
+    )
+    incomes, expenses, nets = [], [], {}
+    for template, due in occurrences:
+        if (template.id, due) not in booked:
+            continue
+        (incomes if template.kind == "income" else expenses).append(_row(template, due, now))
+        signed = template.amount if template.kind == "income" else -template.amount
+        key = (template.account_id, template.owner_id)
+        nets[key] = nets.get(key, 0.0) + signed
+
+    totals = RollupTotals()
+    spend = BudgetDeltas()
+    days = DailyDeltas()
+    await ledger.insert_transactions(db, incomes, expenses, totals, spend, days)
+    await totals.flush(db)
+    await spend.flush(db)
+    # in card order, so concurrent writers lock the cards in the same order
+    for (account_id, owner_id), net in sorted(nets.items()):
+        await ledger.apply_balance_delta(db, account_id, owner_id, net)
+    await days.flush(db)
+    return advanced, len(incomes) + len(expenses)
+
+
+async def materialize_due(now: Optional[datetime] = None) -> int:
+    """Book everything due by ``now``, one committed batch at a time. Returns the count."""
+    booked = 0
+    while True:
+        async with database.AsyncSessionLocal() as db:
+            advanced, count = await materialize_batch(db, now or datetime.now())
+            await db.commit()
+        booked += count
+        if advanced == 0:
+            return booked
+
+
+async def run(interval: float = INTERVAL):
+    """Background task: book due occurrences every ``interval`` seconds."""
+    while True:
+        try:
+            booked = await materialize_due()
+            if booked:
+                logger.info("booked %d recurring transactions", booked)
+        except Exception:
+            logger.exception("booking recurring transactions failed, retrying in %.0fs", interval)
+        await asyncio.sleep(interval)
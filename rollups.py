@@ -0,0 +1,156 @@
+"""
+Per-account, per-month income and expense totals.
+
+The transaction handlers keep these tables current by recording every change
+as a delta, so the analytics page only ever reads a few hundred rollup rows no
+matter how long an account's history is. ``python rollups.py backfill``
+rebuilds them from the transaction tables.
+"""
+import sys
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import Date, delete, func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+
+def month_of(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+INCOME_KEY = ("account_id", "owner_id", "month", "t_type")
+EXPENSE_KEY = INCOME_KEY + ("importance",)
+
+
+async def _upsert(db: AsyncSession, table, rows: list):
+    statement = pg_insert(table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.__table__.primary_key],
+        set_={
+            "total": table.total + statement.excluded.total,
+            "count": table.count + statement.excluded.count,
+        },
+    )
+    await db.execute(statement)
+
+
+def _bucket(row: dict, key_columns) -> Optional[tuple]:
+    """
+    The rollup key of ``row``, or None for legacy rows without a type or
+    importance: the key columns are the primary key, so such rows stay out of
+    the rollups (the backfill skips them too) until they are edited.
+    """
+    key = tuple(
+        month_of(row["created_at"]) if name == "month" else row[name]
+        for name in key_columns
+    )
+    return None if None in key else key
+
+
+def _as_row(model, key_columns) -> dict:
+    row = {name: getattr(model, name) for name in key_columns if name != "month"}
+    row["created_at"] = model.created_at
+    return row
+
+
+async def record_income(
+    db: AsyncSession, income: models.Incomes, amount: float, count: int
+):
+    """Add ``amount``/``count`` to the rollup bucket ``income`` falls into."""
+    key = _bucket(_as_row(income, INCOME_KEY), INCOME_KEY)
+    if key is None:
+        return
+    row = dict(zip(INCOME_KEY, key), total=amount, count=count)
+    await _upsert(db, models.MonthlyIncomeTotals, [row])
+
+
+async def record_expense(
+    db: AsyncSession, expense: models.Expenses, amount: float, count: int
+):
+    """Add ``amount``/``count`` to the rollup bucket ``expense`` falls into."""
+    key = _bucket(_as_row(expense, EXPENSE_KEY), EXPENSE_KEY)
+    if key is None:
+        return
+    row = dict(zip(EXPENSE_KEY, key), total=amount, count=count)
+    await _upsert(db, models.MonthlyExpenseTotals, [row])
+
+
+class RollupTotals:
+    """
+    Collects rollup deltas for bulk writers (imports, recurring transactions)
+    so they can be written with one multi-row upsert per table at the end
+    instead of one statement per transaction.
+    """
+
+    def __init__(self):
+        self.incomes = {}
+        self.expenses = {}
+
+    @staticmethod
+    def _add(buckets: dict, key: Optional[tuple], amount: float):
+        if key is None:
+            return
+        total, count = buckets.get(key, (0.0, 0))
+        buckets[key] = (total + amount, count + 1)
+
+    def add_income(self, row: dict):
+        self._add(self.incomes, _bucket(row, INCOME_KEY), row["amount"])
+
+    def add_expense(self, row: dict):
+        self._add(self.expenses, _bucket(row, EXPENSE_KEY), row["amount"])
+
+    async def flush(self, db: AsyncSession):
+        for table, key_columns, buckets in (
+            (models.MonthlyIncomeTotals, INCOME_KEY, self.incomes),
+            (models.MonthlyExpenseTotals, EXPENSE_KEY, self.expenses),
+        ):
+            if buckets:
+                rows = [
+                    dict(zip(key_columns, key), total=total, count=count)
+                    for key, (total, count) in buckets.items()
+                ]
+                await _upsert(db, table, rows)
+            buckets.clear()
+
+
+def _rebuild_statements():
+    for source, rollup, keys in (
+        (models.Incomes, models.MonthlyIncomeTotals, ("t_type",)),
+        (models.Expenses, models.MonthlyExpenseTotals, ("t_type", "importance")),
+    ):
+        month = func.date_trunc("month", source.created_at).cast(Date)
+        group = [source.account_id, source.owner_id, month] + [
+            getattr(source, key) for key in keys
+        ]
+        query = (
+            select(*group, func.sum(source.amount), func.count())
+            .where(source.is_active == True)
+            .where(*(getattr(source, key).isnot(None) for key in keys))
+            .group_by(*group)
+        )
+        columns = ["account_id", "owner_id", "month", *keys, "total", "count"]
+        yield delete(rollup)
+        yield insert(rollup).from_select(columns, query)
+
+
+def backfill(engine):
+    """
+    Rebuild both rollup tables from scratch in one transaction. Writes to the
+    transaction tables wait until it finishes so no delta is lost or counted
+    twice.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE incomes, expenses IN SHARE MODE"))
+        for statement in _rebuild_statements():
+            conn.execute(statement)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        raise SystemExit("usage: python rollups.py backfill")
+    from database import get_engine
+
+    backfill(get_engine())
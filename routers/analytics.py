@@ -0,0 +1,92 @@
+from datetime import date, datetime
+import sys
+
+sys.path.append("..")
+
+from starlette.responses import RedirectResponse
+from starlette import status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, APIRouter, Request, Query
+from fastapi.responses import HTMLResponse
+
+import models
+from database import get_db
+from templating import templates
+from .auth import get_current_user
+
+
+router = APIRouter()
+
+
+def months_back(months: int) -> date:
+    """First day of the month ``months - 1`` months before the current one."""
+    today = datetime.now()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _totals(rollup, owner_id: int, since: date, *group):
+    return (
+        select(*group, func.sum(rollup.total).label("total"))
+        .join(models.Accounts, models.Accounts.id == rollup.account_id)
+        .where(rollup.owner_id == owner_id)
+        .where(rollup.month >= since)
+        .where(models.Accounts.is_active == True)
+        .group_by(*group)
+    )
+
+
+@router.get("/", response_class=HTMLResponse)
+async def analytics_page(
+    request: Request,
+    months: int = Query(24, ge=1, le=120),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    since = months_back(months)
+    expenses = models.MonthlyExpenseTotals
+    incomes = models.MonthlyIncomeTotals
+
+    by_category = (
+        await db.execute(
+            _totals(expenses, user.get("id"), since, models.ExpenseTypes.name)
+            .join(models.ExpenseTypes, models.ExpenseTypes.id == expenses.t_type)
+            .order_by(func.sum(expenses.total).desc())
+        )
+    ).all()
+    by_importance = (
+        await db.execute(
+            _totals(expenses, user.get("id"), since, expenses.importance)
+            .order_by(expenses.importance)
+        )
+    ).all()
+    by_income_type = (
+        await db.execute(
+            _totals(incomes, user.get("id"), since, models.IncomeTypes.name)
+            .join(models.IncomeTypes, models.IncomeTypes.id == incomes.t_type)
+            .order_by(func.sum(incomes.total).desc())
+        )
+    ).all()
+
+    by_month = {}
+    for rollup, column in ((incomes, "income"), (expenses, "expense")):
+        rows = await db.execute(_totals(rollup, user.get("id"), since, rollup.month))
+        for month, total in rows:
+            by_month.setdefault(month, {"income": 0, "expense": 0})[column] = total
+
+    return templates.TemplateResponse(
+        "analytics.html",
+        {
+            "request": request,
+            "user": user,
+            "months": months,
+            "since": since,
+            "by_category": by_category,
+            "by_importance": by_importance,
+            "by_income_type": by_income_type,
+            "by_month": sorted(by_month.items(), reverse=True),
+        },
+    )
@@ -0,0 +1,628 @@
+"""
+Versioned JSON API mirroring the card, transaction and custom data pages.
+
+Authenticate with ``POST /api/v1/token`` and send the token back as an
+``Authorization: Bearer`` header (the browser session cookie works too).
+Handlers return ``ORJSONResponse`` objects directly so FastAPI skips its
+``jsonable_encoder`` pass and orjson serialises datetimes itself.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+import sys
+
+sys.path.append("..")
+
+from fastapi import Depends, APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import budgets
+import conditional
+import models
+import ledger
+import recurring
+import snapshots
+from database import get_db
+from lookup_cache import TYPE_MODELS, get_types, invalidate_types
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page
+from rollups import RollupTotals
+from search import SEARCH_LIMIT, search_query
+from .auth import authenticate_user, create_access_token, get_current_user
+
+BATCH_LIMIT = 1000
+
+IMPORTANCE_PATTERN = "^(" + "|".join(models.IMPORTANCE) + ")$"
+
+router = APIRouter(default_response_class=ORJSONResponse)
+
+
+class CardIn(BaseModel):
+    name: str = Field(..., max_length=100)
+    description: str = Field("", max_length=200)
+    card_type: int
+    balance: float = 0
+
+
+class CustomDataIn(BaseModel):
+    name: str = Field(..., max_length=100)
+    description: str = Field("", max_length=200)
+
+
+class IncomeIn(BaseModel):
+    t_type: int
+    amount: float = Field(..., gt=0)
+    description: str = Field("", max_length=200)
+
+
+class ExpenseIn(IncomeIn):
+    importance: str = Field(..., regex=IMPORTANCE_PATTERN)
+
+
+class IncomeUpdate(IncomeIn):
+    # the transaction's current created_at, as returned when it was listed:
+    # it lets the lookup skip the other monthly partitions
+    created_at: Optional[datetime] = None
+
+
+class ExpenseUpdate(IncomeUpdate):
+    importance: Optional[str] = Field(None, regex=IMPORTANCE_PATTERN)
+
+
+class RecurringIn(IncomeIn):
+    kind: str = Field(..., regex="^(income|expense)$")
+    importance: Optional[str] = Field(None, regex=IMPORTANCE_PATTERN)
+    frequency: str = Field(..., regex="^(" + "|".join(models.FREQUENCIES) + ")$")
+    starts_on: date
+    ends_on: Optional[date] = None
+
+
+class BatchIn(BaseModel):
+    incomes: List[IncomeIn] = Field(default_factory=list, max_items=BATCH_LIMIT)
+    expenses: List[ExpenseIn] = Field(default_factory=list, max_items=BATCH_LIMIT)
+
+
+async def api_user(request: Request):
+    user = await get_current_user(request)
+    if user is None or user.get("id") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
+def not_found(what: str):
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{what} not found")
+
+
+async def owned_card(db: AsyncSession, user: dict, card_id: int) -> models.Accounts:
+    card = await db.scalar(
+        select(models.Accounts)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == user.get("id"))
+        .where(models.Accounts.is_active == True)
+    )
+    if card is None:
+        raise not_found("card")
+    return card
+
+
+async def check_types(db: AsyncSession, user: dict, kind: str, type_ids):
+    active = {row.id for row in await get_types(db, user.get("id"), kind, active_only=True)}
+    unknown = sorted(set(type_ids) - active)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"unknown {kind} id(s): {unknown}",
+        )
+
+
+def card_json(card) -> dict:
+    return {
+        "id": card.id,
+        "name": card.name,
+        "description": card.description,
+        "card_type": card.card_type,
+        "balance": card.balance,
+        "created_at": card.created_at,
+        "modified_at": card.modified_at,
+    }
+
+
+def transaction_json(row) -> dict:
+    """Works for ORM rows and the ledger listing and feed rows."""
+    item = {
+        "id": row.id,
+        "description": row.description,
+        "amount": row.amount,
+        "created_at": row.created_at,
+        "t_type": row.t_type,
+    }
+    for optional in ("kind", "importance", "type_name", "balance_after"):
+        if hasattr(row, optional):
+            item[optional] = getattr(row, optional)
+    return item
+
+
+def recurring_json(row) -> dict:
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "t_type": row.t_type,
+        "amount": row.amount,
+        "description": row.description,
+        "importance": row.importance,
+        "frequency": row.frequency,
+        "next_due": row.next_due,
+        "ends_on": row.ends_on,
+    }
+
+
+def custom_data_json(row) -> dict:
+    return {"id": row.id, "name": row.name, "description": row.description}
+
+
+@router.post("/token")
+async def issue_token(
+    form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)
+):
+    user = await authenticate_user(form_data.username, form_data.password, db)
+    if user is False:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token = create_access_token(user.username, user.id)
+    return ORJSONResponse({"access_token": token, "token_type": "bearer"})
+
+
+@router.get("/cards")
+async def list_cards(user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)):
+    cards = (
+        await db.scalars(
+            select(models.Accounts)
+            .where(models.Accounts.owner_id == user.get("id"))
+            .where(models.Accounts.is_active == True)
+            .order_by(models.Accounts.id)
+        )
+    ).all()
+    return ORJSONResponse({"items": [card_json(card) for card in cards]})
+
+
+@router.post("/cards", status_code=status.HTTP_201_CREATED)
+async def create_card(
+    body: CardIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    await check_types(db, user, "account-type", [body.card_type])
+    card_model = models.Accounts(**body.dict())
+    card_model.is_active = True
+    card_model.created_at = datetime.now()
+    card_model.modified_at = datetime.now()
+    card_model.owner_id = user.get("id")
+    db.add(card_model)
+    await db.flush()
+    ledger.record_adjustment(db, card_model.id, card_model.owner_id, "opening", card_model.balance)
+    await snapshots.record(
+        db, card_model.id, card_model.owner_id, card_model.created_at.date(), card_model.balance
+    )
+    await db.commit()
+    return ORJSONResponse(card_json(card_model), status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/cards/{card_id}")
+async def read_card(card_id: int, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)):
+    return ORJSONResponse(card_json(await owned_card(db, user, card_id)))
+
+
+@router.put("/cards/{card_id}")
+async def update_card(
+    card_id: int, body: CardIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    card_model = await owned_card(db, user, card_id)
+    await check_types(db, user, "account-type", [body.card_type])
+    for field, value in body.dict(exclude={"balance"}).items():
+        setattr(card_model, field, value)
+    card_model.modified_at = datetime.now()
+    balance = await ledger.set_balance(db, card_id, user.get("id"), body.balance)
+    await db.commit()
+    return ORJSONResponse({**card_json(card_model), "balance": balance})
+
+
+@router.delete("/cards/{card_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_card(card_id: int, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)):
+    card_model = await owned_card(db, user, card_id)
+    card_model.is_active = False
+    card_model.modified_at = datetime.now()
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def _transaction_page(db, query, table, after, before, limit, id_col=None):
+    rows, next_cursor, prev_cursor = await keyset_page(
+        db, query, table.created_at, id_col or table.id, after=after, before=before, limit=limit
+    )
+    return ORJSONResponse(
+        {"items": [transaction_json(row) for row in rows], "next": next_cursor, "prev": prev_cursor}
+    )
+
+
+@router.get("/cards/{card_id}/incomes")
+async def list_incomes(
+    card_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    query = ledger.income_listing(user.get("id"), card_id, start, end)
+    return await _transaction_page(db, query, models.Incomes, after, before, limit)
+
+
+@router.get("/cards/{card_id}/expenses")
+async def list_expenses(
+    card_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    query = ledger.expense_listing(user.get("id"), card_id, start, end)
+    return await _transaction_page(db, query, models.Expenses, after, before, limit)
+
+
+@router.get("/cards/{card_id}/feed")
+async def list_feed(
+    card_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    query, feed = ledger.feed_listing(user.get("id"), card_id, start, end, after, before, limit)
+    return await _transaction_page(db, query, feed.c, after, before, limit, id_col=feed.c.seq)
+
+
+@router.get("/cards/{card_id}/balance")
+async def read_balance(
+    card_id: int,
+    at: Optional[datetime] = None,
+    on: Optional[date] = None,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """The card balance right after ``at``, at the end of ``on``, or now."""
+    if at is None and on is not None:
+        balance = await snapshots.closing_balance(db, card_id, user.get("id"), on)
+    else:
+        balance = await snapshots.balance_at(db, card_id, user.get("id"), at or datetime.now())
+    if balance is None:
+        raise not_found("card")
+    return ORJSONResponse({"balance": balance})
+
+
+@router.get("/cards/{card_id}/balances")
+async def list_balances(
+    card_id: int,
+    start: date,
+    end: Optional[date] = None,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    End-of-day balances for a chart: the balance before ``start`` and every
+    day up to ``end`` (default: today) on which it changed.
+    """
+    opening = await snapshots.closing_balance(db, card_id, user.get("id"), start - timedelta(days=1))
+    if opening is None:
+        raise not_found("card")
+    rows = await db.execute(
+        snapshots.history_listing(card_id, user.get("id"), start, end or date.today())
+    )
+    return ORJSONResponse(
+        {
+            "opening": opening,
+            "items": [{"day": row.day, "net": row.net, "balance": row.balance} for row in rows],
+        }
+    )
+
+
+@router.post("/cards/{card_id}/incomes", status_code=status.HTTP_201_CREATED)
+async def create_income(
+    card_id: int, body: IncomeIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    await owned_card(db, user, card_id)
+    await check_types(db, user, "income-type", [body.t_type])
+    income = await ledger.create_income(
+        db, user.get("id"), card_id, body.t_type, body.amount, body.description
+    )
+    if income is None:
+        await db.rollback()
+        raise not_found("card")
+    await db.commit()
+    return ORJSONResponse(transaction_json(income), status_code=status.HTTP_201_CREATED)
+
+
+@router.put("/cards/{card_id}/incomes/{income_id}")
+async def update_income(
+    card_id: int,
+    income_id: int,
+    body: IncomeUpdate,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await owned_card(db, user, card_id)
+    await check_types(db, user, "income-type", [body.t_type])
+    income = await ledger.update_income(
+        db, user.get("id"), card_id, income_id, body.t_type, body.amount, body.description, body.created_at
+    )
+    if income is None:
+        await db.rollback()
+        raise not_found("income")
+    await db.commit()
+    return ORJSONResponse(transaction_json(income))
+
+
+@router.delete("/cards/{card_id}/incomes/{income_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_income(
+    card_id: int,
+    income_id: int,
+    created_at: Optional[datetime] = None,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await owned_card(db, user, card_id)
+    if await ledger.delete_income(db, user.get("id"), card_id, income_id, created_at) is None:
+        await db.rollback()
+        raise not_found("income")
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/cards/{card_id}/expenses", status_code=status.HTTP_201_CREATED)
+async def create_expense(
+    card_id: int, body: ExpenseIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    await owned_card(db, user, card_id)
+    await check_types(db, user, "expense-type", [body.t_type])
+    expense = await ledger.create_expense(
+        db, user.get("id"), card_id, body.t_type, body.amount, body.description, body.importance
+    )
+    if expense is None:
+        await db.rollback()
+        raise not_found("card")
+    await db.commit()
+    return ORJSONResponse(transaction_json(expense), status_code=status.HTTP_201_CREATED)
+
+
+@router.put("/cards/{card_id}/expenses/{expense_id}")
+async def update_expense(
+    card_id: int,
+    expense_id: int,
+    body: ExpenseUpdate,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await owned_card(db, user, card_id)
+    await check_types(db, user, "expense-type", [body.t_type])
+    expense = await ledger.update_expense(
+        db,
+        user.get("id"),
+        card_id,
+        expense_id,
+        body.t_type,
+        body.amount,
+        body.description,
+        body.importance,
+        body.created_at,
+    )
+    if expense is None:
+        await db.rollback()
+        raise not_found("expense")
+    await db.commit()
+    return ORJSONResponse(transaction_json(expense))
+
+
+@router.delete("/cards/{card_id}/expenses/{expense_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_expense(
+    card_id: int,
+    expense_id: int,
+    created_at: Optional[datetime] = None,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await owned_card(db, user, card_id)
+    if await ledger.delete_expense(db, user.get("id"), card_id, expense_id, created_at) is None:
+        await db.rollback()
+        raise not_found("expense")
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/cards/{card_id}/transactions/batch", status_code=status.HTTP_201_CREATED)
+async def create_transactions_batch(
+    card_id: int, body: BatchIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    """
+    Insert up to ``BATCH_LIMIT`` incomes and expenses in one transaction: one
+    executemany per table, one rollup upsert, a single balance update and
+    one daily balance update per day.
+    """
+    owner_id = user.get("id")
+    await owned_card(db, user, card_id)
+    await check_types(db, user, "income-type", [item.t_type for item in body.incomes])
+    await check_types(db, user, "expense-type", [item.t_type for item in body.expenses])
+
+    now = datetime.now()
+    common = {
+        "created_at": now,
+        "modified_at": now,
+        "is_active": True,
+        "owner_id": owner_id,
+        "account_id": card_id,
+    }
+    incomes = [{**item.dict(), **common} for item in body.incomes]
+    expenses = [{**item.dict(), **common} for item in body.expenses]
+
+    totals = RollupTotals()
+    spend = budgets.BudgetDeltas()
+    days = snapshots.DailyDeltas()
+    net = await ledger.insert_transactions(db, incomes, expenses, totals, spend, days)
+    await totals.flush(db)
+    await spend.flush(db)
+    balance = await ledger.apply_balance_delta(db, card_id, owner_id, net)
+    await days.flush(db)
+    await db.commit()
+    return ORJSONResponse(
+        {"incomes": len(incomes), "expenses": len(expenses), "balance": balance},
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
+@router.get("/cards/{card_id}/recurring")
+async def list_recurring(card_id: int, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)):
+    rows = (await db.scalars(recurring.listing(user.get("id"), card_id))).all()
+    return ORJSONResponse({"items": [recurring_json(row) for row in rows]})
+
+
+@router.post("/cards/{card_id}/recurring", status_code=status.HTTP_201_CREATED)
+async def create_recurring(
+    card_id: int, body: RecurringIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    await owned_card(db, user, card_id)
+    await check_types(db, user, f"{body.kind}-type", [body.t_type])
+    if body.kind == "expense" and body.importance is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="expenses need an importance"
+        )
+    template = recurring.new_template(
+        user.get("id"), card_id, body.kind, body.t_type, body.amount, body.description,
+        body.frequency, body.starts_on, body.ends_on, body.importance,
+    )
+    db.add(template)
+    await db.commit()
+    return ORJSONResponse(recurring_json(template), status_code=status.HTTP_201_CREATED)
+
+
+@router.delete("/cards/{card_id}/recurring/{recurring_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def stop_recurring(
+    card_id: int, recurring_id: int, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    if await recurring.stop(db, user.get("id"), card_id, recurring_id) is None:
+        raise not_found("recurring transaction")
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/search")
+async def search(
+    q: str,
+    kind: Optional[str] = Query(None, regex="^(income|expense)$"),
+    t_type: Optional[int] = None,
+    importance: Optional[str] = Query(None, regex=IMPORTANCE_PATTERN),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    query = search_query(
+        user.get("id"), q, kind, t_type, importance, min_amount, max_amount, start, end, limit
+    )
+    rows = (await db.execute(query)).all() if query is not None else []
+    return ORJSONResponse(
+        {
+            "items": [
+                {**transaction_json(row), "account_id": row.account_id, "rank": row.rank}
+                for row in rows
+            ]
+        }
+    )
+
+
+def type_model(kind: str):
+    if kind not in TYPE_MODELS:
+        raise not_found("custom data type")
+    return TYPE_MODELS[kind]
+
+
+@router.get("/custom-data/{kind}")
+async def list_custom_data(kind: str, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)):
+    type_model(kind)
+    rows = await get_types(db, user.get("id"), kind, active_only=True)
+    return ORJSONResponse({"items": [custom_data_json(row) for row in rows]})
+
+
+@router.post("/custom-data/{kind}", status_code=status.HTTP_201_CREATED)
+async def create_custom_data(
+    kind: str, body: CustomDataIn, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    custom_data_model = type_model(kind)(**body.dict())
+    custom_data_model.is_active = True
+    custom_data_model.owner_id = user.get("id")
+    custom_data_model.created_at = datetime.now()
+    custom_data_model.modified_at = datetime.now()
+    db.add(custom_data_model)
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), kind)
+    return ORJSONResponse(custom_data_json(custom_data_model), status_code=status.HTTP_201_CREATED)
+
+
+async def owned_custom_data(db: AsyncSession, user: dict, kind: str, cd_id: int):
+    table = type_model(kind)
+    cd_model = await db.scalar(
+        select(table)
+        .where(table.id == cd_id)
+        .where(table.owner_id == user.get("id"))
+        .where(table.is_active == True)
+    )
+    if cd_model is None:
+        raise not_found(kind)
+    return cd_model
+
+
+@router.put("/custom-data/{kind}/{cd_id}")
+async def update_custom_data(
+    kind: str,
+    cd_id: int,
+    body: CustomDataIn,
+    user: dict = Depends(api_user),
+    db: AsyncSession = Depends(get_db),
+):
+    cd_model = await owned_custom_data(db, user, kind, cd_id)
+    cd_model.name = body.name
+    cd_model.description = body.description
+    cd_model.modified_at = datetime.now()
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), kind)
+    return ORJSONResponse(custom_data_json(cd_model))
+
+
+@router.delete("/custom-data/{kind}/{cd_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_custom_data(
+    kind: str, cd_id: int, user: dict = Depends(api_user), db: AsyncSession = Depends(get_db)
+):
+    cd_model = await owned_custom_data(db, user, kind, cd_id)
+    cd_model.is_active = False
+    cd_model.modified_at = datetime.now()
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), kind)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
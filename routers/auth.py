@@ -1,4 +1,6 @@
+import os
 import sys
+import time
 
 sys.path.append("..")
 from starlette.responses import RedirectResponse
@@ -7,27 +9,28 @@ from datetime import datetime, timedelta
 from typing import Optional
 
 import models
-from database import SessionLocal, engine
+from database import get_db
 from fastapi import Depends, HTTPException, status, APIRouter, Request, Response, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import HTMLResponse
 import jwt
 from jwt.exceptions import ExpiredSignatureError, PyJWTError
 
 
 from constants import AuthConstants
+from hashing import HashingPoolFull, password_hasher
+from lookup_cache import LRUCache
+from templating import templates
 
 SECRET_KEY = AuthConstants.SECRET_KEY
 ALGORITHM = AuthConstants.ALGORITHM
 
-templates = Jinja2Templates(directory="templates")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-models.Base.metadata.create_all(bind=engine)
+# tokens whose signature was already checked, each entry lives until the token's exp
+token_cache = LRUCache(TOKEN_CACHE_SIZE, ttl=0)
 
 oauth2bearer = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -46,29 +49,37 @@ class LoginForm:
         self.password = form.get("password")
 
 
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
+def hashing_pool_full_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password checks in progress",
+        headers={"Retry-After": "1"},
+    )
 
 
-def get_password_hash(password):
-    return bcrypt_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashingPoolFull:
+        raise hashing_pool_full_exception()
 
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingPoolFull:
+        raise hashing_pool_full_exception()
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(models.Users).filter(models.Users.username == username).first()
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(
+        select(models.Users).where(models.Users.username == username)
+    )
 
     if user is None:
         return False
 
-    if verify_password(password, user.hashed_password) is False:
+    if await verify_password(password, user.hashed_password) is False:
         return False
 
     return user
@@ -86,18 +97,36 @@ def create_access_token(
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def request_token(request: Request) -> Optional[str]:
+    """The session cookie for browsers, an ``Authorization: Bearer`` header for API clients."""
+    token = request.cookies.get("access_token")
+    if token is None:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and credentials:
+            token = credentials
+    return token
+
+
 async def get_current_user(request: Request):
     try:
-        token = request.cookies.get("access_token")
+        token = request_token(request)
         if token is None:
             return None
+        user = token_cache.get(token)
+        if user is not None:
+            return user
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")  # type: ignore
         user_id: int = payload.get("id")  # type: ignore
 
         if user_id is None or username is None:
             logout(request)
-        return {"username": username, "id": user_id}
+            return {"username": username, "id": user_id}
+        user = {"username": username, "id": user_id}
+        token_cache.set(
+            token, user, expires_at=time.monotonic() + payload["exp"] - time.time()
+        )
+        return user
     except ExpiredSignatureError:
         logout(request)
     except PyJWTError:
@@ -108,9 +137,9 @@ async def get_current_user(request: Request):
 async def login_for_access_token(
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
 
     if user is False:
         return False
@@ -137,7 +166,7 @@ async def authentication_page(request: Request):
 
 
 @router.post("/", response_class=HTMLResponse)
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_db)):
     try:
         form = LoginForm(request)
         await form.create_oath_form()
@@ -152,15 +181,25 @@ async def login(request: Request, db: Session = Depends(get_db)):
                 "login.html", {"request": request, "msg": msg}
             )
         return response
-    except HTTPException:
-        msg = "Unknown Error"
+    except HTTPException as exc:
+        if exc.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            msg = "Too many login attempts right now, please try again"
+        else:
+            msg = "Unknown Error"
         return templates.TemplateResponse(
             "login.html", {"request": request, "msg": msg}
         )
 
 
+def forget_token(request: Request):
+    token = request_token(request)
+    if token is not None:
+        token_cache.invalidate(token)
+
+
 @router.get("/logout")
 async def logout(request: Request):
+    forget_token(request)
     msg = "Logout Successful"
     response = templates.TemplateResponse(
         "login.html", {"request": request, "msg": msg}
@@ -183,12 +222,14 @@ async def register_user(
     lastname: str = Form(...),
     password: str = Form(...),
     password2: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    validation1 = (
-        db.query(models.Users).filter(models.Users.username == username).first()
+    validation1 = await db.scalar(
+        select(models.Users).where(models.Users.username == username)
+    )
+    validation2 = await db.scalar(
+        select(models.Users).where(models.Users.email == email)
     )
-    validation2 = db.query(models.Users).filter(models.Users.email == email).first()
 
     if password != password2 or validation1 is not None or validation2 is not None:
         msg = "Invalid registration request"
@@ -202,14 +243,14 @@ async def register_user(
     user_model.first_name = firstname
     user_model.last_name = lastname
 
-    hash_password = get_password_hash(password)
+    hash_password = await get_password_hash(password)
     user_model.hashed_password = hash_password
     user_model.is_active = True
     user_model.created_at = datetime.now()
     user_model.modified_at = datetime.now()
 
     db.add(user_model)
-    db.commit()
+    await db.commit()
 
     msg = "User successfully created"
     return templates.TemplateResponse("login.html", {"request": request, "msg": msg})
@@ -231,31 +272,34 @@ async def change_password_user(
     email: str = Form(...),
     password: str = Form(...),
     password2: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
         if user is None:
             return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    user_model = db.query(models.Users).filter(models.Users.username == email).first()
+    user_model = await db.scalar(
+        select(models.Users).where(models.Users.username == email)
+    )
 
     if (
         user_model is None
-        or verify_password(password, user_model.hashed_password) is False
+        or await verify_password(password, user_model.hashed_password) is False
     ):
         msg = "Incorrect Username or Password"
         return templates.TemplateResponse(
             "change-password.html", {"request": request, "user": user, "msg": msg}
         )
 
-    hash_password = get_password_hash(password2)
+    hash_password = await get_password_hash(password2)
 
     user_model.hashed_password = hash_password
     user_model.modified_at = datetime.now()
 
     db.add(user_model)
-    db.commit()
+    await db.commit()
+    forget_token(request)
 
     msg = "Password Changed Successfully"
     response = templates.TemplateResponse(
@@ -0,0 +1,93 @@
+import sys
+
+sys.path.append("..")
+
+from starlette.responses import RedirectResponse
+from starlette import status
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, APIRouter, HTTPException, Request, Form
+from fastapi.responses import HTMLResponse
+
+import budgets
+import conditional
+import models
+from database import get_db
+from lookup_cache import get_types
+from templating import templates
+from .auth import get_current_user
+
+
+router = APIRouter()
+
+
+@router.get("/", response_class=HTMLResponse)
+async def budgets_page(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    return templates.TemplateResponse(
+        "budgets.html",
+        {
+            "request": request,
+            "user": user,
+            "expense_types": await get_types(db, user.get("id"), "expense-type", active_only=True),
+            "importances": models.IMPORTANCE,
+            **await budgets.summary(db, user.get("id")),
+        },
+    )
+
+
+@router.post("/", response_class=HTMLResponse)
+async def create_budget(
+    request: Request,
+    category: str = Form(...),
+    amount: float = Form(...),
+    alert_percent: int = Form(80),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    # the dropdown sends "type:<expense type id>" or "importance:<level>"
+    kind, _, value = category.partition(":")
+    t_type = importance = None
+    if kind == "type" and value.isdigit():
+        t_type = int(value)
+        types = await get_types(db, user.get("id"), "expense-type", active_only=True)
+        if t_type not in {row.id for row in types}:
+            t_type = None
+    elif kind == "importance" and value in models.IMPORTANCE:
+        importance = value
+    if (t_type is None and importance is None) or amount <= 0 or not 0 < alert_percent <= 100:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="invalid budget")
+
+    await budgets.create_budget(db, user.get("id"), amount, t_type, importance, alert_percent / 100)
+    # the card pages show the budgets
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    return RedirectResponse(url="/budgets", status_code=status.HTTP_302_FOUND)
+
+
+@router.get("/delete/{budget_id}")
+async def delete_budget(request: Request, budget_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    if await budgets.remove_budget(db, user.get("id"), budget_id):
+        await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    return RedirectResponse(url="/budgets", status_code=status.HTTP_302_FOUND)
+
+
+@router.get("/alerts/{alert_id}/dismiss")
+async def dismiss_alert(request: Request, alert_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    if await budgets.dismiss_alert(db, user.get("id"), alert_id):
+        await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    return RedirectResponse(url=request.headers.get("referer") or "/budgets", status_code=status.HTTP_302_FOUND)
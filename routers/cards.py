@@ -5,57 +5,60 @@ sys.path.append("..")
 
 from starlette.responses import RedirectResponse
 from starlette import status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, APIRouter, Request, Form
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
+import budgets
+import conditional
+import ledger
 import models
-from database import engine, SessionLocal
+import snapshots
+from database import get_db
+from lookup_cache import get_types
+from rollups import month_of
+from templating import templates
 from .auth import get_current_user
 
 
 router = APIRouter()
 
-models.Base.metadata.create_all(bind=engine)
-
-templates = Jinja2Templates(directory="templates")
-
-
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
 
 @router.get("/", response_class=HTMLResponse)
-async def read_all_by_user(request: Request, db: Session = Depends(get_db)):
+async def read_all_by_user(request: Request, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    stamp = await conditional.cards_stamp(db, user.get("id"))
+    if stamp is not None:
+        tag = conditional.etag(stamp, user.get("id"), month_of(datetime.now()))
+        if conditional.is_fresh(request, tag, stamp):
+            return conditional.not_modified(tag, stamp)
+
     cards = (
-        db.query(models.Accounts)
-        .filter(models.Accounts.owner_id == user.get("id"))
-        .filter(models.Accounts.is_active == True)
-        .all()
-    )
-    return templates.TemplateResponse(
-        "cards.html", {"request": request, "cards": cards, "user": user}
+        await db.scalars(
+            select(models.Accounts)
+            .where(models.Accounts.owner_id == user.get("id"))
+            .where(models.Accounts.is_active == True)
+        )
+    ).all()
+    response = templates.TemplateResponse(
+        "cards.html",
+        {"request": request, "cards": cards, "user": user, **await budgets.summary(db, user.get("id"))},
     )
+    if stamp is not None:
+        conditional.with_validators(response, tag, stamp)
+    return response
 
 
 @router.get("/add-card", response_class=HTMLResponse)
-async def add_new_card(request: Request, db: Session = Depends(get_db)):
+async def add_new_card(request: Request, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    cardtypes = (db.query(models.AccountTypes)
-        .filter(models.AccountTypes.owner_id == user.get("id"))
-        .filter(models.AccountTypes.is_active == True)
-        .all()
-    )
+    cardtypes = await get_types(db, user.get("id"), "account-type", active_only=True)
     return templates.TemplateResponse(
         "add-card.html", {"request": request, "user": user, "cardtypes": cardtypes}
     )
@@ -68,7 +71,7 @@ async def create_card(
     description: str = Form(...),
     card_type: int = Form(...),
     balance: float = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
@@ -84,18 +87,29 @@ async def create_card(
     card_model.owner_id = user.get("id")
 
     db.add(card_model)
-    db.commit()
+    await db.flush()
+    ledger.record_adjustment(db, card_model.id, card_model.owner_id, "opening", balance)
+    await snapshots.record(
+        db, card_model.id, card_model.owner_id, card_model.created_at.date(), balance
+    )
+    await db.commit()
 
     return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
 
 
 @router.get("/edit-card/{card_id}", response_class=HTMLResponse)
-async def edit_card(request: Request, card_id: int, db: Session = Depends(get_db)):
+async def edit_card(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    cardtypes = db.query(models.AccountTypes).all()
-    card = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
+    cardtypes = await get_types(db, user.get("id"), "account-type")
+    card = await db.scalar(
+        select(models.Accounts)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == user.get("id"))
+    )
+    if card is None:
+        return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
     return templates.TemplateResponse(
         "edit-card.html",
         {"request": request, "card": card, "cardtypes": cardtypes, "user": user},
@@ -110,46 +124,51 @@ async def edit_card_commit(
     description: str = Form(...),
     card_type: int = Form(...),
     balance: float = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    card_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
+    card_model = await db.scalar(
+        select(models.Accounts)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == user.get("id"))
+    )
+    if card_model is None:
+        return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
 
     card_model.name = name
     card_model.description = description
     card_model.card_type = card_type
-    card_model.balance = balance
     card_model.modified_at = datetime.now()
 
     db.add(card_model)
-    db.commit()
+    await ledger.set_balance(db, card_id, user.get("id"), balance)
+    await db.commit()
 
     return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
 
 
 @router.get("/delete/{card_id}")
-async def delete_card(request: Request, card_id: int, db: Session = Depends(get_db)):
+async def delete_card(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    card_model = (
-        db.query(models.Accounts)
-        .filter(models.Accounts.id == card_id)
-        .filter(models.Accounts.owner_id == user.get("id"))
-        .first()
+    card_model = await db.scalar(
+        select(models.Accounts)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == user.get("id"))
     )
 
     if card_model is None:
         return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
 
     card_model.is_active = False
-    card_model.modifed_at = datetime.now()
+    card_model.modified_at = datetime.now()
 
     db.add(card_model)
-    db.commit()
+    await db.commit()
 
     return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
@@ -5,60 +5,32 @@ sys.path.append("..")
 
 from starlette.responses import RedirectResponse
 from starlette import status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, APIRouter, Request, Form
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
+import conditional
 import models
-from database import engine, SessionLocal
+from database import get_db
+from lookup_cache import TYPE_MODELS, get_types, invalidate_types
+from templating import templates
 from .auth import get_current_user
 
 
 router = APIRouter()
 
-models.Base.metadata.create_all(bind=engine)
-
-templates = Jinja2Templates(directory="templates")
-
-
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
 
 @router.get("/{cd_type}", response_class=HTMLResponse)
 async def read_all_by_user(
-    request: Request, cd_type: str, db: Session = Depends(get_db)
+    request: Request, cd_type: str, db: AsyncSession = Depends(get_db)
 ):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
     custom_data = {}
-    if cd_type == "account-type":
-        custom_data = (
-            db.query(models.AccountTypes)
-            .filter(models.AccountTypes.owner_id == user.get("id"))
-            .filter(models.AccountTypes.is_active == True)
-            .all()
-        )
-    elif cd_type == "income-type":
-        custom_data = (
-            db.query(models.IncomeTypes)
-            .filter(models.IncomeTypes.owner_id == user.get("id"))
-            .filter(models.IncomeTypes.is_active == True)
-            .all()
-        )
-    elif cd_type == "expense-type":
-        custom_data = (
-            db.query(models.ExpenseTypes)
-            .filter(models.ExpenseTypes.owner_id == user.get("id"))
-            .filter(models.ExpenseTypes.is_active == True)
-            .all()
-        )
+    if cd_type in TYPE_MODELS:
+        custom_data = await get_types(db, user.get("id"), cd_type, active_only=True)
     return templates.TemplateResponse(
         "custom-data.html",
         {
@@ -86,7 +58,7 @@ async def create_custom_data(
     cd_type: str,
     name: str = Form(...),
     description: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
@@ -106,7 +78,9 @@ async def create_custom_data(
     custom_data_model.modified_at = datetime.now()
 
     db.add(custom_data_model)
-    db.commit()
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), cd_type)
 
     return RedirectResponse(
         url=f"/custom-data/{cd_type}", status_code=status.HTTP_302_FOUND
@@ -118,28 +92,18 @@ async def add_new_card(
     request: Request,
     cd_type: str,
     cd_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
     cd_model = {}
     if cd_type == "account-type":
-        cd_model = (
-            db.query(models.AccountTypes)
-            .filter(models.AccountTypes.id == cd_id)
-            .first()
-        )
+        cd_model = await db.get(models.AccountTypes, cd_id)
     elif cd_type == "income-type":
-        cd_model = (
-            db.query(models.IncomeTypes).filter(models.IncomeTypes.id == cd_id).first()
-        )
+        cd_model = await db.get(models.IncomeTypes, cd_id)
     elif cd_type == "expense-type":
-        cd_model = (
-            db.query(models.ExpenseTypes)
-            .filter(models.ExpenseTypes.id == cd_id)
-            .first()
-        )
+        cd_model = await db.get(models.ExpenseTypes, cd_id)
 
     return templates.TemplateResponse(
         "edit-custom-data.html",
@@ -154,35 +118,27 @@ async def edit_card_commit(
     cd_id: int,
     name: str = Form(...),
     description: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
     if cd_type == "account-type":
-        cd_model = (
-            db.query(models.AccountTypes)
-            .filter(models.AccountTypes.id == cd_id)
-            .first()
-        )
+        cd_model = await db.get(models.AccountTypes, cd_id)
     elif cd_type == "income-type":
-        cd_model = (
-            db.query(models.IncomeTypes).filter(models.IncomeTypes.id == cd_id).first()
-        )
+        cd_model = await db.get(models.IncomeTypes, cd_id)
     elif cd_type == "expense-type":
-        cd_model = (
-            db.query(models.ExpenseTypes)
-            .filter(models.ExpenseTypes.id == cd_id)
-            .first()
-        )
+        cd_model = await db.get(models.ExpenseTypes, cd_id)
 
     cd_model.name = name
     cd_model.description = description
     cd_model.modified_at = datetime.now()
 
     db.add(cd_model)
-    db.commit()
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), cd_type)
 
     return RedirectResponse(
         url=f"/custom-data/{cd_type}", status_code=status.HTTP_302_FOUND
@@ -191,7 +147,7 @@ async def edit_card_commit(
 
 @router.get("/delete/{cd_type}/{cd_id}")
 async def delete_card(
-    request: Request, cd_type: str, cd_id: int, db: Session = Depends(get_db)
+    request: Request, cd_type: str, cd_id: int, db: AsyncSession = Depends(get_db)
 ):
     user = await get_current_user(request)
     if user is None:
@@ -204,11 +160,10 @@ async def delete_card(
     elif cd_type == "expense-type":
         cd_model = models.ExpenseTypes
 
-    cd_check_model = (
-        db.query(cd_model)
-        .filter(cd_model.id == cd_id)
-        .filter(cd_model.owner_id == user.get("id"))
-        .first()
+    cd_check_model = await db.scalar(
+        select(cd_model)
+        .where(cd_model.id == cd_id)
+        .where(cd_model.owner_id == user.get("id"))
     )
 
     if cd_check_model is None:
@@ -218,7 +173,9 @@ async def delete_card(
     cd_check_model.modified_at = datetime.now()
 
     db.add(cd_check_model)
-    db.commit()
+    await conditional.touch_owner(db, user.get("id"))
+    await db.commit()
+    invalidate_types(user.get("id"), cd_type)
 
     return RedirectResponse(
         url=f"/custom-data/{cd_type}", status_code=status.HTTP_302_FOUND
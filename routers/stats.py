@@ -0,0 +1,40 @@
+import hmac
+import os
+import sys
+
+sys.path.append("..")
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+
+import database
+from lookup_cache import type_cache
+from metrics import pool_snapshot
+from .auth import token_cache
+
+# bearer token for /metrics and /stats/*, which stay hidden (404) while it is unset
+STATS_TOKEN = os.getenv("STATS_TOKEN")
+
+
+async def require_stats_token(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if not STATS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), STATS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_stats_token)])
+
+
+@router.get("/cache")
+async def cache_stats():
+    return {"types": type_cache.stats(), "tokens": token_cache.stats()}
+
+
+@router.get("/pool")
+async def pool_stats():
+    return pool_snapshot(database.async_engine.sync_engine.pool, database.POOL_SETTINGS)
@@ -1,188 +1,274 @@
-from datetime import datetime
+from datetime import date, datetime
+from typing import Optional
+from urllib.parse import urlencode
 import sys
 
 sys.path.append("..")
 
 from starlette.responses import RedirectResponse
 from starlette import status
-from sqlalchemy.orm import Session
-from fastapi import Depends, APIRouter, Request, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, APIRouter, HTTPException, Request, Form, Query, File, UploadFile
+from fastapi.responses import HTMLResponse, StreamingResponse
+
+import budgets
+import conditional
+import database
 import models
-from database import engine, SessionLocal
+import partitions
+from database import get_db
+import ledger
+import recurring
+from exporter import MEDIA_TYPES, export_transactions
+from lookup_cache import get_types
+from rollups import month_of
+from importer import ImportMapping, ImportRowError, import_transactions
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page
+from search import SEARCH_LIMIT, search_query
+from templating import templates
 from .auth import get_current_user
 
 
 router = APIRouter()
 
-models.Base.metadata.create_all(bind=engine)
 
-templates = Jinja2Templates(directory="templates")
+def _page_url(card_id: int, params: dict, direction: str, cursor: Optional[str]):
+    if cursor is None:
+        return None
+    query = {k: v for k, v in params.items() if v is not None}
+    query[direction] = cursor
+    return f"/transactions/card/{card_id}?{urlencode(query)}"
 
 
-def get_db():
+def _form_value(value: Optional[str], parse):
+    """GET forms send empty inputs as "", which means no filter."""
+    if not value:
+        return None
     try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
+        return parse(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"invalid value {value!r}")
+
+
+def _export_response(user: dict, file_format: str, card_id: Optional[int] = None):
+    name = f"card-{card_id}" if card_id is not None else "all-cards"
+    return StreamingResponse(
+        export_transactions(user.get("id"), card_id, file_format),
+        media_type=MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="transactions-{name}.{file_format}"'},
+    )
+
+
+@router.get("/export")
+async def export_all_cards(request: Request, file_format: str = Query("csv", alias="format", regex="^(csv|jsonl)$")):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    return _export_response(user, file_format)
+
+
+@router.get("/search", response_class=HTMLResponse)
+async def search_transactions(
+    request: Request,
+    q: str = "",
+    kind_type: Optional[str] = Query(None, alias="type"),
+    importance: Optional[str] = None,
+    min_amount: Optional[str] = None,
+    max_amount: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    # the type dropdown sends "income", "expense" or "income:<id>" / "expense:<id>"
+    kind, _, t_type = (kind_type or "").partition(":")
+    filters = {
+        "kind": kind if kind in ("income", "expense") else None,
+        "t_type": _form_value(t_type, int),
+        "importance": importance if importance in models.IMPORTANCE else None,
+        "min_amount": _form_value(min_amount, float),
+        "max_amount": _form_value(max_amount, float),
+        "start": _form_value(start, date.fromisoformat),
+        "end": _form_value(end, date.fromisoformat),
+    }
+    query = search_query(user.get("id"), q, **filters)
+    results = (await db.execute(query)).all() if query is not None else []
+
+    return templates.TemplateResponse(
+        "search.html",
+        {
+            "request": request,
+            "user": user,
+            "q": q,
+            "results": results,
+            "limit": SEARCH_LIMIT,
+            "selected_type": kind_type or "",
+            "importance": importance or "",
+            "importances": models.IMPORTANCE,
+            "min_amount": min_amount or "",
+            "max_amount": max_amount or "",
+            "start": start or "",
+            "end": end or "",
+            "income_types": await get_types(db, user.get("id"), "income-type", active_only=True),
+            "expense_types": await get_types(db, user.get("id"), "expense-type", active_only=True),
+        },
+    )
+
+
+@router.get("/card/{card_id}/export")
+async def export_card(request: Request, card_id: int, file_format: str = Query("csv", alias="format", regex="^(csv|jsonl)$")):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    return _export_response(user, file_format, card_id)
 
 
 @router.get("/card/{card_id}", response_class=HTMLResponse)
 async def read_all_by_user(
-    request: Request, card_id: int, db: Session = Depends(get_db)
+    request: Request,
+    card_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
 ):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    incomes = (
-        db.query(models.Incomes, models.IncomeTypes).join(models.IncomeTypes)
-        .filter(models.Incomes.account_id == card_id)
-        .filter(models.Incomes.owner_id == user.get("id"))
-        .filter(models.Incomes.is_active == True)
-        .all()
-    )
-    expenses = (
-        db.query(models.Expenses, models.ExpenseTypes).join(models.ExpenseTypes)
-        .filter(models.Expenses.account_id == card_id)
-        .filter(models.Expenses.owner_id == user.get("id"))
-        .filter(models.Expenses.is_active == True)
-        .all()
+
+    # any card's expenses move the budget panel, so the stamp covers them all
+    stamp = await conditional.cards_stamp(db, user.get("id"))
+    if stamp is not None:
+        tag = conditional.etag(
+            stamp, user.get("id"), card_id, request.url.query, month_of(datetime.now())
+        )
+        if conditional.is_fresh(request, tag, stamp):
+            return conditional.not_modified(tag, stamp)
+
+    query, feed = ledger.feed_listing(user.get("id"), card_id, start, end, after, before, limit)
+    transactions, next_cursor, prev_cursor = await keyset_page(
+        db,
+        query,
+        feed.c.created_at,
+        feed.c.seq,
+        after=after,
+        before=before,
+        limit=limit,
     )
 
-    return templates.TemplateResponse(
+    params = {"start": start, "end": end, "limit": limit}
+    pages = {
+        "next": _page_url(card_id, params, "after", next_cursor),
+        "prev": _page_url(card_id, params, "before", prev_cursor),
+    }
+
+    response = templates.TemplateResponse(
         "transactions.html",
         {
             "request": request,
-            "incomes": incomes,
-            "expenses": expenses,
+            "transactions": transactions,
+            "pages": pages,
+            "start": start,
+            "end": end,
             "user": user,
-            "card_id": card_id
+            "card_id": card_id,
+            **await budgets.summary(db, user.get("id")),
         },
     )
+    if stamp is not None:
+        conditional.with_validators(response, tag, stamp)
+    return response
 
 
 @router.get("/card/{card_id}/add-income", response_class=HTMLResponse)
-async def add_new_income(request: Request, card_id: int, db: Session = Depends(get_db)):
+async def add_new_income(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
     # importance = ['Essential', 'Have to have', 'Nice to have', 'Should not have']
-    account = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    options = (
-    db.query(models.IncomeTypes)
-    .filter(models.IncomeTypes.owner_id == user.get("id"))
-    .all()
-    )
+    account = await db.get(models.Accounts, card_id)
+    options = await get_types(db, user.get("id"), "income-type")
     return templates.TemplateResponse(
         "add-income.html", {"request": request, "user": user,  "options": options,"account" : account }
     )
 
 
 @router.post("/card/{card_id}/add-income", response_class=HTMLResponse)
-async def create_income(request: Request, card_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), db: Session = Depends(get_db)):
+async def create_income(request: Request, card_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    # adding income 
-    income_model = models.Incomes()
-    income_model.amount = amount
-    income_model.description = description
-    income_model.is_active = True
-    income_model.t_type = t_type
-    income_model.created_at = datetime.now()
-    income_model.modified_at = datetime.now()
-    income_model.owner_id = user.get("id")
-    income_model.account_id = card_id
-    db.add(income_model)
-
-    account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    account_model.balance += amount
-    db.add(account_model)
-
-    db.commit()
+
+    income_model = await ledger.create_income(db, user.get("id"), card_id, t_type, amount, description)
+    if income_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+    await db.commit()
 
     return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
     
     
 
 @router.get("/card/{card_id}/edit-income/{transaction_id}", response_class=HTMLResponse)
-async def edit_income(request: Request, card_id: int, transaction_id: int, db: Session = Depends(get_db)):
+async def edit_income(request: Request, card_id: int, transaction_id: int, created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
     # importance = ['Essential', 'Have to have', 'Nice to have', 'Should not have']
-    account = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    options = (
-    db.query(models.IncomeTypes)
-    .filter(models.IncomeTypes.owner_id == user.get("id"))
-    .all()
-    )
-    income = db.query(models.Incomes).filter(models.Incomes.account_id == card_id).filter(models.Incomes.id == transaction_id).first()
+    account = await db.get(models.Accounts, card_id)
+    options = await get_types(db, user.get("id"), "income-type")
+    income = await db.scalar(ledger.point_lookup(models.Incomes, card_id, transaction_id, created_at))
     return templates.TemplateResponse(
         "edit-income.html", {"request": request, "user": user,  "options": options,"account" : account, "income": income, "transaction_id": transaction_id }
     )
 
 
 @router.post("/card/{card_id}/edit-income/{transaction_id}", response_class=HTMLResponse)
-async def update_income(request: Request, card_id: int, transaction_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...),db: Session = Depends(get_db)):
+async def update_income(request: Request, card_id: int, transaction_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    
-    income_model = db.query(models.Incomes).filter(models.Incomes.account_id == card_id).filter(models.Incomes.id == transaction_id).first()
-    if income_model.amount != amount:
-        income_diff = income_model.amount - amount
-        income_model.amount = amount
-        account_modify = True
-    else:
-        account_modify = False
-    income_model.description = description
-    income_model.t_type = t_type
-    income_model.modified_at = datetime.now()
-    db.add(income_model)
-
-    if account_modify : 
-        account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-        account_model.balance -= income_diff
-        db.add(account_model)
-
-    db.commit()
+
+    income_model = await ledger.update_income(db, user.get("id"), card_id, transaction_id, t_type, amount, description, created_at)
+    if income_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+    await db.commit()
 
     return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
 
+
 @router.get("/card/{card_id}/delete-income/{transaction_id}", response_class=HTMLResponse)
-async def delete_income(request: Request, card_id: int, transaction_id: int,db: Session = Depends(get_db)):
+async def delete_income(request: Request, card_id: int, transaction_id: int, created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    
-    income_model = db.query(models.Incomes).filter(models.Incomes.account_id == card_id).filter(models.Incomes.id == transaction_id).first()
-    income_model.is_active = False
-    db.add(income_model)
 
-    account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    account_model.balance -= income_model.amount
-    db.add(account_model)
+    income_model = await ledger.delete_income(db, user.get("id"), card_id, transaction_id, created_at)
+    if income_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
 
-    db.commit()
+    await db.commit()
 
     return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
 
 
 @router.get("/card/{card_id}/add-expense", response_class=HTMLResponse)
-async def add_new_expense(request: Request, card_id: int, db: Session = Depends(get_db)):
+async def add_new_expense(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    account = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    options = (
-    db.query(models.ExpenseTypes)
-    .filter(models.ExpenseTypes.owner_id == user.get("id"))
-    .all()
-    )
+    account = await db.get(models.Accounts, card_id)
+    options = await get_types(db, user.get("id"), "expense-type")
     importance = ['Essential', 'Have to have', 'Nice to have', 'Should not have']
     return templates.TemplateResponse(
         "add-expense.html", {"request": request, "user": user,  "options": options,"account" : account, "importance": importance }
@@ -190,91 +276,222 @@ async def add_new_expense(request: Request, card_id: int, db: Session = Depends(
 
 
 @router.post("/card/{card_id}/add-expense", response_class=HTMLResponse)
-async def create_expense(request: Request, card_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), importance: str= Form(...),db: Session = Depends(get_db)):
+async def create_expense(request: Request, card_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), importance: str= Form(...),db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    # adding income 
-    expense_model = models.Expenses()
-    expense_model.amount = amount
-    expense_model.description = description
-    expense_model.is_active = True
-    expense_model.t_type = t_type
-    expense_model.importance = importance
-    expense_model.created_at = datetime.now()
-    expense_model.modified_at = datetime.now()
-    expense_model.owner_id = user.get("id")
-    expense_model.account_id = card_id
-
-    db.add(expense_model)
-
-    account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    account_model.balance -= amount
-    db.add(account_model)
-
-    db.commit()
+
+    expense_model = await ledger.create_expense(db, user.get("id"), card_id, t_type, amount, description, importance)
+    if expense_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+    await db.commit()
 
     return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
 
 @router.get("/card/{card_id}/edit-expense/{transaction_id}", response_class=HTMLResponse)
-async def edit_income(request: Request, card_id: int, transaction_id: int, db: Session = Depends(get_db)):
+async def edit_income(request: Request, card_id: int, transaction_id: int, created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
     importance = ['Essential', 'Have to have', 'Nice to have', 'Should not have']
-    account = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    options = (
-    db.query(models.ExpenseTypes)
-    .filter(models.ExpenseTypes.owner_id == user.get("id"))
-    .all()
-    )
-    expense = db.query(models.Expenses).filter(models.Expenses.account_id == card_id).filter(models.Expenses.id == transaction_id).first()
+    account = await db.get(models.Accounts, card_id)
+    options = await get_types(db, user.get("id"), "expense-type")
+    expense = await db.scalar(ledger.point_lookup(models.Expenses, card_id, transaction_id, created_at))
     return templates.TemplateResponse(
         "edit-expense.html", {"request": request, "user": user,  "options": options,"account" : account, "expense": expense, "importance": importance,"transaction_id": transaction_id }
     )
 
 
 @router.post("/card/{card_id}/edit-expense/{transaction_id}", response_class=HTMLResponse)
-async def update_expense(request: Request, card_id: int, transaction_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...),db: Session = Depends(get_db)):
+async def update_expense(request: Request, card_id: int, transaction_id: int, t_type: int= Form(...), amount: float= Form(...), description: str= Form(...), importance: str= Form(...), created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    
-    expense_model = db.query(models.Expenses).filter(models.Expenses.account_id == card_id).filter(models.Expenses.id == transaction_id).first()
-    if expense_model.amount != amount:
-        exp_diff = expense_model.amount - amount
-        expense_model.amount = amount
-        account_modify = True
-    else:
-        account_modify = False
-    expense_model.description = description
-    expense_model.t_type = t_type
-    expense_model.modified_at = datetime.now()
-    db.add(expense_model)
-
-    if account_modify : 
-        account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-        account_model.balance += exp_diff
-        db.add(account_model)
-
-    db.commit()
+    if importance not in models.IMPORTANCE:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="invalid importance")
+
+    expense_model = await ledger.update_expense(db, user.get("id"), card_id, transaction_id, t_type, amount, description, importance, created_at)
+    if expense_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+    await db.commit()
 
     return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
 
+
 @router.get("/card/{card_id}/delete-expense/{transaction_id}", response_class=HTMLResponse)
-async def delete_expense(request: Request, card_id: int, transaction_id: int,db: Session = Depends(get_db)):
+async def delete_expense(request: Request, card_id: int, transaction_id: int, created_at: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    expense_model = await ledger.delete_expense(db, user.get("id"), card_id, transaction_id, created_at)
+    if expense_model is None:
+        await db.rollback()
+        return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+    await db.commit()
+
+    return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
+
+
+async def _owned_card(db: AsyncSession, user: dict, card_id: int):
+    return await db.scalar(
+        select(models.Accounts)
+        .where(models.Accounts.id == card_id)
+        .where(models.Accounts.owner_id == user.get("id"))
+    )
+
+
+@router.get("/card/{card_id}/recurring", response_class=HTMLResponse)
+async def recurring_page(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    account = await _owned_card(db, user, card_id)
+    if account is None:
+        return RedirectResponse(url="/cards", status_code=status.HTTP_302_FOUND)
+
+    income_types = await get_types(db, user.get("id"), "income-type")
+    expense_types = await get_types(db, user.get("id"), "expense-type")
+    type_names = {("income", row.id): row.name for row in income_types}
+    type_names.update({("expense", row.id): row.name for row in expense_types})
+    recurring_rows = (await db.scalars(recurring.listing(user.get("id"), card_id))).all()
+    return templates.TemplateResponse(
+        "recurring.html",
+        {
+            "request": request,
+            "user": user,
+            "account": account,
+            "recurring": recurring_rows,
+            "type_names": type_names,
+            "income_types": [row for row in income_types if row.is_active],
+            "expense_types": [row for row in expense_types if row.is_active],
+            "importance": models.IMPORTANCE,
+        },
+    )
+
+
+@router.post("/card/{card_id}/recurring", response_class=HTMLResponse)
+async def create_recurring(
+    request: Request,
+    card_id: int,
+    kind_type: str = Form(..., alias="type"),
+    amount: float = Form(...),
+    description: str = Form(...),
+    importance: str = Form(models.IMPORTANCE[0]),
+    frequency: str = Form(...),
+    starts_on: date = Form(...),
+    ends_on: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    # the type dropdown sends "income:<id>" or "expense:<id>", like the search form
+    kind, _, t_type = kind_type.partition(":")
+    t_type = _form_value(t_type, int)
+    type_ids = set()
+    if kind in ("income", "expense"):
+        type_ids = {row.id for row in await get_types(db, user.get("id"), f"{kind}-type", active_only=True)}
+    if (
+        await _owned_card(db, user, card_id) is None
+        or t_type not in type_ids
+        or amount <= 0
+        or frequency not in models.FREQUENCIES
+        or importance not in models.IMPORTANCE
+    ):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="invalid recurring transaction")
+
+    db.add(recurring.new_template(
+        user.get("id"), card_id, kind, t_type, amount, description, frequency,
+        starts_on, _form_value(ends_on, date.fromisoformat), importance,
+    ))
+    await db.commit()
+    return RedirectResponse(url=f"/transactions/card/{card_id}/recurring", status_code=status.HTTP_302_FOUND)
+
+
+@router.get("/card/{card_id}/recurring/{recurring_id}/stop")
+async def stop_recurring(request: Request, card_id: int, recurring_id: int, db: AsyncSession = Depends(get_db)):
     user = await get_current_user(request)
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    
-    expense_model = db.query(models.Expenses).filter(models.Expenses.account_id == card_id).filter(models.Expenses.id == transaction_id).first()
-    expense_model.is_active = False
-    db.add(expense_model)
 
-    account_model = db.query(models.Accounts).filter(models.Accounts.id == card_id).first()
-    account_model.balance += expense_model.amount
-    db.add(account_model)
+    await recurring.stop(db, user.get("id"), card_id, recurring_id)
+    await db.commit()
+    return RedirectResponse(url=f"/transactions/card/{card_id}/recurring", status_code=status.HTTP_302_FOUND)
 
-    db.commit()
 
-    return RedirectResponse(url=f"/transactions/card/{card_id}", status_code=status.HTTP_302_FOUND)
\ No newline at end of file
+@router.get("/card/{card_id}/import", response_class=HTMLResponse)
+async def import_page(request: Request, card_id: int, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+    return await _render_import(request, db, user, card_id)
+
+
+async def _render_import(request: Request, db: AsyncSession, user: dict, card_id: int, msg: Optional[str] = None):
+    account = await db.get(models.Accounts, card_id)
+    income_options = await get_types(db, user.get("id"), "income-type")
+    expense_options = await get_types(db, user.get("id"), "expense-type")
+    importance = ['Essential', 'Have to have', 'Nice to have', 'Should not have']
+    return templates.TemplateResponse(
+        "import.html", {"request": request, "user": user, "account": account, "income_options": income_options, "expense_options": expense_options, "importance": importance, "msg": msg}
+    )
+
+
+@router.post("/card/{card_id}/import", response_class=HTMLResponse)
+async def import_statement(
+    request: Request,
+    card_id: int,
+    statement: UploadFile = File(...),
+    file_format: str = Form("csv"),
+    date_column: str = Form("date"),
+    date_format: str = Form("%Y-%m-%d"),
+    amount_column: str = Form("amount"),
+    description_column: str = Form("description"),
+    type_column: str = Form(""),
+    income_type: int = Form(...),
+    expense_type: int = Form(...),
+    importance: str = Form("Essential"),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await get_current_user(request)
+    if user is None:
+        return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
+
+    income_ids = {row.id for row in await get_types(db, user.get("id"), "income-type")}
+    expense_ids = {row.id for row in await get_types(db, user.get("id"), "expense-type")}
+    if income_type not in income_ids or expense_type not in expense_ids:
+        return await _render_import(request, db, user, card_id, msg="Nothing imported, pick one of your income and expense types")
+    if importance not in models.IMPORTANCE:
+        return await _render_import(request, db, user, card_id, msg="Nothing imported, pick a valid importance")
+
+    mapping = ImportMapping(
+        date_column=date_column,
+        amount_column=amount_column,
+        description_column=description_column,
+        type_column=type_column or None,
+        date_format=date_format,
+        income_type=income_type,
+        expense_type=expense_type,
+        importance=importance,
+    )
+    try:
+        # give the file's months their partitions first, so no row lands in the default one
+        result = await import_transactions(
+            db, statement, file_format, mapping, user.get("id"), card_id,
+            prepare=lambda months: partitions.ensure_logged(database.async_engine, months),
+        )
+    except ImportRowError as exc:
+        await db.rollback()
+        return await _render_import(request, db, user, card_id, msg=f"Nothing imported, {exc}")
+
+    await db.commit()
+
+    msg = f"Imported {result.incomes} incomes and {result.expenses} expenses"
+    return await _render_import(request, db, user, card_id, msg=msg)
@@ -0,0 +1,124 @@
+"""
+Search a user's income and expense descriptions across all active cards.
+
+Each word of the query matches as a prefix through the full-text index
+(``amaz`` finds "Amazon"), and the trigram index catches misspellings
+(``amazn``). Both indexes lead with owner_id (migration 0004), so the cost
+depends on the user's own rows only. Results are ranked by the better of
+the two scores, newest first on ties.
+"""
+import re
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import String, cast, func, literal, literal_column, null, or_, select, union_all
+
+import models
+from ledger import date_bounds
+
+SEARCH_LIMIT = 50
+WORD = re.compile(r"\w+")
+
+
+def prefix_query(text: str) -> Optional[str]:
+    """``tsquery`` text requiring every word of ``text`` as a prefix, or None."""
+    words = WORD.findall(text.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _document(table):
+    # spelled exactly like models.SEARCH_DOCUMENT, without bind parameters,
+    # so the planner matches it to the expression index
+    return func.to_tsvector(
+        literal_column("'simple'"), func.coalesce(table.description, literal_column("''"))
+    )
+
+
+def _branch(kind, table, type_table, owner_id, text, tsquery, filters):
+    document = _document(table)
+    query = func.to_tsquery(literal_column("'simple'"), tsquery)
+    rank = func.greatest(
+        func.ts_rank(document, query), func.word_similarity(text, table.description)
+    )
+    importance = (
+        cast(table.importance, String) if kind == "expense" else cast(null(), String)
+    )
+    statement = (
+        select(
+            table.id,
+            literal(kind).label("kind"),
+            table.account_id,
+            models.Accounts.name.label("card_name"),
+            table.description,
+            table.amount,
+            importance.label("importance"),
+            table.created_at,
+            table.t_type,
+            type_table.name.label("type_name"),
+            rank.label("rank"),
+        )
+        .join(type_table, type_table.id == table.t_type)
+        .join(models.Accounts, models.Accounts.id == table.account_id)
+        .where(table.owner_id == owner_id)
+        .where(table.is_active == True)
+        .where(models.Accounts.is_active == True)
+        .where(or_(document.op("@@")(query), table.description.op("%>")(text)))
+    )
+    if filters["min_amount"] is not None:
+        statement = statement.where(table.amount >= filters["min_amount"])
+    if filters["max_amount"] is not None:
+        statement = statement.where(table.amount <= filters["max_amount"])
+    if filters["t_type"] is not None:
+        statement = statement.where(table.t_type == filters["t_type"])
+    if filters["importance"] is not None:
+        statement = statement.where(table.importance == filters["importance"])
+    return date_bounds(statement, table.created_at, filters["start"], filters["end"])
+
+
+def search_query(
+    owner_id: int,
+    text: str,
+    kind: Optional[str] = None,
+    t_type: Optional[int] = None,
+    importance: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = SEARCH_LIMIT,
+):
+    """
+    Select the best ``limit`` matches for ``text``, or None when it has no
+    words. ``kind`` ("income"/"expense") picks one table; ``t_type`` only
+    makes sense together with it and ``importance`` implies expenses.
+    """
+    tsquery = prefix_query(text)
+    if tsquery is None:
+        return None
+    if importance is not None:
+        kind = "expense"
+    filters = {
+        "t_type": t_type,
+        "importance": importance,
+        "min_amount": min_amount,
+        "max_amount": max_amount,
+        "start": start,
+        "end": end,
+    }
+    branches = []
+    if kind in (None, "income"):
+        branches.append(
+            _branch("income", models.Incomes, models.IncomeTypes, owner_id, text, tsquery, filters)
+        )
+    if kind in (None, "expense"):
+        branches.append(
+            _branch("expense", models.Expenses, models.ExpenseTypes, owner_id, text, tsquery, filters)
+        )
+    results = union_all(*branches).subquery("results")
+    return (
+        select(results)
+        .order_by(results.c.rank.desc(), results.c.created_at.desc())
+        .limit(limit)
+    )
@@ -0,0 +1,244 @@
+"""
+End-of-day balance of every card, one row per card and day it changed.
+
+``balance`` is the card balance at the end of ``day`` and ``net`` the day's
+change. Every ledger write adds its amount to the day of the transaction and
+to every later row of the card, so editing or deleting an old transaction
+corrects the history from that day on. The balance at any moment is then one
+row plus at most that day's transactions, whatever the card's age.
+``python snapshots.py backfill`` rebuilds the table from the transaction
+tables, walking back from the stored card balances.
+"""
+import sys
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import Date, case, cast, delete, func, insert, literal, select, text, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+
+def _end_of_day(account_id: int, day: date, fallback):
+    """
+    The card balance at the end of ``day``: the last row up to it, else the
+    balance before the first row after it, else ``fallback`` (no rows at all).
+    """
+    table = models.AccountDailyBalances
+    last = (
+        select(table.balance)
+        .where(table.account_id == account_id)
+        .where(table.day <= day)
+        .order_by(table.day.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    following = (
+        select(table.balance - table.net)
+        .where(table.account_id == account_id)
+        .where(table.day > day)
+        .order_by(table.day)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return func.coalesce(last, following, fallback)
+
+
+def closing_expression(account_id: int, day: date):
+    """``closing_balance`` as a scalar expression, for use inside a larger query."""
+    card = select(models.Accounts.balance).where(models.Accounts.id == account_id).scalar_subquery()
+    return _end_of_day(account_id, day, card)
+
+
+def record_statements(
+    account_id: int, owner_id: int, day: date, amount: float, pending: Optional[float] = None
+):
+    """
+    The statements adding ``amount`` to the card's balance from the end of
+    ``day`` on. ``pending`` is how much of the stored card balance is not
+    recorded here yet (default ``amount``); it only matters for the card's
+    first row.
+    """
+    table = models.AccountDailyBalances
+    if pending is None:
+        pending = amount
+    current = (
+        select(models.Accounts.balance - pending)
+        .where(models.Accounts.id == account_id)
+        .scalar_subquery()
+    )
+    opening = _end_of_day(account_id, day - timedelta(days=1), current)
+    yield (
+        pg_insert(table)
+        .values(account_id=account_id, day=day, owner_id=owner_id, net=0, balance=opening)
+        .on_conflict_do_nothing(index_elements=["account_id", "day"])
+    )
+    yield (
+        update(table)
+        .where(table.account_id == account_id)
+        .where(table.day >= day)
+        .values(
+            balance=table.balance + amount,
+            net=table.net + case((table.day == day, amount), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def record(
+    db: AsyncSession,
+    account_id: int,
+    owner_id: int,
+    day: date,
+    amount: float,
+    pending: Optional[float] = None,
+):
+    """
+    Add ``amount`` to the card's balance from the end of ``day`` on.
+
+    Call it after the card balance itself was updated, which also holds the
+    card's row lock so writers to one card cannot interleave here.
+    """
+    if amount == 0:
+        return
+    for statement in record_statements(account_id, owner_id, day, amount, pending):
+        await db.execute(statement)
+
+
+class DailyDeltas:
+    """
+    Collects per-day balance changes for bulk writers, like ``RollupTotals``,
+    and records them after the caller applied their sum to the card balance.
+    """
+
+    def __init__(self):
+        self.days = {}
+
+    def add(self, row: dict, amount: float):
+        key = (row["account_id"], row["owner_id"], row["created_at"].date())
+        self.days[key] = self.days.get(key, 0.0) + amount
+
+    async def flush(self, db: AsyncSession):
+        pending = {}
+        for (account_id, _, _), amount in self.days.items():
+            pending[account_id] = pending.get(account_id, 0.0) + amount
+        for (account_id, owner_id, day), amount in sorted(self.days.items()):
+            await record(db, account_id, owner_id, day, amount, pending[account_id])
+            pending[account_id] -= amount
+        self.days.clear()
+
+
+def _signed_rows(account_id: int, owner_id: int, since: datetime, until: datetime):
+    """The card's active rows from ``since`` up to ``until``, bounded in each branch for pruning."""
+    branches = []
+    for table, signed in (
+        (models.Incomes, models.Incomes.amount),
+        (models.Expenses, -models.Expenses.amount),
+    ):
+        branches.append(
+            select(table.created_at, signed.label("signed"))
+            .where(table.owner_id == owner_id)
+            .where(table.account_id == account_id)
+            .where(table.is_active == True)
+            .where(table.created_at >= since)
+            .where(table.created_at <= until)
+        )
+    return union_all(*branches).subquery("signed_rows")
+
+
+async def balance_at(
+    db: AsyncSession, account_id: int, owner_id: int, moment: datetime
+) -> Optional[float]:
+    """
+    The card balance right after ``moment``, or None when the card does not
+    belong to ``owner_id``: the previous day's closing balance plus the
+    transactions of ``moment``'s day up to it.
+    """
+    card = await db.scalar(
+        select(models.Accounts.balance)
+        .where(models.Accounts.id == account_id)
+        .where(models.Accounts.owner_id == owner_id)
+    )
+    if card is None:
+        return None
+    day = moment.date()
+    opening = await db.scalar(select(_end_of_day(account_id, day - timedelta(days=1), card)))
+    rows = _signed_rows(account_id, owner_id, datetime.combine(day, time.min), moment)
+    today = await db.scalar(select(func.coalesce(func.sum(rows.c.signed), 0)))
+    return opening + today
+
+
+async def closing_balance(
+    db: AsyncSession, account_id: int, owner_id: int, day: date
+) -> Optional[float]:
+    """The card balance at the end of ``day``, or None when the card is not ``owner_id``'s."""
+    card = await db.scalar(
+        select(models.Accounts.balance)
+        .where(models.Accounts.id == account_id)
+        .where(models.Accounts.owner_id == owner_id)
+    )
+    if card is None:
+        return None
+    return await db.scalar(select(_end_of_day(account_id, day, card)))
+
+
+def history_listing(account_id: int, owner_id: int, start: date, end: date):
+    """The card's days with a balance change between ``start`` and ``end``, oldest first."""
+    table = models.AccountDailyBalances
+    return (
+        select(table.day, table.net, table.balance)
+        .where(table.account_id == account_id)
+        .where(table.owner_id == owner_id)
+        .where(table.day >= start)
+        .where(table.day <= end)
+        .order_by(table.day)
+    )
+
+
+def _rebuild_statements():
+    table = models.AccountDailyBalances
+    signed = union_all(
+        select(models.Incomes.account_id, models.Incomes.created_at, models.Incomes.amount.label("signed"))
+        .where(models.Incomes.is_active == True),
+        select(models.Expenses.account_id, models.Expenses.created_at, (-models.Expenses.amount).label("signed"))
+        .where(models.Expenses.is_active == True),
+    ).subquery("signed")
+    day = cast(signed.c.created_at, Date)
+    days = (
+        select(signed.c.account_id, day.label("day"), func.sum(signed.c.signed).label("net"))
+        .group_by(signed.c.account_id, day)
+        .subquery("days")
+    )
+    # everything after the day, which the stored balance already includes
+    later = func.sum(days.c.net).over(
+        partition_by=days.c.account_id, order_by=days.c.day.desc(), rows=(None, -1)
+    )
+    query = select(
+        days.c.account_id,
+        days.c.day,
+        models.Accounts.owner_id,
+        days.c.net,
+        models.Accounts.balance - func.coalesce(later, literal(0)),
+    ).join(models.Accounts, models.Accounts.id == days.c.account_id)
+    yield delete(table)
+    yield insert(table).from_select(["account_id", "day", "owner_id", "net", "balance"], query)
+
+
+def backfill(engine):
+    """
+    Rebuild the table in one transaction, with the card and transaction
+    tables locked against writes so no change is lost or counted twice.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE accounts, incomes, expenses IN SHARE MODE"))
+        for statement in _rebuild_statements():
+            conn.execute(statement)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        raise SystemExit("usage: python snapshots.py backfill")
+    from database import get_engine
+
+    backfill(get_engine())
@@ -0,0 +1,39 @@
+"""
+The one Jinja environment every router renders with.
+
+Compiled templates are kept in a filesystem bytecode cache so a new worker
+process loads them instead of parsing the sources again, and
+``precompile_templates`` compiles everything once at startup so the first
+request to each page does not pay for it. Templates are only re-checked on
+disk when ``TEMPLATE_AUTO_RELOAD`` is set, which is what you want while
+editing them locally.
+"""
+import os
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+
+from assets import asset_url
+
+TEMPLATE_DIR = "templates"
+# None lets jinja pick a private directory under the system temp dir
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR")
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() in ("1", "true", "yes")
+
+templates = Jinja2Templates(
+    directory=TEMPLATE_DIR,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+)
+templates.env.globals["asset_url"] = asset_url
+
+
+def precompile_templates() -> int:
+    """Load every template into the environment's cache; returns how many."""
+    if TEMPLATE_CACHE_DIR:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    env = templates.env
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)